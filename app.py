@@ -1,31 +1,148 @@
 from __future__ import annotations
 
+import argparse
+import hmac
+import json
 import os
 import sys
-from typing import List, Union
+from typing import Iterator
 
 import geopandas as gpd
-from flask import Flask, request, send_file, Response
-from geopandas import GeoDataFrame
-from shapely.geometry import LineString, Point
-from waitress import serve as waitress_serve
+from flask import Flask, request, send_file, Response, stream_with_context, g
 
 # This next line would disable the warning when the built-in flask server is started on the local machine:
 # os.environ["FLASK_ENV"] = "development"
-from util.parse_request_parameters import parse_request_parameters, URL_Parameter_Parse_Exception
-from util.sample_linestring import sample_linestring
-from util.serialise_output_geometry import serialise_output_geometry, Serialise_Results_Exception
+from util.network_snapshot import open_road_network
+from util.parse_request_parameters import parse_request_parameters, parse_output_parameters, parse_reverse_request_parameters, parse_reverse_filter_parameters, URL_Parameter_Parse_Exception
+from util.read_bulk_rows import read_bulk_rows
+from util.request_metrics import Request_Metrics, Request_Timer, Slow_Request_Log, start_request_timer, finish_request_timer, current_request_timer, time_stage, count_request_metric, record_request_error
+from util.road_network import Road_Network
+from util.road_network_reloader import Road_Network_Reloader
+from util.response_cache import Response_Cache, response_cache_key, response_etag, etag_matches
+from util.road_network_index import REQUEST_CARRIAGEWAY_BITMASK
+from util.road_network_tiles import write_road_network_tile, write_slice_result_tile, check_tile_coordinates, Vector_Tile_Exception, VECTOR_TILE_CONTENT_TYPE, MAX_TILE_ZOOM, ROAD_NETWORK_TILE_LAYER, SLICE_RESULT_TILE_LAYER
+from util.sample_linestring_batch import sample_linestring_batch, Slice_Network_Exception
+from util.serialise_output_geometry import serialise_batch_result, serialise_part_features, Serialise_Results_Exception, OUTPUT_CONTENT_TYPES, PART_FEATURE_OUTPUT_TYPES
+from util.serve_workers import serve_workers
+from util.stream_bulk_features import stream_bulk_features, stream_bulk_flatgeobuf, BULK_OUTPUT_TYPES
+from util.stream_reverse_features import stream_reverse_features, REVERSE_ROW_COLUMNS, REVERSE_ROW_REQUIRED_COLUMNS, ERROR_SUGGEST_CORRECT_REVERSE_BULK
+from util.tile_cache import Tile_Cache
 
 app = Flask(__name__)
 
 # This data is publicly available as a GeoJSON file from https://catalogue.data.wa.gov.au/dataset/mrwa-road-network
-path_to_gdb = r"data.gdb"
-gdf_all_roads: gpd.GeoDataFrame = gpd.read_file(
+# Both paths can be overridden with environment variables, which is how the benchmarks load a synthetic network. See benchmark/
+path_to_gdb = os.environ.get("ROAD_NETWORK_SOURCE", r"data.gdb")
+# The columns of the network used by this server are compiled into a snapshot which is memory-mapped at startup.
+# It is recompiled automatically whenever data.gdb changes. See util/network_snapshot.py
+path_to_snapshot = os.environ.get("ROAD_NETWORK_SNAPSHOT", r"data.snapshot")
+# The layer of data.gdb to load. It can be overridden with the ROAD_NETWORK_LAYER environment variable or --layer
+road_network_layer = os.environ.get("ROAD_NETWORK_LAYER") or "NTWK_IRIS_Road_Network_20201029"
+if __name__ == '__main__':
+	# --layer is read now rather than with the other arguments at the end of this file, so that the network is only loaded (or compiled) once
+	layer_argument_parser = argparse.ArgumentParser(add_help=False)
+	layer_argument_parser.add_argument("--layer", default=road_network_layer)
+	road_network_layer = layer_argument_parser.parse_known_args()[0].layer
+road_network: Road_Network = open_road_network(
 	path_to_gdb,
-	layer="NTWK_IRIS_Road_Network_20201029"
+	layer=road_network_layer,
+	snapshot_path=path_to_snapshot
+)
+print(road_network.memory_report())
+
+# Responses are cached by their normalised slice requests. Each worker process has its own cache.
+RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Clients may keep responses but must check with the server (using the ETag) before reusing them.
+RESPONSE_CACHE_CONTROL = "public, no-cache"
+response_cache = Response_Cache(RESPONSE_CACHE_MAX_BYTES)
+
+# Map tiles served from /tiles/ are cached in memory by each worker process. Tiles of the road network are also written to TILE_CACHE_DIRECTORY,
+# which is shared by every worker process. Set it to an empty string to keep tiles in memory only.
+TILE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+tile_cache = Tile_Cache(TILE_CACHE_MAX_BYTES, os.environ.get("TILE_CACHE_DIRECTORY", r"data.tiles") or None)
+# tiles left on disk from older versions of the network will never be used again
+tile_cache.remove_old_versions(keep_network_version=road_network.version)
+
+
+def swap_road_network(new_road_network: Road_Network) -> None:
+	global road_network
+	road_network = new_road_network
+	print(road_network.memory_report())
+	# Cached responses are keyed by the network version, so those of the old network will never be used again.
+	# Tiles of the old version are left on disk, since other worker processes may still be serving it. They are removed at the next startup.
+	response_cache.clear()
+	tile_cache.clear()
+
+
+# A new release of the network is loaded in the background and then swapped in, either when POST /admin/reload/ is requested
+# or when the watcher finds that data.gdb or the snapshot has changed. See util/road_network_reloader.py
+road_network_reloader = Road_Network_Reloader(road_network, path_to_gdb, road_network_layer, path_to_snapshot, on_reload=swap_road_network)
+# The watcher checks for changes this often. It is started by the first request each worker process handles,
+# because threads started before serve_workers() forks the workers would not run in them. See also --watch-seconds
+road_network_watch_seconds = float(os.environ["ROAD_NETWORK_WATCH_SECONDS"]) if os.environ.get("ROAD_NETWORK_WATCH_SECONDS") else None
+# POST /admin/reload/ must be sent with this token in the X-Reload-Token header. Reloading by request is disabled if it is not set.
+road_network_reload_token = os.environ.get("ROAD_NETWORK_RELOAD_TOKEN") or None
+
+# Per-stage timings of every request are served from /metrics. Each worker process has its own totals.
+request_metrics = Request_Metrics()
+# Requests slower than SLOW_REQUEST_SECONDS are logged with their full query. See also the --slow-request-seconds and --slow-request-log options
+slow_request_log = Slow_Request_Log(
+	float(os.environ["SLOW_REQUEST_SECONDS"]) if os.environ.get("SLOW_REQUEST_SECONDS") else None,
+	os.environ.get("SLOW_REQUEST_LOG")
 )
 
 
+@app.before_request
+def before_request_start_timer():
+	start_request_timer()
+
+
+@app.before_request
+def before_request_use_current_road_network():
+	# The whole request uses the network which was current when it started, even if a reload swaps in a new one before it finishes
+	g.road_network = road_network
+	if road_network_watch_seconds is not None:
+		road_network_reloader.start_watching(road_network_watch_seconds)
+
+
+@app.after_request
+def after_request_add_road_network_version(response: Response) -> Response:
+	if "road_network" in g:
+		response.headers["X-Road-Network-Version"] = g.road_network.version
+	return response
+
+
+@app.after_request
+def after_request_record_metrics(response: Response) -> Response:
+	request_timer = current_request_timer()
+	if request_timer is None:
+		return response
+	if not response.is_streamed and response.content_length is not None:
+		count_request_metric("response_bytes", response.content_length)
+	finish_request_timer(request_timer)
+	response.headers["Server-Timing"] = request_timer.server_timing()
+	record_finished_request(response.status_code, request_timer)
+	return response
+
+
+@app.teardown_request
+def teardown_request_timer(exception):
+	# The timer is still running only when the route raised an exception, since after_request() did not run
+	request_timer = current_request_timer()
+	if request_timer is None:
+		return
+	if request_timer.error is None:
+		record_request_error("unknown")
+	finish_request_timer(request_timer)
+	record_finished_request(500, request_timer)
+
+
+def record_finished_request(status: int, request_timer: Request_Timer) -> None:
+	route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+	request_metrics.observe(route, status, request_timer)
+	slow_request_log.record(request.full_path, status, request_timer)
+
+
 @app.route('/secrets/')
 def route_handle_get_secrets():
 	try:
@@ -42,39 +159,57 @@ def route_handle_get():
 	if request.args.get("show", default=None) is not None:
 		return send_file('static_show/map.html')
 	
-	# noinspection PyTypeChecker
-	# request_output_type: Literal["WKT", "GEOJSON"] = "WKT" if request.args.get("wkt", default=None) is not None else "GEOJSON"
-	request_output_type = "WKT" if request.args.get("wkt", default=None) is not None else "GEOJSON"
-	
 	try:
-		slice_requests = parse_request_parameters(request)
+		with time_stage("parse"):
+			slice_requests = parse_request_parameters(request)
+			request_output_type, request_merge, request_precision = parse_output_parameters(request)
 	except URL_Parameter_Parse_Exception as e:
+		record_request_error("parse")
 		return Response(e.message, status=400)
 	except Exception:
+		record_request_error("unknown")
 		return Response("error: Unknown server error while trying to parse URL parameters.", status=500)
 	
+	current_request_timer().output_type = request_output_type
+	# GeoJSON and WKT responses keep the default (text/html) content type that Excel and PowerBI have always been given
+	response_mimetype = OUTPUT_CONTENT_TYPES.get(request_output_type)
+	
+	with time_stage("cache"):
+		cache_key = response_cache_key(g.road_network.version, slice_requests, (request_output_type, request_merge, request_precision))
+		cache_headers = {"ETag": f'"{response_etag(cache_key)}"', "Cache-Control": RESPONSE_CACHE_CONTROL}
+		if etag_matches(request.if_none_match, response_etag(cache_key)):
+			return Response(status=304, headers=cache_headers)
+		
+		cached_response = response_cache.get(cache_key)
+		if cached_response is not None:
+			return Response(cached_response, headers={**cache_headers, "X-Cache": "HIT"}, mimetype=response_mimetype)
+	
 	try:
-		slice_results: List[Union[Point, LineString]] = []
-		for slice_request in slice_requests:
-			road_segment_rows = filter_dataframe(gdf_all_roads, slice_request.road, slice_request.slk_from, slice_request.slk_to, slice_request.cway)
-			slice_results.extend(
-				sample_linestring(
-					road_segment_rows,
-					slk_cut_first=slice_request.slk_from,
-					slk_cut_second=slice_request.slk_to,
-					offset_metres=slice_request.offset
-				)
-			)
-		if len(slice_results) == 0:
+		with time_stage("slice"):
+			batch_result = sample_linestring_batch(slice_requests, g.road_network)
+		if len(batch_result.request_number) == 0:
 			raise Slice_Network_Exception("Valid user parameters produced no resulting geometry. Are the SLK bounds within the extent of the road?")
+		count_request_metric("output_vertices", len(batch_result.coordinates))
 		
-		return Response(serialise_output_geometry(slice_results, request_output_type))  # , mimetype="application/json")
+		with time_stage("serialise"):
+			if request_merge == "none" and request_output_type in PART_FEATURE_OUTPUT_TYPES and any(item.interval is not None for item in slice_requests):
+				# each sample point is its own feature, so that it can carry its slk
+				response_body = serialise_part_features(batch_result, slice_requests, g.road_network.carriageway[batch_result.row_position], request_output_type, request_precision)
+			else:
+				response_body = serialise_batch_result(batch_result, request_output_type, request_merge, request_precision)
+			if isinstance(response_body, str):
+				response_body = response_body.encode("utf-8")
+		response_cache.put(cache_key, response_body)
+		return Response(response_body, headers={**cache_headers, "X-Cache": "MISS"}, mimetype=response_mimetype)
 	
 	except Slice_Network_Exception as slice_network_exception:
+		record_request_error("slice")
 		return Response(f"error: unable to slice network with the provided parameters: {slice_network_exception.message}", status=400)
 	except Serialise_Results_Exception as serialise_results_exception:
+		record_request_error("serialise")
 		return Response(f"error: unable to serialise results with the provided parameters: {serialise_results_exception.message}", status=400)
 	except Exception as e:
+		record_request_error("unknown")
 		exc_type, exc_obj, exc_tb = sys.exc_info()
 		file_name = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
 		print(exc_type, file_name, exc_tb.tb_lineno)
@@ -83,37 +218,206 @@ def route_handle_get():
 		return Response(f"error: Unknown error. ", status=500)
 
 
-class Slice_Network_Exception(Exception):
-	def __init__(self, message):
-		super().__init__(message)
-		self.message = message
-
-
-def filter_dataframe(all_road_segments: GeoDataFrame, road: str, request_slk_from: float, request_slk_to: float, carriageway: str) -> gpd.GeoDataFrame:
-	result = all_road_segments[
-		(all_road_segments["ROAD"] == road.strip().upper()) & (all_road_segments["START_SLK"] <= request_slk_to) & (all_road_segments["END_SLK"] >= request_slk_from)
-	]
-	
-	if carriageway == "LS":
-		result = result[(result["CWY"] == "Left") | (result["CWY"] == "Single")]
-	elif carriageway == "RS":
-		result = result[(result["CWY"] == "Right") | (result["CWY"] == "Single")]
-	elif carriageway == "LR":
-		result = result[(result["CWY"] == "Right") | (result["CWY"] == "Left")]
-	elif carriageway == "R":
-		result = result[result["CWY"] == "Right"]
-	elif carriageway == "L":
-		result = result[result["CWY"] == "Left"]
-	elif carriageway == "S":
-		result = result[result["CWY"] == "Single"]
-	elif carriageway == "LRS":
-		pass
+@app.route('/tiles/<int:zoom>/<int:x>/<int:y>.mvt')
+def route_handle_get_tile(zoom: int, x: int, y: int):
+	# A Mapbox vector tile of the road network, or of the result of a slice query if the url has the same `road`, `slk_from`, `slk_to` (etc) parameters as `/`.
+	# See util/road_network_tiles.py
+	try:
+		with time_stage("parse"):
+			check_tile_coordinates(zoom, x, y)
+			slice_requests = parse_request_parameters(request) if "road" in request.args else None
+	except (URL_Parameter_Parse_Exception, Vector_Tile_Exception) as e:
+		record_request_error("parse")
+		return Response(e.message, status=400)
+	
+	current_request_timer().output_type = "MVT"
+	
+	with time_stage("cache"):
+		query_key = response_cache_key(g.road_network.version, slice_requests, "MVT") if slice_requests is not None else None
+		tile_etag = response_etag((g.road_network.version, query_key, zoom, x, y))
+		cache_headers = {"ETag": f'"{tile_etag}"', "Cache-Control": RESPONSE_CACHE_CONTROL}
+		if etag_matches(request.if_none_match, tile_etag):
+			return Response(status=304, headers=cache_headers)
+		
+		cached_tile = tile_cache.get(g.road_network.version, zoom, x, y, query_key)
+		if cached_tile is not None:
+			return Response(cached_tile, headers={**cache_headers, "X-Cache": "HIT"}, mimetype=VECTOR_TILE_CONTENT_TYPE)
+	
+	try:
+		if slice_requests is None:
+			with time_stage("serialise"):
+				tile = write_road_network_tile(g.road_network, zoom, x, y)
+		else:
+			with time_stage("slice"):
+				batch_result = sample_linestring_batch(slice_requests, g.road_network)
+			with time_stage("serialise"):
+				tile = write_slice_result_tile(batch_result, slice_requests, zoom, x, y)
+	except Slice_Network_Exception as slice_network_exception:
+		record_request_error("slice")
+		return Response(f"error: unable to slice network with the provided parameters: {slice_network_exception.message}", status=400)
+	
+	tile_cache.put(g.road_network.version, zoom, x, y, tile, query_key)
+	return Response(tile, headers={**cache_headers, "X-Cache": "MISS"}, mimetype=VECTOR_TILE_CONTENT_TYPE)
+
+
+@app.route('/tiles/tilejson.json')
+def route_handle_get_tilejson():
+	# Describes the tiles served by /tiles/ (see https://github.com/mapbox/tilejson-spec), including the bounds of the road network,
+	# or of the result of the slice query in the url parameters. `?show` uses the bounds to zoom the map to the result.
+	try:
+		slice_requests = parse_request_parameters(request) if "road" in request.args else None
+	except URL_Parameter_Parse_Exception as e:
+		record_request_error("parse")
+		return Response(e.message, status=400)
+	
+	if slice_requests is None:
+		coordinates = g.road_network.geometry.coordinates
+		query_string = ""
+		layer = {"id": ROAD_NETWORK_TILE_LAYER, "fields": {"ROAD": "String", "CWY": "String", "START_SLK": "Number", "END_SLK": "Number"}}
 	else:
+		try:
+			with time_stage("slice"):
+				batch_result = sample_linestring_batch(slice_requests, g.road_network)
+			if len(batch_result.request_number) == 0:
+				raise Slice_Network_Exception("Valid user parameters produced no resulting geometry. Are the SLK bounds within the extent of the road?")
+		except Slice_Network_Exception as slice_network_exception:
+			record_request_error("slice")
+			return Response(f"error: unable to slice network with the provided parameters: {slice_network_exception.message}", status=400)
+		coordinates = batch_result.coordinates
+		query_string = "?" + request.query_string.decode("utf-8")
+		layer = {"id": SLICE_RESULT_TILE_LAYER, "fields": {"road": "String", "slk_from": "Number", "slk_to": "Number", "offset": "Number", "cway": "String"}}
+	
+	tilejson = {
+		"tilejson": "3.0.0",
+		"tiles": [request.url_root + "tiles/{z}/{x}/{y}.mvt" + query_string],
+		"minzoom": 0,
+		"maxzoom": MAX_TILE_ZOOM,
+		"vector_layers": [layer],
+	}
+	if len(coordinates) > 0:
+		tilejson["bounds"] = [*coordinates.min(axis=0).tolist(), *coordinates.max(axis=0).tolist()]
+	return Response(json.dumps(tilejson), mimetype="application/json")
+
+
+@app.route('/cache/')
+def route_handle_get_cache_stats():
+	return Response(json.dumps(response_cache.stats()), mimetype="application/json")
+
+
+@app.route('/admin/reload/', methods=['GET', 'POST'])
+def route_handle_admin_reload():
+	# GET responds with the version of the network being served and the state of the last reload.
+	# POST starts loading a new release in the background. The `layer` url parameter loads a different layer, and `wait` responds only once the reload has finished.
+	# Each request reloads only the worker process which answers it. The other workers load the new snapshot when their watcher next checks (see --watch-seconds).
+	if road_network_reload_token is None:
+		return Response("error: reloading is disabled. Set the ROAD_NETWORK_RELOAD_TOKEN environment variable to enable it.", status=403)
+	if not hmac.compare_digest(request.headers.get("X-Reload-Token", default="").encode("utf-8"), road_network_reload_token.encode("utf-8")):
+		return Response("error: missing or incorrect X-Reload-Token header.", status=403)
+	
+	status = 200
+	if request.method == "POST":
+		wait = request.args.get("wait", default=None) is not None
+		if not road_network_reloader.reload(layer=request.args.get("layer", default=None), wait=wait):
+			status = 409
+		elif not wait:
+			status = 202
+		elif road_network_reloader.last_error is not None:
+			status = 500
+	return Response(json.dumps(road_network_reloader.status()), status=status, mimetype="application/json")
+
+
+@app.route('/metrics')
+def route_handle_get_metrics():
+	# Prometheus text format. Only covers requests served by the worker process which answers this request.
+	return Response(request_metrics.exposition(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route('/bulk/', methods=['POST'])
+def route_handle_post_bulk():
+	# Slices every row of a JSON array or CSV request body. See read_bulk_rows()
+	# Responds with a GeoJSON FeatureCollection, or with newline delimited GeoJSON Features if the `ndjson` url parameter is present,
+	# or with a FlatGeobuf file if the `format=flatgeobuf` url parameter is present.
+	output_ndjson = request.args.get("ndjson", default=None) is not None
+	
+	try:
+		request_output_type, request_merge, request_precision = parse_output_parameters(request)
+		if request_output_type not in BULK_OUTPUT_TYPES:
+			raise URL_Parameter_Parse_Exception(f"error: /bulk/ can only respond with {' or '.join(item.lower() for item in BULK_OUTPUT_TYPES)}. eg /bulk/?format=flatgeobuf")
+		bulk_rows = read_bulk_rows(request)
+	except URL_Parameter_Parse_Exception as e:
+		record_request_error("parse")
+		return Response(e.message, status=400)
+	
+	if request_output_type == "FLATGEOBUF":
+		flatgeobuf = stream_bulk_flatgeobuf(bulk_rows, g.road_network, merge=request_merge, precision=request_precision)
+		return Response(stream_with_context(flatgeobuf), mimetype=OUTPUT_CONTENT_TYPES["FLATGEOBUF"])
+	
+	features = stream_bulk_features(bulk_rows, g.road_network, merge=request_merge, precision=request_precision)
+	return feature_collection_response(features, output_ndjson)
+
+
+@app.route('/reverse/', methods=['GET', 'POST'])
+def route_handle_reverse():
+	# Finds the nearest road, cway, slk and offset for each point. See reverse_geocode()
+	# Points are read from the `lat` and `lon` url parameters of a GET request, or from the JSON array or CSV body of a POST request (like /bulk/).
+	# The `road`, `cway` and `radius` url parameters limit the search for every point.
+	output_ndjson = request.args.get("ndjson", default=None) is not None
+	
+	try:
+		reverse_filter = parse_reverse_filter_parameters(request)
+		if request.method == "POST":
+			reverse_rows = read_bulk_rows(request, REVERSE_ROW_COLUMNS, REVERSE_ROW_REQUIRED_COLUMNS, ERROR_SUGGEST_CORRECT_REVERSE_BULK)
+		else:
+			reverse_rows = [
+				{"id": row_number, "lat": item.lat, "lon": item.lon}
+				for row_number, item in enumerate(parse_reverse_request_parameters(request))
+			]
+	except URL_Parameter_Parse_Exception as e:
+		record_request_error("parse")
+		return Response(e.message, status=400)
+	
+	features = stream_reverse_features(reverse_rows, g.road_network, reverse_filter)
+	return feature_collection_response(features, output_ndjson)
+
+
+def feature_collection_response(features: Iterator[str], output_ndjson: bool) -> Response:
+	# Streams serialised features as a GeoJSON FeatureCollection, or as newline delimited GeoJSON Features
+	if output_ndjson:
+		return Response(stream_with_context(feature + "\n" for feature in features), mimetype="application/x-ndjson")
+	
+	def generate_feature_collection():
+		yield '{"type":"FeatureCollection","features":['
+		for feature_number, feature in enumerate(features):
+			yield feature if feature_number == 0 else "," + feature
+		yield ']}'
+	
+	return Response(stream_with_context(generate_feature_collection()), mimetype="application/geo+json")
+
+
+# No longer used by the routes, which slice with sample_linestring_batch(). Kept as the row lookup for the original sample_linestring(),
+# which the benchmarks compare against (see benchmark/micro_benchmarks.py)
+def filter_dataframe(road_network: Road_Network, road: str, request_slk_from: float, request_slk_to: float, carriageway: str) -> gpd.GeoDataFrame:
+	carriageway_mask = REQUEST_CARRIAGEWAY_BITMASK.get(carriageway)
+	if carriageway_mask is None:
 		raise Slice_Network_Exception(f"Invalid carriageway parameter: {carriageway}. Must be any combination of the three letters 'L', 'R' and 'S'. eg &cwy=LR or &cwy=RL or &cwy=S. omit the parameter to query all.")
 	
-	return result
+	return road_network.rows(road_network.index.lookup(road, request_slk_from, request_slk_to, carriageway_mask))
 
 
 if __name__ == '__main__':
+	argument_parser = argparse.ArgumentParser(description="Serve the linear referencing geocoding server.")
+	argument_parser.add_argument("--host", default="0.0.0.0")
+	argument_parser.add_argument("--port", type=int, default=8001)
+	argument_parser.add_argument("--workers", type=int, default=1, help="number of worker processes. They share one copy of the road network.")
+	argument_parser.add_argument("--threads", type=int, default=4, help="number of threads in each worker process")
+	argument_parser.add_argument("--slow-request-seconds", type=float, default=slow_request_log.threshold_seconds, help="log the full query and stage timings of requests slower than this")
+	argument_parser.add_argument("--slow-request-log", default=slow_request_log.path, help="append slow requests to this file instead of printing them")
+	argument_parser.add_argument("--layer", default=road_network_reloader.layer, help="layer of the road network source to load")
+	argument_parser.add_argument("--watch-seconds", type=float, default=road_network_watch_seconds, help="check the road network source for a new release this often, and reload it when it changes")
+	# --layer has already been used to load the network. See road_network_layer above
+	arguments = argument_parser.parse_args()
+	road_network_watch_seconds = arguments.watch_seconds
+	slow_request_log.threshold_seconds = arguments.slow_request_seconds
+	slow_request_log.path = arguments.slow_request_log
 	# app.run(host='0.0.0.0', port=8001)
-	waitress_serve(app, host='0.0.0.0', port=8001)
+	serve_workers(app, host=arguments.host, port=arguments.port, workers=arguments.workers, threads=arguments.threads)
@@ -0,0 +1,172 @@
+"""
+An asyncio (ASGI) entry point which serves the same routes as app.py, for when many identical requests arrive at once
+(eg when a PowerBI report opens and each visual sends the same `?road=...` query).
+
+Each request is handled by the flask app on a bounded pool of threads (see Coalescing_Executor) so the event loop is never blocked by slicing.
+Slice requests to `/` which normalise to the same response cache key while an identical request is still being computed wait for and share its response.
+When all threads are busy and `--max-queued` requests are already waiting, further requests are refused at once with 503 and a Retry-After header.
+
+Run with
+	python asgi_app.py --port 8001
+or with any ASGI server, eg
+	uvicorn asgi_app:application --port 8001
+
+Responses are sent once they are complete, so /bulk/ and /reverse/ responses are not streamed as they are by app.py.
+"""
+import argparse
+import io
+import os
+import sys
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from werkzeug.wrappers import Request
+
+import app as flask_app_module
+from util.coalescing_executor import Coalescing_Executor, Executor_Full_Exception
+from util.parse_request_parameters import parse_request_parameters, parse_output_parameters, URL_Parameter_Parse_Exception
+from util.response_cache import response_cache_key
+
+# Clients refused because the server is busy are asked to try again after this many seconds
+BUSY_RETRY_AFTER_SECONDS = 1
+
+slice_executor = Coalescing_Executor(
+	threads=int(os.environ.get("ASGI_THREADS", 4)),
+	max_queued=int(os.environ.get("ASGI_MAX_QUEUED", 64))
+)
+
+# (status code, headers, body) of a response from the flask app
+Wsgi_Response = Tuple[int, List[Tuple[bytes, bytes]], bytes]
+
+
+async def application(scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+	if scope["type"] == "lifespan":
+		await _handle_lifespan(receive, send)
+		return
+	if scope["type"] != "http":
+		# eg websocket. No route of this server accepts them
+		raise ValueError(f"ASGI scope type {scope['type']!r} is not served. Only 'http' and 'lifespan' are.")
+
+	request_body = bytearray()
+	while True:
+		message = await receive()
+		if message["type"] == "http.disconnect":
+			return
+		request_body += message.get("body", b"")
+		if not message.get("more_body", False):
+			break
+
+	environ = _wsgi_environ(scope, bytes(request_body))
+	try:
+		status, headers, response_body = await slice_executor.run(coalescing_key(environ), _call_flask_app, environ)
+	except Executor_Full_Exception:
+		status = 503
+		headers = [(b"content-type", b"text/plain; charset=utf-8"), (b"retry-after", str(BUSY_RETRY_AFTER_SECONDS).encode("latin-1"))]
+		response_body = b"error: The server is busy. Please try again shortly."
+
+	await send({"type": "http.response.start", "status": status, "headers": headers})
+	await send({"type": "http.response.body", "body": response_body})
+
+
+def coalescing_key(environ: Dict[str, Any]) -> Optional[Hashable]:
+	"""
+	Requests with the same key get the same response, and are computed once when they arrive together.
+	:return: the response cache key of a valid slice request to `/`, or None for any other request
+	"""
+	if environ["REQUEST_METHOD"] != "GET" or environ["PATH_INFO"] != "/":
+		return None
+	request = Request(environ)
+	if not request.args or request.args.get("show", default=None) is not None:
+		return None
+	try:
+		slice_requests = parse_request_parameters(request)
+		request_output_type, request_merge, request_precision = parse_output_parameters(request)
+	except URL_Parameter_Parse_Exception:
+		# the flask app will respond with the error
+		return None
+	cache_key = response_cache_key(flask_app_module.road_network.version, slice_requests, (request_output_type, request_merge, request_precision))
+	# The If-None-Match header decides between a 304 and a 200 response
+	return cache_key, environ.get("HTTP_IF_NONE_MATCH")
+
+
+def _call_flask_app(environ: Dict[str, Any]) -> Wsgi_Response:
+	response_start = []
+	response_body_parts = []
+
+	def start_response(status: str, response_headers: List[Tuple[str, str]], exc_info=None):
+		response_start[:] = [status, response_headers]
+		return response_body_parts.append
+
+	response_iterable = flask_app_module.app(environ, start_response)
+	try:
+		response_body_parts.extend(response_iterable)
+	finally:
+		if hasattr(response_iterable, "close"):
+			response_iterable.close()
+
+	status, response_headers = response_start
+	return (
+		int(status.split(" ", 1)[0]),
+		[(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in response_headers],
+		b"".join(response_body_parts)
+	)
+
+
+def _wsgi_environ(scope: Dict[str, Any], request_body: bytes) -> Dict[str, Any]:
+	server_host, server_port = scope.get("server") or ("localhost", 80)
+	environ = {
+		"REQUEST_METHOD": scope["method"],
+		"SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+		"PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+		"QUERY_STRING": scope["query_string"].decode("latin-1"),
+		"SERVER_NAME": server_host,
+		"SERVER_PORT": str(server_port),
+		"SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+		"CONTENT_LENGTH": str(len(request_body)),
+		"wsgi.version": (1, 0),
+		"wsgi.url_scheme": scope.get("scheme", "http"),
+		"wsgi.input": io.BytesIO(request_body),
+		"wsgi.errors": sys.stderr,
+		"wsgi.multithread": True,
+		"wsgi.multiprocess": False,
+		"wsgi.run_once": False,
+	}
+	if scope.get("client"):
+		environ["REMOTE_ADDR"], environ["REMOTE_PORT"] = scope["client"][0], str(scope["client"][1])
+	for name, value in scope["headers"]:
+		name = name.decode("latin-1").upper().replace("-", "_")
+		value = value.decode("latin-1")
+		if name == "CONTENT_TYPE":
+			environ["CONTENT_TYPE"] = value
+		elif name != "CONTENT_LENGTH":
+			name = "HTTP_" + name
+			environ[name] = environ[name] + "," + value if name in environ else value
+	return environ
+
+
+async def _handle_lifespan(receive: Callable, send: Callable) -> None:
+	while True:
+		message = await receive()
+		if message["type"] == "lifespan.startup":
+			await send({"type": "lifespan.startup.complete"})
+		elif message["type"] == "lifespan.shutdown":
+			slice_executor.shutdown()
+			await send({"type": "lifespan.shutdown.complete"})
+			return
+
+
+if __name__ == '__main__':
+	argument_parser = argparse.ArgumentParser(description="Serve the linear referencing geocoding server from an asyncio event loop. Requires uvicorn.")
+	argument_parser.add_argument("--host", default="0.0.0.0")
+	argument_parser.add_argument("--port", type=int, default=8001)
+	argument_parser.add_argument("--threads", type=int, default=slice_executor.threads, help="number of threads which handle requests")
+	argument_parser.add_argument("--max-queued", type=int, default=slice_executor.max_queued, help="number of requests which may wait for a thread before further requests are refused with 503")
+	arguments = argument_parser.parse_args()
+	try:
+		import uvicorn
+	except ImportError:
+		print("The asyncio entry point needs an ASGI server. Install one with `pip install uvicorn`, or serve asgi_app:application with another ASGI server.")
+		sys.exit(1)
+	# replaces the executor built from the environment variables when this module was imported
+	slice_executor.shutdown()
+	slice_executor = Coalescing_Executor(threads=arguments.threads, max_queued=arguments.max_queued)
+	uvicorn.run(application, host=arguments.host, port=arguments.port)
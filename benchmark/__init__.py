@@ -0,0 +1,8 @@
+"""
+Benchmarks for the server which run against a synthetic road network, so that the real data.gdb is not needed.
+
+	python -m benchmark --scale small --output benchmark_results.json
+	python -m benchmark --scale small --compare benchmark_results.json --threshold 1.25
+
+See README.MD and python -m benchmark --help
+"""
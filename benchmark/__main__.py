@@ -0,0 +1,133 @@
+import argparse
+import datetime
+import hashlib
+import importlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+
+from benchmark.synthetic_network import make_synthetic_network, SYNTHETIC_NETWORK_SCALES
+from benchmark.timing import time_benchmark, compare_results, format_seconds, DEFAULT_REGRESSION_THRESHOLD, MINIMUM_REPEAT_SECONDS, REPEAT_COUNT
+
+BENCHMARK_RESULTS_FORMAT_VERSION = 1
+
+
+def main() -> int:
+	argument_parser = argparse.ArgumentParser(prog="python -m benchmark", description="Benchmark the server against a synthetic road network.")
+	argument_parser.add_argument("--scale", choices=sorted(SYNTHETIC_NETWORK_SCALES), default="small", help="size of the synthetic road network")
+	argument_parser.add_argument("--vertices-per-km", type=float, default=50, help="density of vertices in the synthetic road network")
+	argument_parser.add_argument("--seed", type=int, default=0, help="seed for the synthetic road network and the benchmark requests")
+	argument_parser.add_argument("--filter", default=None, help="only run benchmarks whose name contains this text. eg --filter end_to_end")
+	argument_parser.add_argument("--minimum-repeat-seconds", type=float, default=MINIMUM_REPEAT_SECONDS)
+	argument_parser.add_argument("--repeat", type=int, default=REPEAT_COUNT)
+	argument_parser.add_argument("--output", default=None, help="write the results to this JSON file")
+	argument_parser.add_argument("--compare", default=None, help="JSON file written by an earlier run. The run fails if any benchmark is slower than --threshold times its time in that file")
+	argument_parser.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD)
+	arguments = argument_parser.parse_args()
+
+	network_parameters = {
+		**SYNTHETIC_NETWORK_SCALES[arguments.scale],
+		"vertices_per_km": arguments.vertices_per_km,
+		"seed": arguments.seed,
+	}
+	print(f"Generating synthetic road network {network_parameters}")
+	all_road_segments = make_synthetic_network(**network_parameters)
+
+	# The server is pointed at a snapshot of the synthetic network. Its source does not exist, so the snapshot is loaded as it is. See open_road_network()
+	# The imports are deferred until here because app.py loads the network as soon as it is imported.
+	temporary_directory = tempfile.mkdtemp(prefix="road_network_benchmark_")
+	try:
+		from util.network_snapshot import write_network_snapshot
+		snapshot_path = os.path.join(temporary_directory, "synthetic.snapshot")
+		write_network_snapshot(
+			all_road_segments,
+			snapshot_path,
+			layer="synthetic",
+			source_signature=[],
+			source_sha256=hashlib.sha256(json.dumps(network_parameters, sort_keys=True).encode("utf-8")).hexdigest()
+		)
+		os.environ["ROAD_NETWORK_SOURCE"] = os.path.join(temporary_directory, "synthetic.gdb")
+		os.environ["ROAD_NETWORK_SNAPSHOT"] = snapshot_path
+		# tiles are only cached in memory, so that the benchmarks can cheaply clear the cache before each request
+		os.environ["TILE_CACHE_DIRECTORY"] = ""
+		app_module = importlib.import_module("app")
+
+		from benchmark.end_to_end_benchmarks import end_to_end_benchmarks
+		from benchmark.micro_benchmarks import micro_benchmarks
+		benchmarks = {
+			**micro_benchmarks(all_road_segments, app_module.road_network, app_module.filter_dataframe, arguments.seed),
+			**end_to_end_benchmarks(app_module, all_road_segments, arguments.seed),
+		}
+
+		results = {}
+		for name, benchmark in benchmarks.items():
+			if arguments.filter is not None and arguments.filter not in name:
+				continue
+			results[name] = time_benchmark(benchmark, arguments.minimum_repeat_seconds, arguments.repeat)
+			print(f"{name:<60} {format_seconds(results[name]['seconds_per_call_median']):>12} per call (min {format_seconds(results[name]['seconds_per_call_min'])})")
+
+		network = app_module.road_network
+		run = {
+			"format_version": BENCHMARK_RESULTS_FORMAT_VERSION,
+			"created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+			"environment": _environment(),
+			"network": {
+				**network_parameters,
+				"scale": arguments.scale,
+				"rows": len(network),
+				"vertices": len(network.geometry.coordinates),
+			},
+			"benchmarks": results,
+		}
+	finally:
+		# on windows the snapshot can't be removed while it is still mapped. It will be left in the temporary directory in that case.
+		shutil.rmtree(temporary_directory, ignore_errors=True)
+
+	if arguments.output is not None:
+		with open(arguments.output, "w") as output_file:
+			json.dump(run, output_file, indent="\t")
+		print(f"Results written to {arguments.output}")
+
+	if arguments.compare is not None:
+		with open(arguments.compare) as baseline_file:
+			baseline = json.load(baseline_file)
+		if baseline.get("network") != run["network"]:
+			print(f"Warning: {arguments.compare} was run against a different synthetic network {baseline.get('network')}")
+		regressions = compare_results(baseline, run, arguments.threshold)
+		for regression in regressions:
+			print(f"REGRESSION: {regression}")
+		if regressions:
+			return 1
+		print(f"No benchmark is more than {arguments.threshold} times slower than {arguments.compare}")
+
+	return 0
+
+
+def _environment() -> dict:
+	environment = {
+		"python": sys.version.split()[0],
+		"platform": platform.platform(),
+		"processor": platform.processor(),
+	}
+	for package_name in ("numpy", "pandas", "shapely", "geopandas", "flask"):
+		environment[package_name] = _package_version(package_name)
+	return environment
+
+
+def _package_version(package_name: str):
+	try:
+		from importlib.metadata import version, PackageNotFoundError
+	except ImportError:
+		# python 3.7
+		return getattr(importlib.import_module(package_name), "__version__", None)
+	try:
+		return version(package_name)
+	except PackageNotFoundError:
+		return None
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,106 @@
+import json
+from typing import Callable, Dict, Any, List
+from urllib.parse import urlencode
+
+import geopandas as gpd
+import numpy as np
+
+from benchmark.synthetic_network import synthetic_slice_requests
+from util.parse_request_parameters import Slice_Request_Args
+from util.road_network_tile_levels import web_mercator_world_coordinates
+
+
+class End_To_End_Benchmark_Exception(Exception):
+	def __init__(self, message):
+		super().__init__(message)
+		self.message = message
+
+
+def end_to_end_benchmarks(app_module, all_road_segments: gpd.GeoDataFrame, seed: int = 0) -> Dict[str, Callable[[], Any]]:
+	"""
+	Benchmarks of whole requests made through the flask test client, named "end_to_end.<query>".
+	The response and tile caches are cleared before each request, except by the "cached" benchmarks.
+	:param app_module: the imported app.py, already loaded with the network in all_road_segments
+	"""
+	client = app_module.app.test_client()
+	rng = np.random.default_rng(seed)
+
+	def get(url: str, clear_cache: bool = True) -> Callable[[], Any]:
+		def benchmark():
+			if clear_cache:
+				app_module.response_cache.clear()
+				app_module.tile_cache.clear()
+			return _check_response(url, client.get(url))
+		return benchmark
+
+	def post(url: str, body: Any) -> Callable[[], Any]:
+		data = json.dumps(body)
+		return lambda: _check_response(url, client.post(url, data=data, content_type="application/json"))
+
+	single = _slice_query(synthetic_slice_requests(all_road_segments, 1, seed))
+	multi_road = _slice_query(synthetic_slice_requests(all_road_segments, 50, seed))
+	offset = _slice_query(synthetic_slice_requests(all_road_segments, 1, seed, offset_metres=-5, cway="L"))
+	point = _slice_query(synthetic_slice_requests(all_road_segments, 1, seed, length_km=0))
+	multi_point = _slice_query(synthetic_slice_requests(all_road_segments, 50, seed, length_km=0))
+	# many ranges on few roads, most of which overlap others, like a table of defects or works
+	overlapping = _slice_query(synthetic_slice_requests(all_road_segments[all_road_segments["ROAD"].isin(all_road_segments["ROAD"].unique()[:5])], 500, seed))
+	bulk_rows = [
+		{"id": row_number, "road": item.road, "slk_from": item.slk_from, "slk_to": item.slk_to}
+		for row_number, item in enumerate(synthetic_slice_requests(all_road_segments, 1000, seed))
+	]
+	# random points a few metres from random vertices of the network
+	reverse_points = np.array([
+		geometry.geoms[0].coords[0] for geometry in all_road_segments.geometry.iloc[rng.integers(0, len(all_road_segments), 50)]
+	]) + rng.normal(0, 1e-4, (50, 2))
+	reverse = urlencode({"lat": ",".join(map(str, reverse_points[:, 1])), "lon": ",".join(map(str, reverse_points[:, 0]))})
+
+	# tiles around the middle vertex of the network
+	network_coordinates = app_module.road_network.geometry.coordinates
+	tile_centre = web_mercator_world_coordinates(network_coordinates[len(network_coordinates) // 2:len(network_coordinates) // 2 + 1])[0]
+	tile = {zoom: "{}/{}/{}".format(zoom, *(tile_centre * 2 ** zoom).astype(int).tolist()) for zoom in (6, 10, 14)}
+
+	return {
+		"end_to_end.single": get("/?" + single),
+		"end_to_end.single[cached]": get("/?" + single, clear_cache=False),
+		"end_to_end.single[wkt]": get("/?" + single + "&wkt"),
+		"end_to_end.multi_road[50]": get("/?" + multi_road),
+		"end_to_end.multi_road[50,merge=union]": get("/?" + multi_road + "&merge=union"),
+		"end_to_end.multi_road[50,precision=6]": get("/?" + multi_road + "&precision=6"),
+		"end_to_end.multi_road[50,format=wkb]": get("/?" + multi_road + "&format=wkb"),
+		"end_to_end.multi_road[50,format=twkb]": get("/?" + multi_road + "&format=twkb"),
+		"end_to_end.multi_road[50,format=polyline]": get("/?" + multi_road + "&format=polyline"),
+		"end_to_end.offset": get("/?" + offset),
+		"end_to_end.point": get("/?" + point),
+		"end_to_end.multi_point[50]": get("/?" + multi_point),
+		"end_to_end.multi_road[50,interval=20]": get("/?" + multi_road + "&interval=20"),
+		"end_to_end.multi_road[50,interval=20,merge=none]": get("/?" + multi_road + "&interval=20&merge=none"),
+		"end_to_end.overlapping[500]": get("/?" + overlapping),
+		"end_to_end.overlapping[500,merge=union]": get("/?" + overlapping + "&merge=union"),
+		"end_to_end.overlapping[500,coalesce]": get("/?" + overlapping + "&coalesce"),
+		"end_to_end.bulk[1000]": post("/bulk/", bulk_rows),
+		"end_to_end.bulk[1000,format=flatgeobuf]": post("/bulk/?format=flatgeobuf", bulk_rows),
+		"end_to_end.reverse[50]": get("/reverse/?" + reverse),
+		"end_to_end.tile[z=6]": get(f"/tiles/{tile[6]}.mvt"),
+		"end_to_end.tile[z=10]": get(f"/tiles/{tile[10]}.mvt"),
+		"end_to_end.tile[z=14]": get(f"/tiles/{tile[14]}.mvt"),
+		"end_to_end.tile[z=10,cached]": get(f"/tiles/{tile[10]}.mvt", clear_cache=False),
+		"end_to_end.tile[z=10,multi_road[50]]": get(f"/tiles/{tile[10]}.mvt?" + multi_road),
+	}
+
+
+def _slice_query(slice_requests: List[Slice_Request_Args]) -> str:
+	return urlencode({
+		"road": ",".join(item.road for item in slice_requests),
+		"slk_from": ",".join(str(item.slk_from) for item in slice_requests),
+		"slk_to": ",".join(str(item.slk_to) for item in slice_requests),
+		"offset": ",".join(str(item.offset) for item in slice_requests),
+		"cway": ",".join(item.cway for item in slice_requests),
+	})
+
+
+def _check_response(url: str, response):
+	# get_data() also consumes streamed responses, so that the time to produce the whole body is measured
+	body = response.get_data()
+	if response.status_code != 200:
+		raise End_To_End_Benchmark_Exception(f"{url} returned status {response.status_code}: {body[:200]!r}")
+	return body
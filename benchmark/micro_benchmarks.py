@@ -0,0 +1,104 @@
+import dataclasses
+from typing import Callable, Dict, Any
+
+import geopandas as gpd
+import numpy as np
+from flask import Request
+from shapely.geometry import LineString
+from werkzeug.test import EnvironBuilder
+
+from benchmark.synthetic_network import synthetic_slice_requests
+from util.cut_linestring import cut_linestring, double_cut_coordinates
+from util.direction_of_linestring import direction_of_linestring
+from util.get_point_along_linestring_with_offset import get_point_along_linestring_with_offset
+from util.parse_request_parameters import parse_request_parameters, coalesce_slice_requests
+from util.response_cache import response_cache_key
+from util.reverse_geocode import reverse_geocode
+from util.road_network import Road_Network
+from util.road_network_geometry import Road_Network_Geometry
+from util.road_network_index import Road_Network_Index, REQUEST_CARRIAGEWAY_BITMASK
+from util.road_network_spatial_index import Road_Network_Spatial_Index
+from util.road_network_tile_levels import Road_Network_Tile_Levels, web_mercator_world_coordinates
+from util.road_network_tiles import write_road_network_tile, tile_bounds
+from util.sample_linestring import sample_linestring
+from util.sample_linestring_batch import sample_linestring_batch
+from util.serialise_output_geometry import serialise_output_geometry, serialise_batch_result
+
+
+def micro_benchmarks(all_road_segments: gpd.GeoDataFrame, road_network: Road_Network, filter_dataframe: Callable, seed: int = 0) -> Dict[str, Callable[[], Any]]:
+	"""
+	One benchmark for each function in util/, named "micro.<function>". Each benchmark is a function taking no arguments.
+	:param road_network: all_road_segments as loaded by the server
+	:param filter_dataframe: app.filter_dataframe
+	"""
+	rng = np.random.default_rng(seed)
+
+	# the segment with the most vertices, since that is where the per-vertex work of the older functions shows up
+	longest_row = int(np.argmax(np.diff(road_network.geometry.vertex_offsets)))
+	longest_segment = all_road_segments.iloc[longest_row]
+	longest_linestring = LineString(road_network.geometry.segment_coordinates(longest_row))
+	longest_start_slk = float(longest_segment["START_SLK"])
+	longest_end_slk = float(longest_segment["END_SLK"])
+	longest_quarter_slk = longest_start_slk + (longest_end_slk - longest_start_slk) / 4
+	longest_half_slk = longest_start_slk + (longest_end_slk - longest_start_slk) / 2
+
+	single_request = synthetic_slice_requests(all_road_segments, 1, seed)[0]
+	single_rows = filter_dataframe(road_network, single_request.road, single_request.slk_from, single_request.slk_to, single_request.cway)
+	many_requests = synthetic_slice_requests(all_road_segments, 100, seed)
+	many_offset_requests = synthetic_slice_requests(all_road_segments, 100, seed, offset_metres=-5, cway="L")
+	many_point_requests = synthetic_slice_requests(all_road_segments, 100, seed, length_km=0)
+	many_interval_requests = [dataclasses.replace(item, interval=20) for item in many_requests]
+	many_results = sample_linestring_batch(many_requests, road_network)
+	many_geometries = many_results.geometries()
+	many_request_query = "road={}&slk_from={}&slk_to={}".format(
+		",".join(item.road for item in many_requests),
+		",".join(str(item.slk_from) for item in many_requests),
+		",".join(str(item.slk_to) for item in many_requests),
+	)
+
+	# random points a few metres from random vertices
+	reverse_points = road_network.geometry.coordinates[rng.integers(0, len(road_network.geometry.coordinates), 100)] + rng.normal(0, 1e-4, (100, 2))
+	reverse_lon = reverse_points[:, 0].tolist()
+	reverse_lat = reverse_points[:, 1].tolist()
+
+	# the zoom level 8 tile around a random vertex
+	tile_vertex = rng.integers(0, len(road_network.geometry.coordinates))
+	tile_x, tile_y = (web_mercator_world_coordinates(road_network.geometry.coordinates[tile_vertex:tile_vertex + 1])[0] * 2 ** 8).astype(int).tolist()
+
+	return {
+		"micro.cut_linestring": lambda: cut_linestring(longest_linestring, longest_start_slk, longest_end_slk, longest_half_slk),
+		"micro.double_cut_coordinates": lambda: double_cut_coordinates(
+			road_network.geometry.segment_coordinates(longest_row),
+			road_network.geometry.segment_cumulative_length(longest_row),
+			longest_start_slk, longest_end_slk, longest_quarter_slk, longest_half_slk
+		),
+		"micro.direction_of_linestring": lambda: direction_of_linestring(longest_linestring, 0.5),
+		"micro.get_point_along_linestring_with_offset": lambda: get_point_along_linestring_with_offset(longest_linestring, longest_start_slk, longest_end_slk, longest_half_slk, 5),
+		"micro.filter_dataframe": lambda: filter_dataframe(road_network, single_request.road, single_request.slk_from, single_request.slk_to, single_request.cway),
+		"micro.road_network_index.lookup": lambda: road_network.index.lookup(single_request.road, single_request.slk_from, single_request.slk_to, REQUEST_CARRIAGEWAY_BITMASK["LRS"]),
+		"micro.road_network_index.lookup_many[100]": lambda: road_network.index.lookup_many(
+			[item.road for item in many_requests],
+			np.array([item.slk_from for item in many_requests]),
+			np.array([item.slk_to for item in many_requests]),
+			np.full(len(many_requests), REQUEST_CARRIAGEWAY_BITMASK["LRS"])
+		),
+		"micro.sample_linestring": lambda: sample_linestring(single_rows, road_network.geometry, single_request.slk_from, single_request.slk_to),
+		"micro.sample_linestring_batch[1]": lambda: sample_linestring_batch([single_request], road_network),
+		"micro.sample_linestring_batch[100]": lambda: sample_linestring_batch(many_requests, road_network),
+		"micro.sample_linestring_batch[100,offset]": lambda: sample_linestring_batch(many_offset_requests, road_network),
+		"micro.sample_linestring_batch[100,point]": lambda: sample_linestring_batch(many_point_requests, road_network),
+		"micro.sample_linestring_batch[100,interval=20]": lambda: sample_linestring_batch(many_interval_requests, road_network),
+		"micro.serialise_output_geometry[100]": lambda: serialise_output_geometry(many_geometries, "GEOJSON"),
+		"micro.serialise_batch_result[100]": lambda: serialise_batch_result(many_results, "GEOJSON"),
+		"micro.serialise_batch_result[100,wkt,precision=6]": lambda: serialise_batch_result(many_results, "WKT", precision=6),
+		"micro.parse_request_parameters[100]": lambda: parse_request_parameters(Request(EnvironBuilder(query_string=many_request_query).get_environ())),
+		"micro.coalesce_slice_requests[100]": lambda: coalesce_slice_requests(many_requests),
+		"micro.response_cache_key[100]": lambda: response_cache_key(road_network.version, many_requests, ("GEOJSON", "collect", None)),
+		"micro.reverse_geocode[100]": lambda: [reverse_geocode(road_network, lat, lon) for lat, lon in zip(reverse_lat, reverse_lon)],
+		"micro.road_network_geometry.from_geodataframe": lambda: Road_Network_Geometry.from_geodataframe(all_road_segments),
+		"micro.road_network_index.build": lambda: Road_Network_Index.from_columns(road_network.road, road_network.start_slk, road_network.end_slk, road_network.carriageway),
+		"micro.road_network_spatial_index.build": lambda: Road_Network_Spatial_Index.from_geometry(road_network.geometry, road_network.index),
+		"micro.road_network_spatial_index.intersecting_steps[z=8]": lambda: road_network.spatial_index.intersecting_steps(*tile_bounds(8, tile_x, tile_y)),
+		"micro.road_network_tile_levels.build": lambda: Road_Network_Tile_Levels.from_geometry(road_network.geometry),
+		"micro.write_road_network_tile[z=8]": lambda: write_road_network_tile(road_network, 8, tile_x, tile_y),
+	}
@@ -0,0 +1,81 @@
+from typing import Dict, List, Optional
+
+import geopandas as gpd
+import numpy as np
+from shapely.geometry import MultiLineString
+
+from util.convert_metres_to_degrees import convert_metres_to_degrees
+from util.parse_request_parameters import Slice_Request_Args
+
+# Named sizes of synthetic network. "large" has roughly as many rows as the real state road network.
+SYNTHETIC_NETWORK_SCALES: Dict[str, Dict[str, int]] = {
+	"small": {"road_count": 50, "segments_per_road": 20},
+	"medium": {"road_count": 400, "segments_per_road": 40},
+	"large": {"road_count": 2000, "segments_per_road": 80},
+}
+
+# Distance from the centre of a dual carriageway road to each of its carriageways
+DUAL_CARRIAGEWAY_OFFSET_METRES = 10
+
+
+def synthetic_road_name(road_number: int) -> str:
+	return f"S{road_number:04d}"
+
+
+def make_synthetic_network(road_count: int = 50, segments_per_road: int = 20, vertices_per_km: float = 50, dual_carriageway_fraction: float = 0.25, seed: int = 0) -> gpd.GeoDataFrame:
+	"""
+	Builds a road network with the same columns as the real one: ROAD, START_SLK, END_SLK, CWY and MultiLineString geometry in degrees.
+	Each road wanders randomly from a random starting point near Perth. Its segments follow on from each other with continuous SLKs,
+	and a random dual_carriageway_fraction of them are split into a "Left" and a "Right" segment either side of the road instead of one "Single" segment.
+	The same arguments always produce the same network.
+	:param vertices_per_km: number of vertices along each kilometre of segment
+	"""
+	rng = np.random.default_rng(seed)
+	rows = []
+	for road_number in range(road_count):
+		road = synthetic_road_name(road_number)
+		position = np.array([115.5, -32.5]) + rng.random(2) * 1.5
+		heading = rng.random() * 2 * np.pi
+		slk = 0.0
+		for _ in range(segments_per_road):
+			length_km = round(0.05 + rng.random() * 1.95, 3)
+			vertex_count = max(2, int(round(length_km * vertices_per_km)) + 1)
+			step_heading = heading + np.cumsum(rng.normal(0, 0.05, vertex_count - 1))
+			step = np.column_stack((np.cos(step_heading), np.sin(step_heading))) * convert_metres_to_degrees(length_km * 1000 / (vertex_count - 1))
+			coordinates = np.vstack((position, position + np.cumsum(step, axis=0)))
+			position = coordinates[-1]
+			heading = step_heading[-1]
+
+			start_slk = round(slk, 3)
+			end_slk = round(slk + length_km, 3)
+			slk = end_slk
+			if rng.random() < dual_carriageway_fraction:
+				# the unit vector to the right of the road at each vertex
+				direction = np.gradient(coordinates, axis=0)
+				direction /= np.hypot(direction[:, 0], direction[:, 1])[:, np.newaxis]
+				right = np.column_stack((direction[:, 1], -direction[:, 0])) * convert_metres_to_degrees(DUAL_CARRIAGEWAY_OFFSET_METRES)
+				rows.append({"ROAD": road, "START_SLK": start_slk, "END_SLK": end_slk, "CWY": "Left", "geometry": MultiLineString([coordinates - right])})
+				rows.append({"ROAD": road, "START_SLK": start_slk, "END_SLK": end_slk, "CWY": "Right", "geometry": MultiLineString([coordinates + right])})
+			else:
+				rows.append({"ROAD": road, "START_SLK": start_slk, "END_SLK": end_slk, "CWY": "Single", "geometry": MultiLineString([coordinates])})
+
+	return gpd.GeoDataFrame(rows, columns=["ROAD", "START_SLK", "END_SLK", "CWY", "geometry"], geometry="geometry", crs="EPSG:4326")
+
+
+def synthetic_slice_requests(all_road_segments: gpd.GeoDataFrame, count: int, seed: int = 0, length_km: float = 1.0, offset_metres: float = 0, cway: Optional[str] = None) -> List[Slice_Request_Args]:
+	"""
+	Picks `count` random slice requests which each start within a random segment of all_road_segments.
+	The same arguments always produce the same requests.
+	:param length_km: the length of each request. 0 requests points.
+	:param cway: only pick segments on this carriageway, and filter the requests to it. eg "L"
+	"""
+	rng = np.random.default_rng(seed)
+	candidates = all_road_segments
+	if cway is not None:
+		candidates = all_road_segments[all_road_segments["CWY"].str[0] == cway]
+	rows = candidates.iloc[rng.integers(0, len(candidates), count)]
+	slk_from = rows["START_SLK"].to_numpy() + rng.random(count) * (rows["END_SLK"] - rows["START_SLK"]).to_numpy()
+	return [
+		Slice_Request_Args(road, float(item_slk_from), float(item_slk_from) + length_km, offset_metres, cway if cway is not None else "LRS")
+		for road, item_slk_from in zip(rows["ROAD"], slk_from)
+	]
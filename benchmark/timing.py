@@ -0,0 +1,66 @@
+import statistics
+import time
+from typing import Callable, Any, Dict, List
+
+# Each benchmark is called enough times per repeat to take at least this long, so that timer resolution does not matter
+MINIMUM_REPEAT_SECONDS = 0.05
+REPEAT_COUNT = 5
+
+# A benchmark has regressed when its median time is more than this many times its median time in the baseline
+DEFAULT_REGRESSION_THRESHOLD = 1.25
+
+
+def time_benchmark(function: Callable[[], Any], minimum_repeat_seconds: float = MINIMUM_REPEAT_SECONDS, repeat_count: int = REPEAT_COUNT) -> Dict[str, Any]:
+	"""
+	Times function the same way as the timeit module: the number of calls per repeat is doubled until one repeat takes at least minimum_repeat_seconds,
+	then the repeats are timed. The first call is made before timing starts so that one-off work (imports, lazily built objects) is not counted.
+	:return: the seconds per call of the fastest and the median repeat
+	"""
+	function()
+	calls_per_repeat = 1
+	while True:
+		elapsed = _time_calls(function, calls_per_repeat)
+		if elapsed >= minimum_repeat_seconds:
+			break
+		calls_per_repeat *= 2
+
+	seconds_per_call = [elapsed / calls_per_repeat] + [_time_calls(function, calls_per_repeat) / calls_per_repeat for _ in range(repeat_count - 1)]
+	return {
+		"calls_per_repeat": calls_per_repeat,
+		"repeat_count": repeat_count,
+		"seconds_per_call_min": min(seconds_per_call),
+		"seconds_per_call_median": statistics.median(seconds_per_call),
+	}
+
+
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float = DEFAULT_REGRESSION_THRESHOLD) -> List[str]:
+	"""
+	Compares two sets of results written by `python -m benchmark --output`. Benchmarks missing from either set are skipped.
+	:return: a description of each benchmark which is more than `threshold` times slower than in the baseline
+	"""
+	regressions = []
+	for name, current_result in current["benchmarks"].items():
+		baseline_result = baseline["benchmarks"].get(name)
+		if baseline_result is None:
+			continue
+		ratio = current_result["seconds_per_call_median"] / baseline_result["seconds_per_call_median"]
+		if ratio > threshold:
+			regressions.append(
+				f"{name} is {ratio:.2f} times slower than the baseline "
+				f"({format_seconds(current_result['seconds_per_call_median'])} vs {format_seconds(baseline_result['seconds_per_call_median'])})"
+			)
+	return regressions
+
+
+def format_seconds(seconds: float) -> str:
+	for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+		if seconds >= scale:
+			return f"{seconds / scale:.3f}{unit}"
+	return f"{seconds / 1e-9:.0f}ns"
+
+
+def _time_calls(function: Callable[[], Any], calls: int) -> float:
+	start = time.perf_counter()
+	for _ in range(calls):
+		function()
+	return time.perf_counter() - start
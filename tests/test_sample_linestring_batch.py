@@ -0,0 +1,47 @@
+import geopandas as gpd
+import numpy as np
+from shapely.geometry import MultiLineString
+
+from benchmark.synthetic_network import make_synthetic_network
+from util.parse_request_parameters import Slice_Request_Args
+from util.road_network import Road_Network
+from util.sample_linestring_batch import sample_linestring_batch
+
+
+def _line_part_lengths(result) -> np.ndarray:
+	lengths = []
+	for part in np.flatnonzero(~result.is_point):
+		coordinates = result.coordinates[result.part_offsets[part]:result.part_offsets[part + 1]]
+		lengths.append(np.hypot(*np.diff(coordinates, axis=0).T).sum())
+	return np.array(lengths)
+
+
+def test_slice_starting_at_segment_boundary_only_returns_next_segment():
+	road_network = Road_Network.from_geodataframe(gpd.GeoDataFrame(
+		{
+			"ROAD": ["H001", "H001"],
+			"START_SLK": [0.0, 1.0],
+			"END_SLK": [1.0, 2.0],
+			"CWY": ["Single", "Single"],
+			"geometry": [MultiLineString([[(116.0, -32.0), (116.003, -32.0), (116.009, -32.0)]]), MultiLineString([[(116.009, -32.0), (116.018, -32.0)]])],
+		},
+		crs="EPSG:4326"
+	), "test")
+
+	result = sample_linestring_batch([Slice_Request_Args("H001", 1.0, 2.0, 0, "LRS")], road_network)
+
+	assert result.row_position.tolist() == [1]
+	assert np.array_equal(result.coordinates, [[116.009, -32.0], [116.018, -32.0]])
+
+
+def test_slices_starting_at_segment_boundaries_have_no_zero_length_parts():
+	all_road_segments = make_synthetic_network(road_count=10, segments_per_road=10)
+	road_network = Road_Network.from_geodataframe(all_road_segments, "test")
+	slice_requests = [
+		Slice_Request_Args(row.ROAD, row.END_SLK, row.END_SLK + 0.5, 0, row.CWY[0])
+		for row in all_road_segments.itertuples()
+	]
+
+	result = sample_linestring_batch(slice_requests, road_network)
+
+	assert np.all(_line_part_lengths(result) > 0)
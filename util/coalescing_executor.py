@@ -0,0 +1,64 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, Optional, Any
+
+
+class Executor_Full_Exception(Exception):
+	def __init__(self, message):
+		super().__init__(message)
+		self.message = message
+
+
+class Coalescing_Executor:
+	"""
+	Runs blocking functions on a fixed number of threads for asyncio code, with two limits on the work it accepts:
+
+	Calls made with the same key while an earlier call with that key is still running share its result (or exception) instead of running again (single-flight).
+	At most `threads + max_queued` calls run or wait for a thread at once. Any more are refused with Executor_Full_Exception,
+	so that a flood of requests is turned away immediately rather than queueing for longer and longer.
+	Calls which join a running call with the same key are never refused, since they add no work.
+
+	Must only be used from one event loop.
+	"""
+
+	def __init__(self, threads: int = 4, max_queued: int = 64):
+		self.threads = threads
+		self.max_queued = max_queued
+		self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="coalescing_executor")
+		# calls submitted to the thread pool which have not yet finished, whether running or queued
+		self._pending_count = 0
+		self._in_flight: Dict[Hashable, asyncio.Future] = {}
+
+	async def run(self, key: Optional[Hashable], function: Callable[..., Any], *args) -> Any:
+		"""
+		:param key: calls with equal keys share one result. None never shares.
+		:raises Executor_Full_Exception: if the executor already has threads + max_queued calls pending
+		"""
+		if key is not None:
+			in_flight = self._in_flight.get(key)
+			if in_flight is not None:
+				# shield so that one caller being cancelled (eg the client disconnected) does not cancel the result for the others
+				return await asyncio.shield(in_flight)
+
+		if self._pending_count >= self.threads + self.max_queued:
+			raise Executor_Full_Exception(f"{self._pending_count} calls are already pending")
+
+		future = asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+		self._pending_count += 1
+		if key is not None:
+			self._in_flight[key] = future
+
+		def on_done(done_future: asyncio.Future):
+			# The bookkeeping is done when the call finishes, rather than when the caller stops waiting, because the thread stays busy until then.
+			self._pending_count -= 1
+			if key is not None and self._in_flight.get(key) is done_future:
+				del self._in_flight[key]
+			if not done_future.cancelled():
+				# marks any exception as retrieved, so that asyncio does not warn about it when every caller has been cancelled
+				done_future.exception()
+
+		future.add_done_callback(on_done)
+		return await asyncio.shield(future)
+
+	def shutdown(self) -> None:
+		self._executor.shutdown(wait=False)
@@ -12,4 +12,8 @@ EARTH_METRES_PER_DEGREE = EARTH_METRES_PER_RADIAN * math.pi / 180
 
 
 def convert_metres_to_degrees(metres: float):
-	return metres / EARTH_METRES_PER_DEGREE
\ No newline at end of file
+	return metres / EARTH_METRES_PER_DEGREE
+
+
+def convert_degrees_to_metres(degrees: float):
+	return degrees * EARTH_METRES_PER_DEGREE
\ No newline at end of file
@@ -1,42 +1,81 @@
 import math
 from typing import Tuple, Optional
 
-from shapely.geometry import LineString, Point
+import numpy as np
+from shapely.geometry import LineString
+
+
+def cumulative_vertex_distance(coordinates: np.ndarray) -> np.ndarray:
+	# distance from the first vertex to each vertex, measured along the line
+	result = np.zeros(len(coordinates), dtype="f8")
+	if len(coordinates) > 1:
+		np.cumsum(np.hypot(*np.diff(coordinates, axis=0).T), out=result[1:])
+	return result
+
+
+def split_coordinates_at_distance(coordinates: np.ndarray, cumulative_length: np.ndarray, distance: float, vertex_after: int) -> Tuple[int, int, np.ndarray]:
+	"""
+	:param vertex_after: the result of np.searchsorted(cumulative_length, distance, side="right")
+	:return: (head_end, tail_start, vertex_at_cut) such that the part before the cut is coordinates[:head_end] + [vertex_at_cut]
+		and the part after the cut is [vertex_at_cut] + coordinates[tail_start:].
+		If the cut falls on an existing vertex then that vertex is used rather than inserting a new one.
+	"""
+	if math.isclose(cumulative_length[vertex_after - 1], distance):
+		return vertex_after - 1, vertex_after, coordinates[vertex_after - 1]
+	if vertex_after < len(coordinates) and math.isclose(cumulative_length[vertex_after], distance):
+		return vertex_after, vertex_after + 1, coordinates[vertex_after]
+	vertex_a = coordinates[vertex_after - 1]
+	vertex_b = coordinates[vertex_after]
+	fraction = (distance - cumulative_length[vertex_after - 1]) / (cumulative_length[vertex_after] - cumulative_length[vertex_after - 1])
+	return vertex_after, vertex_after, vertex_a + (vertex_b - vertex_a) * fraction
 
 
 def cut_linestring(linestring: LineString, linestring_start_slk: float, linestring_end_slk: float, slk_at_which_to_cut: float) -> Tuple[Optional[LineString], Optional[LineString]]:
 	# Cuts a line in two at a distance from its starting point
-	linestring_length_in_slk_units = linestring_end_slk - linestring_start_slk
-	distance_along_linestring_in_slk_units = slk_at_which_to_cut - linestring_start_slk
-	percent = distance_along_linestring_in_slk_units / linestring_length_in_slk_units
-	length_of_linestring_in_data_units = linestring.length
+	linestring_coordinates = np.asarray(linestring.coords, dtype="f8")[:, :2]
+	cumulative_length = cumulative_vertex_distance(linestring_coordinates)
+	length_of_linestring_in_data_units = cumulative_length[-1]
+	percent = (slk_at_which_to_cut - linestring_start_slk) / (linestring_end_slk - linestring_start_slk)
 	distance_along_linestring_in_data_units = length_of_linestring_in_data_units * percent
-	
+
 	if distance_along_linestring_in_data_units <= 0.0:
 		return None, LineString(linestring)
 	if distance_along_linestring_in_data_units >= length_of_linestring_in_data_units:
 		return LineString(linestring), None
+
+	vertex_after = int(np.searchsorted(cumulative_length, distance_along_linestring_in_data_units, side="right"))
+	head_end, tail_start, vertex_at_cut = split_coordinates_at_distance(linestring_coordinates, cumulative_length, distance_along_linestring_in_data_units, vertex_after)
+	return (
+		LineString(np.vstack((linestring_coordinates[:head_end], vertex_at_cut))),
+		LineString(np.vstack((vertex_at_cut, linestring_coordinates[tail_start:])))
+	)
+
+
+def double_cut_coordinates(coordinates: np.ndarray, cumulative_length: np.ndarray, linestring_slk_start: float, linestring_slk_end: float, slk_cut_first: float, slk_cut_second: float) -> Optional[np.ndarray]:
+	"""
+	Cuts a line at two SLKs and returns only the coordinates of the middle part, or None if the middle part is empty.
+	SLK is assumed to vary linearly with distance along the line.
+	:param coordinates: vertices of the line. see Road_Network_Geometry.segment_coordinates()
+	:param cumulative_length: distance along the line to each vertex. see Road_Network_Geometry.segment_cumulative_length()
+	"""
+	length_in_data_units = cumulative_length[-1]
+	length_in_slk_units = linestring_slk_end - linestring_slk_start
+	distance_first = length_in_data_units * (slk_cut_first - linestring_slk_start) / length_in_slk_units
+	distance_second = length_in_data_units * (slk_cut_second - linestring_slk_start) / length_in_slk_units
+
+	if distance_first >= length_in_data_units or distance_second <= max(distance_first, 0.0):
+		return None
+
+	vertex_after_first, vertex_after_second = np.searchsorted(cumulative_length, (distance_first, distance_second), side="right")
+
+	if distance_first <= 0.0:
+		tail_start, vertex_at_first_cut = 1, coordinates[0]
 	else:
-		linestring_coordinates = list(linestring.coords)
-		for index, vertex in enumerate(linestring_coordinates):
-			projected_distance_of_vertex = linestring.project(Point(vertex))
-			if math.isclose(projected_distance_of_vertex, distance_along_linestring_in_data_units):
-				return (
-					LineString(linestring_coordinates[:index + 1]),
-					LineString(linestring_coordinates[index:])
-				)
-			if projected_distance_of_vertex > distance_along_linestring_in_data_units:
-				new_vertex_at_cut = linestring.interpolate(distance_along_linestring_in_data_units)
-				return (
-					LineString(linestring_coordinates[:index] + [(new_vertex_at_cut.x, new_vertex_at_cut.y)]),
-					LineString([(new_vertex_at_cut.x, new_vertex_at_cut.y)] + linestring_coordinates[index:])
-				)
-
-
-def double_cut_linestring(linestring: LineString, linestring_slk_start: float, linestring_slk_end: float, slk_cut_first: float, slk_cut_second: float) -> Tuple[Optional[LineString], Optional[LineString], Optional[LineString]]:
-	part_a, part_bc = cut_linestring(linestring, linestring_start_slk=linestring_slk_start, linestring_end_slk=linestring_slk_end, slk_at_which_to_cut=slk_cut_first)
-	part_b = None
-	part_c = None
-	if part_bc is not None:
-		part_b, part_c = cut_linestring(part_bc, linestring_start_slk=max(linestring_slk_start, slk_cut_first), linestring_end_slk=linestring_slk_end, slk_at_which_to_cut=slk_cut_second)
-	return part_a, part_b, part_c
\ No newline at end of file
+		_, tail_start, vertex_at_first_cut = split_coordinates_at_distance(coordinates, cumulative_length, distance_first, vertex_after_first)
+
+	if distance_second >= length_in_data_units:
+		head_end, vertex_at_second_cut = len(coordinates) - 1, coordinates[-1]
+	else:
+		head_end, _, vertex_at_second_cut = split_coordinates_at_distance(coordinates, cumulative_length, distance_second, vertex_after_second)
+
+	return np.vstack((vertex_at_first_cut, coordinates[tail_start:head_end], vertex_at_second_cut))
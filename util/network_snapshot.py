@@ -0,0 +1,347 @@
+"""
+Compiles the road network into a directory of flat binary arrays which can be memory-mapped at startup,
+instead of parsing the file geodatabase every time the server starts.
+
+The one-time compile step can be run by hand:
+	python -m util.network_snapshot data.gdb NTWK_IRIS_Road_Network_20201029 data.snapshot
+but open_road_network() will also (re)compile the snapshot whenever the source data changes.
+"""
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import shutil
+from contextlib import contextmanager
+from typing import List, Optional
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from util.road_network import Road_Network, ROAD_NETWORK_COLUMNS
+from util.road_network_geometry import Road_Network_Geometry
+from util.road_network_index import Road_Network_Index, ROAD_SLK_KEY_DTYPE
+from util.road_network_spatial_index import Road_Network_Spatial_Index
+from util.road_network_tile_levels import Road_Network_Tile_Levels, SIMPLIFIED_ZOOM_LEVELS
+
+SNAPSHOT_FORMAT_VERSION = 5
+SNAPSHOT_MANIFEST_FILE_NAME = "manifest.json"
+
+# name of each array in the snapshot, and the dtype it is stored with.
+# The codes of the road and carriageway columns are stored with the dtype that pandas itself uses for that many categories (None below),
+# so that pd.Categorical.from_codes() can use the mapped array instead of copying it.
+SNAPSHOT_ARRAYS = {
+	"road_code": None,
+	"carriageway_code": None,
+	"start_slk": "f8",
+	"end_slk": "f8",
+	"coordinates": "f8",
+	"vertex_offsets": "i8",
+	"running_length": "f8",
+	"cumulative_length": "f8",
+	"segment_length": "f8",
+	"step_direction": "f8",
+	"step_normal": "f8",
+	# the simplified geometry of each zoom level in SIMPLIFIED_ZOOM_LEVELS. See Road_Network_Tile_Levels
+	**{f"tile_vertex_z{zoom}": "i8" for zoom in SIMPLIFIED_ZOOM_LEVELS},
+	**{f"tile_vertex_offsets_z{zoom}": "i8" for zoom in SIMPLIFIED_ZOOM_LEVELS},
+	# the sorted arrays of Road_Network_Index
+	"index_row_position": "i8",
+	"index_start_slk": "f8",
+	"index_end_slk": "f8",
+	"index_carriageway_mask": "u1",
+	"index_group_bounds": "i8",
+	"index_end_slk_running_max": "f8",
+	"index_start_slk_key": ROAD_SLK_KEY_DTYPE,
+	"index_end_slk_running_max_key": ROAD_SLK_KEY_DTYPE,
+	# the packed R-tree of Road_Network_Spatial_Index. The node bounds of every level are stored one after the other;
+	# level i is spatial_index_node_bounds[spatial_index_level_offsets[i]:spatial_index_level_offsets[i+1]]
+	"spatial_index_row_road_code": "i8",
+	"spatial_index_row_carriageway_mask": "u1",
+	"spatial_index_step": "i8",
+	"spatial_index_node_bounds": "f8",
+	"spatial_index_level_offsets": "i8",
+}
+
+
+class Network_Snapshot_Exception(Exception):
+	def __init__(self, message):
+		super().__init__(message)
+		self.message = message
+
+
+def compile_network_snapshot(source_path: str, layer: Optional[str], snapshot_path: str, source_sha256: Optional[str] = None) -> None:
+	"""
+	Reads the road network from source_path and writes the columns used by the server to snapshot_path.
+	If layer is None the first layer in the source is read.
+	The snapshot is written beside its final location and then moved into place, so a half written snapshot is never loaded.
+	"""
+	if source_sha256 is None:
+		source_sha256 = _source_sha256(source_path)
+
+	all_road_segments = read_road_network_columns(source_path, layer)
+	missing_columns = [column for column in ROAD_NETWORK_COLUMNS if column not in all_road_segments.columns]
+	if missing_columns:
+		raise Network_Snapshot_Exception(f"The road network layer '{layer}' in '{source_path}' is missing the columns {missing_columns}")
+
+	write_network_snapshot(all_road_segments, snapshot_path, layer, read_source_signature(source_path), source_sha256)
+
+
+def read_road_network_columns(source_path: str, layer: Optional[str]) -> gpd.GeoDataFrame:
+	"""
+	Reads only the ROAD_NETWORK_COLUMNS and the geometry of the road network. The network has dozens of other attribute columns,
+	which would otherwise all be parsed into pandas object columns just to be thrown away.
+	"""
+	if "columns" in inspect.signature(gpd.read_file).parameters:
+		return gpd.read_file(source_path, layer=layer, columns=ROAD_NETWORK_COLUMNS)
+	# Older versions of geopandas (such as the one in requirements.txt) pass extra keyword arguments on to fiona, which can skip the fields it is told to ignore
+	import fiona
+	with fiona.open(source_path, layer=layer) as collection:
+		field_names = list(collection.schema["properties"])
+	return gpd.read_file(source_path, layer=layer, ignore_fields=[name for name in field_names if name not in ROAD_NETWORK_COLUMNS])
+
+
+def write_network_snapshot(all_road_segments: gpd.GeoDataFrame, snapshot_path: str, layer: Optional[str], source_signature: List[list], source_sha256: str) -> None:
+	"""
+	Writes the columns of all_road_segments used by the server to snapshot_path. See compile_network_snapshot()
+	:param source_signature: see read_source_signature()
+	:param source_sha256: identifies the source data. Together with the layer it becomes the version of the loaded network. See network_version()
+	"""
+	all_road_segments = all_road_segments[ROAD_NETWORK_COLUMNS + ["geometry"]]
+
+	# sorted, so that the road codes of the snapshot are also the road codes of the index
+	road_code, road_names = pd.factorize(all_road_segments["ROAD"], sort=True)
+	carriageway_code, carriageway_names = pd.factorize(all_road_segments["CWY"])
+	geometry = Road_Network_Geometry.from_geodataframe(all_road_segments)
+	tile_levels = Road_Network_Tile_Levels.from_geometry(geometry)
+	index = Road_Network_Index.from_geodataframe(all_road_segments)
+	spatial_index = Road_Network_Spatial_Index.from_geometry(geometry, index)
+
+	arrays = {
+		"road_code": pd.Categorical.from_codes(road_code, road_names).codes,
+		"carriageway_code": pd.Categorical.from_codes(carriageway_code, carriageway_names).codes,
+		"start_slk": all_road_segments["START_SLK"].to_numpy(),
+		"end_slk": all_road_segments["END_SLK"].to_numpy(),
+		"coordinates": geometry.coordinates,
+		"vertex_offsets": geometry.vertex_offsets,
+		"running_length": geometry.running_length,
+		"cumulative_length": geometry.cumulative_length,
+		"segment_length": geometry.segment_length,
+		"step_direction": geometry.step_direction,
+		"step_normal": geometry.step_normal,
+		**{f"tile_vertex_z{zoom}": tile_levels.vertex[zoom] for zoom in SIMPLIFIED_ZOOM_LEVELS},
+		**{f"tile_vertex_offsets_z{zoom}": tile_levels.vertex_offsets[zoom] for zoom in SIMPLIFIED_ZOOM_LEVELS},
+		"index_row_position": index.row_position,
+		"index_start_slk": index.start_slk,
+		"index_end_slk": index.end_slk,
+		"index_carriageway_mask": index.carriageway_mask,
+		"index_group_bounds": index.group_bounds,
+		"index_end_slk_running_max": index.end_slk_running_max,
+		"index_start_slk_key": index._start_slk_key,
+		"index_end_slk_running_max_key": index._end_slk_running_max_key,
+		"spatial_index_row_road_code": spatial_index.row_road_code,
+		"spatial_index_row_carriageway_mask": spatial_index.row_carriageway_mask,
+		"spatial_index_step": spatial_index.step,
+		"spatial_index_node_bounds": np.concatenate(spatial_index.node_bounds) if spatial_index.node_bounds else np.empty((0, 4)),
+		"spatial_index_level_offsets": np.cumsum([0] + [len(item) for item in spatial_index.node_bounds]),
+	}
+	manifest = {
+		"format_version": SNAPSHOT_FORMAT_VERSION,
+		"layer": layer,
+		"source_signature": source_signature,
+		"source_sha256": source_sha256,
+		"version": network_version(source_sha256, layer),
+		"road_names": [str(item) for item in road_names],
+		"carriageway_names": [str(item) for item in carriageway_names],
+		"spatial_index_node_size": spatial_index.node_size,
+	}
+
+	temporary_path = f"{snapshot_path}.tmp-{os.getpid()}"
+	shutil.rmtree(temporary_path, ignore_errors=True)
+	os.makedirs(temporary_path)
+	for name, dtype in SNAPSHOT_ARRAYS.items():
+		np.save(os.path.join(temporary_path, name + ".npy"), np.ascontiguousarray(arrays[name], dtype=dtype))
+	with open(os.path.join(temporary_path, SNAPSHOT_MANIFEST_FILE_NAME), "w") as manifest_file:
+		json.dump(manifest, manifest_file)
+
+	old_path = f"{snapshot_path}.old-{os.getpid()}"
+	if os.path.exists(snapshot_path):
+		os.replace(snapshot_path, old_path)
+	os.replace(temporary_path, snapshot_path)
+	# On windows this may fail while another process still has the old arrays mapped. They will be left behind in that case.
+	shutil.rmtree(old_path, ignore_errors=True)
+
+
+def load_network_snapshot(snapshot_path: str) -> Road_Network:
+	"""
+	Memory-maps a snapshot written by compile_network_snapshot(). The arrays are read only and are shared between every process that maps them.
+	Nothing is sorted or rebuilt here; the index and spatial index are mapped from the snapshot along with the geometry.
+	"""
+	manifest = read_snapshot_manifest(snapshot_path)
+	if manifest is None or manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+		raise Network_Snapshot_Exception(f"'{snapshot_path}' is not a road network snapshot, or was written by an incompatible version of this server")
+
+	arrays = {name: np.load(os.path.join(snapshot_path, name + ".npy"), mmap_mode="r") for name in SNAPSHOT_ARRAYS}
+	geometry = Road_Network_Geometry(
+		arrays["coordinates"],
+		arrays["vertex_offsets"],
+		arrays["running_length"],
+		arrays["cumulative_length"],
+		arrays["segment_length"],
+		arrays["step_direction"],
+		arrays["step_normal"]
+	)
+	level_offsets = arrays["spatial_index_level_offsets"].tolist()
+	return Road_Network(
+		pd.Categorical.from_codes(arrays["road_code"], manifest["road_names"]),
+		arrays["start_slk"],
+		arrays["end_slk"],
+		pd.Categorical.from_codes(arrays["carriageway_code"], manifest["carriageway_names"]),
+		geometry,
+		version=manifest["version"],
+		tile_levels=Road_Network_Tile_Levels(
+			{zoom: arrays[f"tile_vertex_z{zoom}"] for zoom in SIMPLIFIED_ZOOM_LEVELS},
+			{zoom: arrays[f"tile_vertex_offsets_z{zoom}"] for zoom in SIMPLIFIED_ZOOM_LEVELS}
+		),
+		index=Road_Network_Index(
+			manifest["road_names"],
+			arrays["index_row_position"],
+			arrays["index_start_slk"],
+			arrays["index_end_slk"],
+			arrays["index_carriageway_mask"],
+			arrays["index_group_bounds"],
+			arrays["index_end_slk_running_max"],
+			arrays["index_start_slk_key"],
+			arrays["index_end_slk_running_max_key"]
+		),
+		spatial_index=Road_Network_Spatial_Index(
+			geometry,
+			manifest["spatial_index_node_size"],
+			len(manifest["road_names"]),
+			arrays["spatial_index_row_road_code"],
+			arrays["spatial_index_row_carriageway_mask"],
+			arrays["spatial_index_step"],
+			[arrays["spatial_index_node_bounds"][start:end] for start, end in zip(level_offsets[:-1], level_offsets[1:])]
+		)
+	)
+
+
+def open_road_network(source_path: str, layer: Optional[str], snapshot_path: str) -> Road_Network:
+	"""
+	Loads the road network from its snapshot, first recompiling the snapshot if it is missing or out of date.
+	The source is only hashed when its modification time or size no longer match those recorded in the snapshot,
+	so the usual startup cost is a few stat() calls plus mapping the arrays.
+	If the source does not exist at all, the snapshot is loaded as it is. This allows the snapshot to be deployed without the source data.
+	:param layer: the layer of the source to load. If None, the snapshot is compiled from the same layer as before, or from the first layer in the source.
+	"""
+	# Several worker processes may reload the network at the same time. Only the first compiles the snapshot; the others wait and then load it.
+	with _snapshot_lock(snapshot_path):
+		manifest = read_snapshot_manifest(snapshot_path)
+		if manifest is not None and not os.path.exists(source_path):
+			print(f"Road network source '{source_path}' was not found. Loading snapshot '{snapshot_path}' as it is")
+
+		elif (
+			manifest is None
+			or manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION
+			or (layer is not None and manifest.get("layer") != layer)
+		):
+			print(f"Compiling road network snapshot '{snapshot_path}' from '{source_path}'")
+			compile_network_snapshot(source_path, layer, snapshot_path)
+
+		elif manifest["source_signature"] != read_source_signature(source_path):
+			source_sha256 = _source_sha256(source_path)
+			if source_sha256 == manifest["source_sha256"]:
+				# only the modification times changed. Record the new ones so that next time we don't need to hash again
+				manifest["source_signature"] = read_source_signature(source_path)
+				_write_manifest(snapshot_path, manifest)
+			else:
+				print(f"Road network source '{source_path}' has changed. Recompiling snapshot '{snapshot_path}'")
+				compile_network_snapshot(source_path, layer if layer is not None else manifest.get("layer"), snapshot_path, source_sha256)
+
+		return load_network_snapshot(snapshot_path)
+
+
+def network_version(source_sha256: str, layer: Optional[str]) -> str:
+	"""
+	:return: the version of a network compiled from this layer of the source. Different layers of the same source get different versions,
+		so that they never share response cache keys, ETags or cached tiles.
+	"""
+	return hashlib.sha256(json.dumps([source_sha256, layer]).encode("utf-8")).hexdigest()[:16]
+
+
+def read_snapshot_manifest(snapshot_path: str) -> Optional[dict]:
+	"""
+	:return: the manifest written with the snapshot, which records the layer and the signature and sha256 of the source it was compiled from. None if there is no snapshot.
+	"""
+	try:
+		with open(os.path.join(snapshot_path, SNAPSHOT_MANIFEST_FILE_NAME)) as manifest_file:
+			return json.load(manifest_file)
+	except (OSError, ValueError):
+		return None
+
+
+def read_source_signature(source_path: str) -> List[list]:
+	"""
+	:return: the name, size and modification time of every file of the source. Cheap to compare with the signature recorded in the snapshot manifest.
+	"""
+	signature = []
+	for file_path in _source_files(source_path):
+		file_stat = os.stat(file_path)
+		signature.append([os.path.relpath(file_path, source_path), file_stat.st_size, file_stat.st_mtime_ns])
+	return signature
+
+
+def _source_files(source_path: str) -> List[str]:
+	# A file geodatabase is a directory of files
+	if not os.path.isdir(source_path):
+		return [source_path]
+	return sorted(
+		os.path.join(directory, file_name)
+		for directory, _, file_names in os.walk(source_path)
+		for file_name in file_names
+		# ESRI lock files come and go while the data is open in other software
+		if not file_name.endswith(".lock")
+	)
+
+
+def _source_sha256(source_path: str) -> str:
+	source_hash = hashlib.sha256()
+	for file_path in _source_files(source_path):
+		source_hash.update(os.path.relpath(file_path, source_path).encode("utf-8"))
+		with open(file_path, "rb") as source_file:
+			for block in iter(lambda: source_file.read(1 << 20), b""):
+				source_hash.update(block)
+	return source_hash.hexdigest()
+
+
+def _write_manifest(snapshot_path: str, manifest: dict) -> None:
+	temporary_manifest_path = os.path.join(snapshot_path, SNAPSHOT_MANIFEST_FILE_NAME + ".tmp")
+	with open(temporary_manifest_path, "w") as manifest_file:
+		json.dump(manifest, manifest_file)
+	os.replace(temporary_manifest_path, os.path.join(snapshot_path, SNAPSHOT_MANIFEST_FILE_NAME))
+
+
+@contextmanager
+def _snapshot_lock(snapshot_path: str):
+	# An exclusive lock on a file beside the snapshot, held across processes. File locks are only available on unix-like systems; elsewhere nothing is locked.
+	try:
+		import fcntl
+	except ImportError:
+		yield
+		return
+	with open(f"{snapshot_path}.lock", "a") as lock_file:
+		fcntl.flock(lock_file, fcntl.LOCK_EX)
+		try:
+			yield
+		finally:
+			fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+if __name__ == "__main__":
+	argument_parser = argparse.ArgumentParser(description="Compile the road network into a snapshot which the server can memory-map at startup.")
+	argument_parser.add_argument("source", help="path to the road network data. eg data.gdb")
+	argument_parser.add_argument("layer", help="name of the road network layer. eg NTWK_IRIS_Road_Network_20201029")
+	argument_parser.add_argument("snapshot", help="path of the snapshot directory to write. eg data.snapshot")
+	arguments = argument_parser.parse_args()
+	compile_network_snapshot(arguments.source, arguments.layer, arguments.snapshot)
@@ -1,8 +1,15 @@
+import dataclasses
+import math
 from dataclasses import dataclass
-from typing import Optional, List
+from typing import Optional, List, Any, Tuple
 
+import numpy as np
+import pandas as pd
 from flask import Request
 
+from util.road_network_index import REQUEST_CARRIAGEWAY_BITMASK
+from util.serialise_output_geometry import MERGE_OPTIONS, DEFAULT_MERGE, OUTPUT_TYPES
+
 
 class URL_Parameter_Parse_Exception(Exception):
 	def __init__(self, message):
@@ -17,10 +24,36 @@ class Slice_Request_Args:
 	slk_to: float
 	offset: float
 	cway: str
+	# metres between sample points. None returns the road between slk_from and slk_to instead. See sample_linestring_batch()
+	interval: Optional[float] = None
+
+
+@dataclass
+class Reverse_Request_Args:
+	lat: float
+	lon: float
+
+
+@dataclass
+class Reverse_Filter_Args:
+	# None searches every road
+	roads: Optional[List[str]]
+	cway: str
+	# metres. None searches any distance
+	radius: Optional[float]
 
 
 ERROR_SUGGEST_CORRECT = "Try /?road=H001&slk_from=6.3&slk_to=7 or /?road=H001,H012&slk_from=6.3,16.4&slk_to=7,17.35"
 ERROR_SUGGEST_CORRECT_ADVANCED = "Try /?road=H001&slk_from=6.3&slk_to=7&offset=-5&cway=L or /?road=H001,H012&slk_from=6.3,16.4&slk_to=7,17.35&offset=-5,5&cway=L,R"
+ERROR_SUGGEST_CORRECT_INTERVAL = "Try /?road=H001&slk_from=6.3&slk_to=7&interval=100 or /?road=H001,H012&slk_from=6.3,16.4&slk_to=7,17.35&interval=100,20"
+
+ERROR_SUGGEST_CORRECT_REVERSE = "Try /reverse/?lat=-31.95&lon=115.86 or /reverse/?lat=-31.95,-32.05&lon=115.86,115.89&road=H001,H012&cway=L&radius=50"
+
+# float64 has at most 17 significant digits; more decimal places than this never change the output
+MAXIMUM_PRECISION = 17
+
+# the most sample points an `interval=` request may ask for (per carriageway), so that one request can't build an enormous response
+MAXIMUM_INTERVAL_POINTS = 100_000
 
 
 def parse_request_parameters(request: Request) -> List[Slice_Request_Args]:
@@ -91,4 +124,218 @@ def parse_request_parameters(request: Request) -> List[Slice_Request_Args]:
 	
 	request_carriageway: List[str] = [''.join(sorted(item.upper())) if item != "" else "LRS" for item in unsorted_request_carriageway]
 	
-	return [Slice_Request_Args(*item) for item in zip(request_roads, request_slk_from, request_slk_to, request_offset, request_carriageway)]
+	# obtain interval. A single value applies to every item of the 'road' list
+	raw_request_interval: Optional[str] = request.args.get("interval", default=None)
+	if raw_request_interval is None or raw_request_interval == "":
+		str_request_interval: List[str] = [''] * len(request_roads)
+	else:
+		str_request_interval: List[str] = raw_request_interval.split(',')
+		if len(str_request_interval) == 1:
+			str_request_interval *= len(request_roads)
+	
+	if len(str_request_interval) != len(request_roads):
+		raise URL_Parameter_Parse_Exception(f"error: optional parameter 'interval={raw_request_interval}' list must be a single value or the same length as the 'road' parameter. {ERROR_SUGGEST_CORRECT_INTERVAL}") from None
+	
+	try:
+		request_interval: List[Optional[float]] = [_parse_interval(item) for item in str_request_interval]
+	except:
+		raise URL_Parameter_Parse_Exception(f"error: optional parameter 'interval={raw_request_interval}' must be a positive number of metres. {ERROR_SUGGEST_CORRECT_INTERVAL}") from None
+	
+	result = [Slice_Request_Args(*item) for item in zip(request_roads, request_slk_from, request_slk_to, request_offset, request_carriageway, request_interval)]
+	if sum(_interval_point_count(item) for item in result) > MAXIMUM_INTERVAL_POINTS:
+		raise URL_Parameter_Parse_Exception(f"error: optional parameter 'interval={raw_request_interval}' would return more than {MAXIMUM_INTERVAL_POINTS} points. Use a longer interval or a shorter range of slk.") from None
+	
+	# if the parameter `coalesce` is present, overlapping and touching ranges are merged before slicing
+	if request.args.get("coalesce", default=None) is not None:
+		result = coalesce_slice_requests(result)
+	return result
+
+
+def coalesce_slice_requests(slice_requests: List[Slice_Request_Args]) -> List[Slice_Request_Args]:
+	"""
+	Merges slice requests for overlapping or touching slk ranges of the same road, cway and offset into one request for each continuous range,
+	so that each segment of the network is cut once per range and comes back as one continuous line rather than as overlapping pieces.
+	Ranges are merged with a sort and sweep: sorted by slk_from within each group, a range starts a new merged range unless it begins at or before
+	the furthest slk_to of the ranges before it.
+	Point requests (slk_from equal to slk_to) and interval requests are left as they are, since merging them would change which points are returned.
+	So are ranges with a non-finite slk, since they can't be compared with the ranges around them.
+	:return: the merged requests, in the order of the first request each was merged from
+	"""
+	if len(slice_requests) < 2:
+		return list(slice_requests)
+
+	group_keys = [
+		(item.road.strip().upper(), item.cway, item.offset)
+		if item.interval is None and math.isfinite(item.slk_from) and math.isfinite(item.slk_to) and not math.isclose(item.slk_from, item.slk_to)
+		else None
+		for item in slice_requests
+	]
+	group, _ = pd.factorize(pd.Series(group_keys, dtype=object))
+	# requests which can't be merged are each a group of their own
+	is_alone = group < 0
+	group[is_alone] = group.max(initial=-1) + 1 + np.arange(np.count_nonzero(is_alone))
+
+	slk_from = np.array([item.slk_from for item in slice_requests], dtype="f8")
+	slk_to = np.array([item.slk_to for item in slice_requests], dtype="f8")
+	order = np.lexsort((slk_from, group))
+	sorted_group = group[order]
+	sorted_slk_from = slk_from[order]
+	sorted_slk_to = slk_to[order]
+	furthest_slk_to = pd.Series(sorted_slk_to).groupby(sorted_group).cummax().to_numpy()
+
+	starts_range = np.ones(len(order), dtype=bool)
+	starts_range[1:] = (sorted_group[1:] != sorted_group[:-1]) | (sorted_slk_from[1:] > furthest_slk_to[:-1])
+	range_start = np.flatnonzero(starts_range)
+	range_slk_from = sorted_slk_from[range_start]
+	range_slk_to = np.maximum.reduceat(sorted_slk_to, range_start)
+	range_first_request = np.minimum.reduceat(order, range_start)
+
+	return [
+		dataclasses.replace(slice_requests[first_request], slk_from=float(range_slk_from[range_number]), slk_to=float(range_slk_to[range_number]))
+		for range_number, first_request in sorted(enumerate(range_first_request.tolist()), key=lambda item: item[1])
+	]
+
+
+def parse_slice_request_row(road: Any, slk_from: Any, slk_to: Any, offset: Any = None, cway: Any = None, interval: Any = None) -> Slice_Request_Args:
+	"""
+	Validates a single row of a bulk request (see read_bulk_rows()) using the same rules that
+	parse_request_parameters() applies to each item of the url parameter lists.
+	Values may be strings (from a CSV body) or numbers (from a JSON body).
+	"""
+	try:
+		assert road is not None
+		road = str(road)
+		assert len(road) > 2
+	except:
+		raise URL_Parameter_Parse_Exception(f"error: missing or malformed value 'road={road}'.") from None
+	
+	try:
+		un_swapped_slk_from = float(slk_from)
+		un_swapped_slk_to = float(slk_to)
+	except:
+		raise URL_Parameter_Parse_Exception(f"error: values 'slk_from={slk_from}' and 'slk_to={slk_to}' are missing or could not be converted to numbers.") from None
+	
+	try:
+		request_offset = float(offset) if offset is not None and offset != "" else 0
+	except:
+		raise URL_Parameter_Parse_Exception(f"error: optional value 'offset={offset}' could not be converted to a number.") from None
+	
+	request_carriageway = ''.join(sorted(str(cway).upper())) if cway is not None and cway != "" else "LRS"
+	
+	try:
+		request_interval = _parse_interval(interval)
+	except:
+		raise URL_Parameter_Parse_Exception(f"error: optional value 'interval={interval}' must be a positive number of metres.") from None
+	
+	result = Slice_Request_Args(
+		road,
+		min(un_swapped_slk_from, un_swapped_slk_to),
+		max(un_swapped_slk_from, un_swapped_slk_to),
+		request_offset,
+		request_carriageway,
+		request_interval
+	)
+	if _interval_point_count(result) > MAXIMUM_INTERVAL_POINTS:
+		raise URL_Parameter_Parse_Exception(f"error: optional value 'interval={interval}' would return more than {MAXIMUM_INTERVAL_POINTS} points.") from None
+	return result
+
+
+def _parse_interval(interval: Any) -> Optional[float]:
+	if interval is None or interval == "":
+		return None
+	request_interval = float(interval)
+	assert request_interval > 0 and math.isfinite(request_interval)
+	return request_interval
+
+
+def _interval_point_count(slice_request: Slice_Request_Args) -> int:
+	if slice_request.interval is None:
+		return 0
+	if not (math.isfinite(slice_request.slk_from) and math.isfinite(slice_request.slk_to)):
+		raise URL_Parameter_Parse_Exception(f"error: 'slk_from={slice_request.slk_from}' and 'slk_to={slice_request.slk_to}' must be finite numbers when 'interval' is used.")
+	return math.floor((slice_request.slk_to - slice_request.slk_from) * 1000 / slice_request.interval) + 1
+
+
+def parse_output_parameters(request: Request) -> Tuple[str, str, Optional[int]]:
+	"""
+	Reads the optional url parameters which control how the response geometry is written. See serialise_batch_result()
+	:return: (output_type, merge, precision)
+	"""
+	raw_request_format: Optional[str] = request.args.get("format", default=None)
+	request_wkt = request.args.get("wkt", default=None) is not None
+	if not raw_request_format:
+		request_output_type = "WKT" if request_wkt else "GEOJSON"
+	else:
+		request_output_type = raw_request_format.strip().upper()
+		if request_output_type not in OUTPUT_TYPES:
+			raise URL_Parameter_Parse_Exception(f"error: optional parameter 'format={raw_request_format}' must be one of {', '.join(item.lower() for item in OUTPUT_TYPES)}. eg &format=wkb")
+		if request_wkt and request_output_type != "WKT":
+			raise URL_Parameter_Parse_Exception(f"error: the 'wkt' parameter can not be used with 'format={raw_request_format}'. Use only one of them.")
+	
+	raw_request_merge: Optional[str] = request.args.get("merge", default=None)
+	request_merge = raw_request_merge.strip().lower() if raw_request_merge else DEFAULT_MERGE
+	if request_merge not in MERGE_OPTIONS:
+		raise URL_Parameter_Parse_Exception(f"error: optional parameter 'merge={raw_request_merge}' must be one of {', '.join(MERGE_OPTIONS)}. eg &merge=union")
+	
+	raw_request_precision: Optional[str] = request.args.get("precision", default=None)
+	if raw_request_precision is None or raw_request_precision == "":
+		request_precision = None
+	else:
+		try:
+			request_precision = int(raw_request_precision)
+			assert 0 <= request_precision <= MAXIMUM_PRECISION
+		except:
+			raise URL_Parameter_Parse_Exception(f"error: optional parameter 'precision={raw_request_precision}' must be a whole number of decimal places from 0 to {MAXIMUM_PRECISION}. eg &precision=6") from None
+	
+	return request_output_type, request_merge, request_precision
+
+
+def parse_reverse_request_parameters(request: Request) -> List[Reverse_Request_Args]:
+	raw_request_lat: Optional[str] = request.args.get("lat", default=None)
+	raw_request_lon: Optional[str] = request.args.get("lon", default=None)
+	try:
+		assert raw_request_lat is not None
+		assert raw_request_lon is not None
+		str_request_lat: List[str] = raw_request_lat.split(',')
+		str_request_lon: List[str] = raw_request_lon.split(',')
+		assert len(str_request_lat) == len(str_request_lon)
+	except:
+		raise URL_Parameter_Parse_Exception(f"error: missing url parameters 'lat' and/or 'lon', or they are not lists of the same length. {ERROR_SUGGEST_CORRECT_REVERSE}") from None
+	
+	return [parse_reverse_request_row(lat, lon) for lat, lon in zip(str_request_lat, str_request_lon)]
+
+
+def parse_reverse_request_row(lat: Any, lon: Any) -> Reverse_Request_Args:
+	try:
+		request_lat = float(lat)
+		request_lon = float(lon)
+		assert -90 <= request_lat <= 90
+		assert -180 <= request_lon <= 180
+	except:
+		raise URL_Parameter_Parse_Exception(f"error: values 'lat={lat}' and 'lon={lon}' are missing or are not valid latitude and longitude in degrees.") from None
+	return Reverse_Request_Args(request_lat, request_lon)
+
+
+def parse_reverse_filter_parameters(request: Request) -> Reverse_Filter_Args:
+	"""
+	Reads the optional url parameters which limit the search of a reverse request. They apply to every point in the request.
+	"""
+	raw_request_roads: Optional[str] = request.args.get("road", default=None)
+	request_roads = [item for item in raw_request_roads.split(',') if item != ""] if raw_request_roads else None
+	
+	raw_request_carriageway: Optional[str] = request.args.get("cway", default=None)
+	request_carriageway = ''.join(sorted(raw_request_carriageway.upper())) if raw_request_carriageway else "LRS"
+	if request_carriageway not in REQUEST_CARRIAGEWAY_BITMASK:
+		raise URL_Parameter_Parse_Exception(f"error: optional parameter 'cway={raw_request_carriageway}' must be any combination of the three letters 'L', 'R' and 'S'. {ERROR_SUGGEST_CORRECT_REVERSE}")
+	
+	raw_request_radius: Optional[str] = request.args.get("radius", default=None)
+	if raw_request_radius is None or raw_request_radius == "":
+		request_radius = None
+	else:
+		try:
+			request_radius = float(raw_request_radius)
+			assert request_radius >= 0
+		except:
+			raise URL_Parameter_Parse_Exception(f"error: optional parameter 'radius={raw_request_radius}' must be a positive number of metres. {ERROR_SUGGEST_CORRECT_REVERSE}") from None
+	
+	return Reverse_Filter_Args(request_roads, request_carriageway, request_radius)
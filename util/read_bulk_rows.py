@@ -0,0 +1,177 @@
+import codecs
+import csv
+import itertools
+import json
+from typing import Iterator, Dict, Any, Sequence
+
+from flask import Request
+
+from util.parse_request_parameters import URL_Parameter_Parse_Exception
+
+BULK_ROW_COLUMNS = ("id", "road", "slk_from", "slk_to", "offset", "cway", "interval")
+BULK_ROW_REQUIRED_COLUMNS = ("road", "slk_from", "slk_to")
+
+# Rows which could not be read from the request body hold their error message under this key, and no other values. See _json_rows()
+BULK_ROW_READ_ERROR = "read_error"
+
+# JSON bodies are decoded this many bytes at a time
+BULK_JSON_BLOCK_BYTES = 64 * 1024
+
+ERROR_SUGGEST_CORRECT_BULK = (
+	"POST a JSON array like [{\"id\":1, \"road\":\"H001\", \"slk_from\":6.3, \"slk_to\":7, \"offset\":-5, \"cway\":\"L\"}, ...] "
+	"or a CSV file with the header row id,road,slk_from,slk_to,offset,cway"
+)
+
+
+def read_bulk_rows(request: Request, columns: Sequence[str] = BULK_ROW_COLUMNS, required_columns: Sequence[str] = BULK_ROW_REQUIRED_COLUMNS, suggest_correct: str = ERROR_SUGGEST_CORRECT_BULK) -> Iterator[Dict[str, Any]]:
+	"""
+	Reads the body of a bulk request as either a JSON array of objects or as CSV with a header row.
+	By default the columns are those of a slice request, of which id, offset, cway and interval are optional. Rows without an id are given their (zero based) row number instead.
+	Rows are read from the request stream one at a time as the iterator is consumed, so the whole body is never held in memory.
+	Only the start of the body is checked before this returns. An item of a JSON array which is not an object, or a JSON body which breaks off part way through,
+	is read as a row holding only BULK_ROW_READ_ERROR, so that the rows before it can still be answered.
+	"""
+	content_type = (request.mimetype or "").lower()
+	stream = request.stream
+
+	if content_type in ("application/json", "text/json"):
+		is_json = True
+	elif content_type in ("text/csv", "application/csv"):
+		is_json = False
+	else:
+		# sniff the first non-whitespace character
+		first_bytes = stream.read(1)
+		while first_bytes and first_bytes.isspace():
+			first_bytes = stream.read(1)
+		is_json = first_bytes == b"["
+		stream = _Prefixed_Stream(first_bytes, stream)
+
+	if is_json:
+		items = _iterate_json_array(stream)
+		try:
+			first_items = list(itertools.islice(items, 1))
+			assert all(isinstance(item, dict) for item in first_items)
+		except:
+			raise URL_Parameter_Parse_Exception(f"error: request body could not be read as a JSON array of objects. {suggest_correct}") from None
+		return _number_rows(_json_rows(itertools.chain(first_items, items)), columns)
+
+	reader = csv.DictReader(codecs.iterdecode(_iterate_lines(stream), "utf-8-sig"))
+	if reader.fieldnames is None or not set(required_columns).issubset(name.strip().lower() for name in reader.fieldnames):
+		raise URL_Parameter_Parse_Exception(f"error: request body could not be read as CSV with the columns {', '.join(required_columns)}. {suggest_correct}")
+	reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+	return _number_rows(reader, columns)
+
+
+def _number_rows(rows, columns: Sequence[str]) -> Iterator[Dict[str, Any]]:
+	for row_number, row in enumerate(rows):
+		if isinstance(row, _Unreadable_Row):
+			yield {**{column: None for column in columns}, "id": row_number, BULK_ROW_READ_ERROR: row.message}
+			continue
+		row_id = row.get("id")
+		yield {
+			**{column: row.get(column) for column in columns},
+			"id": row_id if row_id is not None and row_id != "" else row_number
+		}
+
+
+class _Unreadable_Row:
+	# stands in for a row of a JSON body which could not be read. See _json_rows()
+	def __init__(self, message: str):
+		self.message = message
+
+
+def _json_rows(items: Iterator[Any]) -> Iterator[Any]:
+	try:
+		for item in items:
+			yield item if isinstance(item, dict) else _Unreadable_Row("error: this item of the JSON array is not an object.")
+	except ValueError as e:
+		# the position given by a JSONDecodeError is within the current block, not the body, so only its message is kept
+		yield _Unreadable_Row(f"error: the rest of the request body could not be read as JSON, so no more rows were read. {getattr(e, 'msg', e)}")
+
+
+def _iterate_json_array(stream) -> Iterator[Any]:
+	"""
+	Yields the items of a JSON array one at a time as they are decoded from the stream. Only the item being decoded is held in memory.
+	Raises ValueError where the body stops being a valid JSON array.
+	"""
+	decoder = json.JSONDecoder()
+	text_decoder = codecs.getincrementaldecoder("utf-8-sig")()
+	buffer = ""
+	position = 0
+	at_end = False
+
+	def read_block() -> bool:
+		# drops what has been decoded from the buffer and adds the next block of the body. False once the body has been read to the end
+		nonlocal buffer, position, at_end
+		if at_end:
+			return False
+		block = stream.read(BULK_JSON_BLOCK_BYTES)
+		at_end = not block
+		buffer = buffer[position:] + text_decoder.decode(block, final=at_end)
+		position = 0
+		return True
+
+	def next_character() -> str:
+		# skips whitespace. "" at the end of the body
+		nonlocal position
+		while True:
+			while position < len(buffer) and buffer[position].isspace():
+				position += 1
+			if position < len(buffer):
+				return buffer[position]
+			if not read_block():
+				return ""
+
+	if next_character() != "[":
+		raise ValueError("Expected '[' at the start of the body")
+	position += 1
+	if next_character() == "]":
+		return
+	while True:
+		next_character()
+		while True:
+			try:
+				item, item_end = decoder.raw_decode(buffer, position)
+				# a number at the end of the buffer may carry on in the next block
+				if item_end < len(buffer) or at_end:
+					break
+			except ValueError:
+				# the item may just be cut off at the end of the buffer
+				if at_end:
+					raise
+			read_block()
+		position = item_end
+		yield item
+		separator = next_character()
+		position += 1
+		if separator == "]":
+			return
+		if separator != ",":
+			raise ValueError(f"Expected ',' or ']' after item but found {separator!r}" if separator else "The body ended before the closing ']'")
+
+
+def _iterate_lines(stream) -> Iterator[bytes]:
+	while True:
+		line = stream.readline()
+		if not line:
+			return
+		yield line
+
+
+class _Prefixed_Stream:
+	# puts back the bytes consumed while sniffing the content type
+	def __init__(self, prefix: bytes, stream):
+		self.prefix = prefix
+		self.stream = stream
+
+	def read(self, size: int = -1) -> bytes:
+		prefix, self.prefix = self.prefix, b""
+		if size is None or size < 0:
+			return prefix + self.stream.read()
+		return prefix + self.stream.read(max(size - len(prefix), 0))
+
+	def readline(self) -> bytes:
+		prefix, self.prefix = self.prefix, b""
+		if prefix.endswith(b"\n"):
+			return prefix
+		return prefix + self.stream.readline()
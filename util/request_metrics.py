@@ -0,0 +1,207 @@
+"""
+Times each stage of handling a request, and keeps the totals for every request served by this process.
+
+Code anywhere in a request wraps each stage with `with time_stage("slice"):`, and can add to a count with count_request_metric().
+Both do nothing outside of a request, so the util functions can be called on their own (eg by the benchmarks) at no cost.
+Stages may be nested, in which case time spent in the inner stage is not also counted in the outer one, so the stages of a request add up to its total.
+"""
+import contextvars
+import datetime
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+METRIC_NAME_PREFIX = "geocoding_server"
+
+# Upper bound in seconds of each latency histogram bucket. The last bucket (+Inf) is implied.
+LATENCY_BUCKETS: Tuple[float, ...] = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Counts which may be recorded with count_request_metric(), and their descriptions
+REQUEST_COUNTS: Dict[str, str] = {
+	"input_segments": "Number of road network segments matched by slice requests",
+	"output_vertices": "Number of vertices in sliced geometry",
+	"response_bytes": "Number of bytes in response bodies (streamed responses are not counted)",
+}
+
+_current_request_timer: contextvars.ContextVar = contextvars.ContextVar("current_request_timer", default=None)
+
+
+class Request_Timer:
+	def __init__(self):
+		self.start: float = time.perf_counter()
+		# seconds spent in each stage, in the order the stages first started
+		self.stage_seconds: Dict[str, float] = {}
+		self.counts: Dict[str, int] = {}
+		self.output_type: str = ""
+		self.error: Optional[str] = None
+		self._token = None
+		# time spent in the nested stages of each stage currently running
+		self._nested_seconds: List[float] = []
+
+	def server_timing(self) -> str:
+		"""
+		:return: the value of a Server-Timing header, eg "parse;dur=0.120, slice;dur=3.400, total;dur=4.100". Durations are in milliseconds.
+		"""
+		return ", ".join(f"{stage};dur={seconds * 1000:.3f}" for stage, seconds in self.stage_seconds.items())
+
+
+def start_request_timer() -> Request_Timer:
+	request_timer = Request_Timer()
+	request_timer._token = _current_request_timer.set(request_timer)
+	return request_timer
+
+
+def finish_request_timer(request_timer: Request_Timer) -> None:
+	# The total is the time to produce the response. The body of a streamed response is produced afterwards, and is not included.
+	request_timer.stage_seconds["total"] = time.perf_counter() - request_timer.start
+	if request_timer._token is not None:
+		_current_request_timer.reset(request_timer._token)
+		request_timer._token = None
+
+
+def current_request_timer() -> Optional[Request_Timer]:
+	return _current_request_timer.get()
+
+
+@contextmanager
+def time_stage(stage: str):
+	request_timer = _current_request_timer.get()
+	if request_timer is None:
+		yield
+		return
+	start = time.perf_counter()
+	request_timer._nested_seconds.append(0)
+	try:
+		yield
+	finally:
+		elapsed = time.perf_counter() - start
+		request_timer.stage_seconds[stage] = request_timer.stage_seconds.get(stage, 0) + elapsed - request_timer._nested_seconds.pop()
+		if request_timer._nested_seconds:
+			request_timer._nested_seconds[-1] += elapsed
+
+
+def count_request_metric(name: str, value: int) -> None:
+	request_timer = _current_request_timer.get()
+	if request_timer is not None:
+		request_timer.counts[name] = request_timer.counts.get(name, 0) + value
+
+
+def record_request_error(error: str) -> None:
+	"""
+	:param error: the kind of error, which becomes the `error` label of the error counter. eg "parse", "slice" or "unknown"
+	"""
+	request_timer = _current_request_timer.get()
+	if request_timer is not None:
+		request_timer.error = error
+
+
+class Request_Metrics:
+	"""
+	Totals of the Request_Timer of every finished request, written in the Prometheus text format by exposition().
+	Each worker process (see serve_workers()) has its own totals.
+	"""
+
+	def __init__(self, latency_buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+		self.latency_buckets = latency_buckets
+		self._lock = threading.Lock()
+		# keyed by (route, stage, output_type). The last bucket count is for +Inf
+		self._latency_bucket_counts: Dict[Tuple[str, str, str], List[int]] = {}
+		self._latency_sum: Dict[Tuple[str, str, str], float] = {}
+		self._requests: Dict[Tuple[str, str], int] = {}
+		self._errors: Dict[Tuple[str, str], int] = {}
+		self._counts: Dict[Tuple[str, str, str], int] = {}
+
+	def observe(self, route: str, status: int, request_timer: Request_Timer) -> None:
+		with self._lock:
+			for stage, seconds in request_timer.stage_seconds.items():
+				key = (route, stage, request_timer.output_type)
+				bucket_counts = self._latency_bucket_counts.get(key)
+				if bucket_counts is None:
+					bucket_counts = self._latency_bucket_counts[key] = [0] * (len(self.latency_buckets) + 1)
+					self._latency_sum[key] = 0
+				bucket_counts[_bucket_position(self.latency_buckets, seconds)] += 1
+				self._latency_sum[key] += seconds
+			self._requests[(route, str(status))] = self._requests.get((route, str(status)), 0) + 1
+			if request_timer.error is not None:
+				self._errors[(route, request_timer.error)] = self._errors.get((route, request_timer.error), 0) + 1
+			for name, value in request_timer.counts.items():
+				key = (name, route, request_timer.output_type)
+				self._counts[key] = self._counts.get(key, 0) + value
+
+	def exposition(self) -> str:
+		lines = []
+		with self._lock:
+			name = f"{METRIC_NAME_PREFIX}_stage_seconds"
+			lines.append(f"# HELP {name} Time spent in each stage of handling a request. The stage \"total\" covers the whole request.")
+			lines.append(f"# TYPE {name} histogram")
+			for (route, stage, output_type), bucket_counts in sorted(self._latency_bucket_counts.items()):
+				labels = f'route="{_escape(route)}",stage="{_escape(stage)}",output_type="{_escape(output_type)}"'
+				cumulative_count = 0
+				for upper_bound, bucket_count in zip(self.latency_buckets + ("+Inf",), bucket_counts):
+					cumulative_count += bucket_count
+					lines.append(f'{name}_bucket{{{labels},le="{upper_bound}"}} {cumulative_count}')
+				lines.append(f"{name}_sum{{{labels}}} {self._latency_sum[(route, stage, output_type)]!r}")
+				lines.append(f"{name}_count{{{labels}}} {cumulative_count}")
+
+			name = f"{METRIC_NAME_PREFIX}_requests_total"
+			lines.append(f"# HELP {name} Number of requests, by response status")
+			lines.append(f"# TYPE {name} counter")
+			for (route, status), value in sorted(self._requests.items()):
+				lines.append(f'{name}{{route="{_escape(route)}",status="{status}"}} {value}')
+
+			name = f"{METRIC_NAME_PREFIX}_errors_total"
+			lines.append(f"# HELP {name} Number of requests which failed, by the kind of error")
+			lines.append(f"# TYPE {name} counter")
+			for (route, error), value in sorted(self._errors.items()):
+				lines.append(f'{name}{{route="{_escape(route)}",error="{_escape(error)}"}} {value}')
+
+			for count_name, description in REQUEST_COUNTS.items():
+				name = f"{METRIC_NAME_PREFIX}_{count_name}_total"
+				lines.append(f"# HELP {name} {description}")
+				lines.append(f"# TYPE {name} counter")
+				for (key_name, route, output_type), value in sorted(self._counts.items()):
+					if key_name == count_name:
+						lines.append(f'{name}{{route="{_escape(route)}",output_type="{_escape(output_type)}"}} {value}')
+		return "\n".join(lines) + "\n"
+
+
+class Slow_Request_Log:
+	"""
+	Writes one JSON line with the full query and the time spent in each stage for every request slower than threshold_seconds.
+	Lines are printed, or appended to the file at `path` if it is provided. A threshold of None disables the log.
+	"""
+
+	def __init__(self, threshold_seconds: Optional[float] = None, path: Optional[str] = None):
+		self.threshold_seconds = threshold_seconds
+		self.path = path
+		self._lock = threading.Lock()
+
+	def record(self, full_path: str, status: int, request_timer: Request_Timer) -> None:
+		if self.threshold_seconds is None or request_timer.stage_seconds.get("total", 0) < self.threshold_seconds:
+			return
+		line = json.dumps({
+			"time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+			"query": full_path,
+			"status": status,
+			"seconds": request_timer.stage_seconds,
+			"counts": request_timer.counts,
+		})
+		if self.path is None:
+			print(f"Slow request: {line}")
+			return
+		with self._lock:
+			with open(self.path, "a") as log_file:
+				log_file.write(line + "\n")
+
+
+def _bucket_position(latency_buckets: Tuple[float, ...], seconds: float) -> int:
+	for position, upper_bound in enumerate(latency_buckets):
+		if seconds <= upper_bound:
+			return position
+	return len(latency_buckets)
+
+
+def _escape(label_value: str) -> str:
+	return label_value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
@@ -0,0 +1,95 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple, Hashable
+
+from werkzeug.datastructures import ETags
+
+from util.parse_request_parameters import Slice_Request_Args
+
+
+class Response_Cache:
+	"""
+	Least recently used cache of serialised responses, bounded by the total size of the cached responses in bytes.
+	Safe to share between the threads of one server process.
+	"""
+
+	def __init__(self, max_bytes: int, max_entry_bytes: Optional[int] = None):
+		self.max_bytes = max_bytes
+		# responses bigger than this are not cached at all, so that one huge response can't flush everything else
+		self.max_entry_bytes = max_entry_bytes if max_entry_bytes is not None else max_bytes // 8
+		self.current_bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self._entries: "OrderedDict[Hashable, bytes]" = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key: Hashable) -> Optional[bytes]:
+		with self._lock:
+			value = self._entries.get(key)
+			if value is None:
+				self.misses += 1
+				return None
+			self._entries.move_to_end(key)
+			self.hits += 1
+			return value
+
+	def put(self, key: Hashable, value: bytes) -> None:
+		if len(value) > self.max_entry_bytes:
+			return
+		with self._lock:
+			previous_value = self._entries.pop(key, None)
+			if previous_value is not None:
+				self.current_bytes -= len(previous_value)
+			self._entries[key] = value
+			self.current_bytes += len(value)
+			while self.current_bytes > self.max_bytes:
+				_, evicted_value = self._entries.popitem(last=False)
+				self.current_bytes -= len(evicted_value)
+				self.evictions += 1
+
+	def clear(self) -> None:
+		with self._lock:
+			self._entries.clear()
+			self.current_bytes = 0
+
+	def stats(self) -> dict:
+		with self._lock:
+			return {
+				"entries": len(self._entries),
+				"bytes": self.current_bytes,
+				"max_bytes": self.max_bytes,
+				"hits": self.hits,
+				"misses": self.misses,
+				"evictions": self.evictions,
+			}
+
+
+def response_cache_key(network_version: str, slice_requests: List[Slice_Request_Args], output_format: Hashable) -> Tuple:
+	"""
+	Requests which differ only in the case or padding of road numbers, the order of carriageway letters or the order of each SLK pair
+	produce the same response, and so are given the same key. parse_request_parameters() has already sorted cway and swapped the SLKs.
+	:param output_format: everything else which changes the response body. eg (output type, merge, precision)
+	"""
+	return (
+		network_version,
+		output_format,
+		tuple(
+			(item.road.strip().upper(), item.slk_from, item.slk_to, item.offset, item.cway, item.interval)
+			for item in slice_requests
+		)
+	)
+
+
+def response_etag(cache_key: Tuple) -> str:
+	# The network version is part of the key, so the ETag changes whenever a new network is loaded.
+	return hashlib.sha1(repr(cache_key).encode("utf-8")).hexdigest()
+
+
+def etag_matches(if_none_match: ETags, etag: str) -> bool:
+	"""
+	:return: True if the If-None-Match header lists etag itself. "If-None-Match: *" is not a match: the ETag is known before the request is sliced,
+		and a request which then fails must get its error rather than a 304.
+	"""
+	return etag in if_none_match.as_set(include_weak=True)
@@ -0,0 +1,84 @@
+from dataclasses import dataclass
+from typing import Optional, List
+
+import numpy as np
+
+from util.convert_metres_to_degrees import convert_metres_to_degrees, convert_degrees_to_metres
+from util.road_network import Road_Network
+from util.road_network_index import REQUEST_CARRIAGEWAY_BITMASK
+
+class Reverse_Geocode_Exception(Exception):
+	def __init__(self, message):
+		super().__init__(message)
+		self.message = message
+
+
+@dataclass
+class Reverse_Geocode_Result:
+	road: str
+	# the CWY value of the road ("Left", "Right" or "Single"), the same as in the other outputs of this server
+	cway: str
+	slk: float
+	# metres. Positive values are to the right of the road (in the slk direction), the same as the `offset` url parameter
+	offset: float
+	# metres from the requested point to the nearest point on the road
+	distance: float
+	# nearest point on the road
+	lon: float
+	lat: float
+
+
+def reverse_geocode(road_network: Road_Network, lat: float, lon: float, roads: Optional[List[str]] = None, cway: str = "LRS", radius_metres: Optional[float] = None) -> Optional[Reverse_Geocode_Result]:
+	"""
+	Finds the road segment nearest to (lat, lon), and the SLK and offset of the point relative to that segment.
+	SLK is interpolated in proportion to the distance along the segment, the same way the segment is cut by sample_linestring_batch(),
+	so slicing the network at the returned slk and offset gives back the original point.
+	:param roads: if provided, only these roads are searched
+	:param cway: only these carriageways are searched. Any combination of the letters L, R and S
+	:param radius_metres: if provided, segments further away than this are ignored
+	:return: None if there is no segment within the search radius
+	"""
+	carriageway_mask = REQUEST_CARRIAGEWAY_BITMASK.get(cway)
+	if carriageway_mask is None:
+		raise Reverse_Geocode_Exception(f"Invalid carriageway parameter: {cway}. Must be any combination of the three letters 'L', 'R' and 'S'.")
+
+	road_codes = None
+	if roads is not None:
+		road_codes = [road_network.index.road_codes[road] for road in (item.strip().upper() for item in roads) if road in road_network.index.road_codes]
+		if not road_codes:
+			return None
+
+	nearest = road_network.spatial_index.nearest(
+		lon,
+		lat,
+		max_distance=convert_metres_to_degrees(radius_metres) if radius_metres is not None else np.inf,
+		road_codes=road_codes,
+		carriageway_mask=carriageway_mask
+	)
+	if nearest is None:
+		return None
+	step, fraction, distance = nearest
+
+	geometry = road_network.geometry
+	row = int(np.searchsorted(geometry.vertex_offsets, step, side="right") - 1)
+	step_start = geometry.coordinates[step]
+	nearest_point = step_start + (geometry.coordinates[step + 1] - step_start) * fraction
+
+	start_slk = float(road_network.start_slk[row])
+	end_slk = float(road_network.end_slk[row])
+	segment_length = float(geometry.segment_length[row])
+	distance_along = geometry.cumulative_length[step] + (geometry.cumulative_length[step + 1] - geometry.cumulative_length[step]) * fraction
+	slk = start_slk + (end_slk - start_slk) * distance_along / segment_length if segment_length > 0 else start_slk
+
+	# The nearest point is usually square to the step, but may be off the end of it near a vertex. Either way, the side is given by the step normal.
+	side = np.sign(np.dot(np.array([lon, lat]) - nearest_point, geometry.step_normal[step]))
+
+	return Reverse_Geocode_Result(
+		road=str(road_network.road[row]),
+		cway=str(road_network.carriageway[row]),
+		slk=float(slk),
+		offset=float(side * convert_degrees_to_metres(distance)),
+		distance=float(convert_degrees_to_metres(distance)),
+		lon=float(nearest_point[0]),
+		lat=float(nearest_point[1]),
+	)
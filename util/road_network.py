@@ -0,0 +1,133 @@
+from typing import Sequence, Optional, Dict
+
+import numpy as np
+import pandas as pd
+from geopandas import GeoDataFrame
+from shapely.geometry import MultiLineString
+
+from util.road_network_geometry import Road_Network_Geometry
+from util.road_network_index import Road_Network_Index
+from util.road_network_spatial_index import Road_Network_Spatial_Index
+from util.road_network_tile_levels import Road_Network_Tile_Levels
+
+# The only attribute columns of the road network used by this server
+ROAD_NETWORK_COLUMNS = ["ROAD", "START_SLK", "END_SLK", "CWY"]
+
+
+class Road_Network:
+	"""
+	One release of the road network: its attribute columns, flat geometry, the index used to find segments by road and slk,
+	the spatial index used to find segments near a point, and the simplified geometry used to draw map tiles.
+	`version` identifies the source data the network was loaded from.
+	"""
+
+	def __init__(
+		self,
+		road: Sequence[str],
+		start_slk: np.ndarray,
+		end_slk: np.ndarray,
+		carriageway: Sequence[str],
+		geometry: Road_Network_Geometry,
+		version: str,
+		tile_levels: Optional[Road_Network_Tile_Levels] = None,
+		index: Optional[Road_Network_Index] = None,
+		spatial_index: Optional[Road_Network_Spatial_Index] = None
+	):
+		self.road = road
+		self.start_slk: np.ndarray = start_slk
+		self.end_slk: np.ndarray = end_slk
+		self.carriageway = carriageway
+		self.geometry: Road_Network_Geometry = geometry
+		self.version: str = version
+		# the index, spatial index and tile levels are compiled into the snapshot with the geometry, or else built now
+		self.index: Road_Network_Index = index if index is not None else Road_Network_Index.from_columns(road, start_slk, end_slk, carriageway)
+		self.spatial_index: Road_Network_Spatial_Index = spatial_index if spatial_index is not None else Road_Network_Spatial_Index.from_geometry(geometry, self.index)
+		self.tile_levels: Road_Network_Tile_Levels = tile_levels if tile_levels is not None else Road_Network_Tile_Levels.from_geometry(geometry)
+
+	@classmethod
+	def from_geodataframe(cls, all_road_segments: GeoDataFrame, version: str) -> "Road_Network":
+		return cls(
+			all_road_segments["ROAD"].to_numpy(),
+			all_road_segments["START_SLK"].to_numpy(dtype="f8"),
+			all_road_segments["END_SLK"].to_numpy(dtype="f8"),
+			all_road_segments["CWY"].to_numpy(),
+			Road_Network_Geometry.from_geodataframe(all_road_segments),
+			version
+		)
+
+	def __len__(self):
+		return len(self.start_slk)
+
+	def memory_usage(self) -> Dict[str, int]:
+		"""
+		:return: bytes held by the arrays of each part of the network. Arrays memory-mapped from a snapshot are counted in full,
+			although only the pages which have been read are resident, and those are shared by every worker process.
+		"""
+		return {
+			"attributes": sum(_array_bytes(item) for item in (self.road, self.start_slk, self.end_slk, self.carriageway)),
+			"geometry": _array_bytes(vars(self.geometry)),
+			"index": _array_bytes(vars(self.index)),
+			"spatial_index": _array_bytes(vars(self.spatial_index)),
+			"tile_levels": _array_bytes(vars(self.tile_levels)),
+		}
+
+	def memory_usage_by_road(self) -> pd.Series:
+		"""
+		:return: bytes of attributes and geometry held for the segments of each road, largest first.
+			Each segment is charged for its share of every array with one item per segment or per vertex.
+		"""
+		segment_count = len(self)
+		vertex_count = len(self.geometry.coordinates)
+		arrays = [self.start_slk, self.end_slk, *vars(self.geometry).values(), *vars(self.index).values()]
+		bytes_per_segment = sum(item.nbytes / segment_count for item in arrays if isinstance(item, np.ndarray) and len(item) in (segment_count, segment_count + 1))
+		bytes_per_vertex = sum(item.nbytes / vertex_count for item in arrays if isinstance(item, np.ndarray) and len(item) == vertex_count and vertex_count != segment_count)
+		segment_bytes = bytes_per_segment + bytes_per_vertex * np.diff(self.geometry.vertex_offsets)
+		road = pd.Series(np.asarray(self.road, dtype=object)).astype("category")
+		return pd.Series(segment_bytes).groupby(road, observed=True).sum().sort_values(ascending=False)
+
+	def memory_report(self) -> str:
+		"""
+		:return: a summary of memory_usage() and memory_usage_by_road(), printed when a network is loaded
+		"""
+		memory_usage = self.memory_usage()
+		by_road = self.memory_usage_by_road()
+		return (
+			f"Road network version {self.version}: {len(self):,} segments on {len(by_road):,} roads in {_format_bytes(sum(memory_usage.values()))} "
+			f"({', '.join(f'{name} {_format_bytes(value)}' for name, value in memory_usage.items())}). "
+			f"Per road {_format_bytes(by_road.mean() if len(by_road) else 0)} on average; largest {', '.join(f'{road} {_format_bytes(value)}' for road, value in by_road.head(3).items())}"
+		)
+
+	def rows(self, row_position: np.ndarray) -> GeoDataFrame:
+		"""
+		:return: a GeoDataFrame of only the requested rows, indexed by row position. Shapely geometry is only built for these rows.
+		"""
+		return GeoDataFrame(
+			{
+				"ROAD": np.asarray(self.road[row_position], dtype=object),
+				"START_SLK": self.start_slk[row_position],
+				"END_SLK": self.end_slk[row_position],
+				"CWY": np.asarray(self.carriageway[row_position], dtype=object),
+				"geometry": [_multilinestring(self.geometry.segment_coordinates(position)) for position in row_position],
+			},
+			index=pd.Index(row_position),
+			geometry="geometry"
+		)
+
+
+def _multilinestring(coordinates: np.ndarray) -> Optional[MultiLineString]:
+	return MultiLineString([coordinates]) if len(coordinates) >= 2 else None
+
+
+def _array_bytes(value) -> int:
+	# bytes of the numpy arrays and categoricals in value, which may also be a list or dict of them. Anything else is not counted.
+	if isinstance(value, (np.ndarray, pd.Categorical)):
+		return int(value.nbytes)
+	if isinstance(value, (list, tuple)):
+		return sum(_array_bytes(item) for item in value)
+	if isinstance(value, dict):
+		return sum(_array_bytes(item) for item in value.values())
+	return 0
+
+
+def _format_bytes(value: float) -> str:
+	return f"{value / 1e6:.1f} MB" if value >= 1e6 else f"{value / 1e3:.1f} kB"
@@ -0,0 +1,85 @@
+from typing import List
+
+import numpy as np
+from geopandas import GeoDataFrame
+
+
+class Road_Network_Geometry:
+	"""
+	The vertices of every segment in the road network packed into one flat coordinate buffer.
+	The coordinates of segment i are coordinates[vertex_offsets[i]:vertex_offsets[i+1]],
+	and cumulative_length holds the distance (in data units) from the start of that segment to each of its vertices.
+	Both are built once when the network is loaded (or read from a snapshot, see network_snapshot.py) so that cutting a segment never needs to measure it again.
+	"""
+
+	def __init__(self, coordinates: np.ndarray, vertex_offsets: np.ndarray, running_length: np.ndarray, cumulative_length: np.ndarray, segment_length: np.ndarray, step_direction: np.ndarray, step_normal: np.ndarray):
+		self.coordinates: np.ndarray = coordinates
+		self.vertex_offsets: np.ndarray = vertex_offsets
+		# running_length increases monotonically over the whole buffer, so it can be bisected for many segments at once.
+		self.running_length: np.ndarray = running_length
+		self.cumulative_length: np.ndarray = cumulative_length
+		self.segment_length: np.ndarray = segment_length
+		# step_direction[i] is the direction (radians anticlockwise from east) of the straight step from vertex i to vertex i+1,
+		# and step_normal[i] is the unit vector pointing to the right of that step. The last vertex of each segment repeats the step before it.
+		# Zero length steps take the direction of the nearest step in the same segment that has some length.
+		self.step_direction: np.ndarray = step_direction
+		self.step_normal: np.ndarray = step_normal
+
+	@classmethod
+	def from_coordinates(cls, coordinates: np.ndarray, vertex_offsets: np.ndarray) -> "Road_Network_Geometry":
+		vertex_count = np.diff(vertex_offsets)
+		has_vertices = vertex_count > 0
+		segment_start = vertex_offsets[:-1][has_vertices]
+
+		step_length = np.zeros(len(coordinates), dtype="f8")
+		step_length[1:] = np.hypot(*np.diff(coordinates, axis=0).T)
+		# The step onto the first vertex of each segment comes from the previous segment. Discard it.
+		step_length[segment_start] = 0
+
+		running_length = np.cumsum(step_length)
+		cumulative_length = running_length - np.repeat(running_length[segment_start], vertex_count[has_vertices])
+		segment_length = np.zeros(len(vertex_count), dtype="f8")
+		segment_length[has_vertices] = cumulative_length[vertex_offsets[1:][has_vertices] - 1]
+
+		vertex_number = np.arange(len(coordinates))
+		vertex_segment_start = np.repeat(vertex_offsets[:-1], vertex_count)
+		vertex_segment_end = np.repeat(vertex_offsets[1:], vertex_count)
+		step_delta = np.zeros((len(coordinates), 2), dtype="f8")
+		step_delta[:-1] = np.diff(coordinates, axis=0)
+		step_has_length = (vertex_number < vertex_segment_end - 1) & np.any(step_delta != 0, axis=1)
+		# fill the other steps from the previous step with length, or failing that the next one
+		previous_step = np.maximum.accumulate(np.where(step_has_length, vertex_number, -1))
+		next_step = np.minimum.accumulate(np.where(step_has_length, vertex_number, len(coordinates))[::-1])[::-1]
+		source_step = np.where(previous_step >= vertex_segment_start, previous_step, next_step)
+		source_step_in_segment = source_step < vertex_segment_end
+		source_step = np.where(source_step_in_segment, source_step, vertex_number)
+		step_direction = np.where(
+			source_step_in_segment,
+			np.arctan2(step_delta[source_step, 1], step_delta[source_step, 0]),
+			0
+		)
+		step_normal = np.column_stack((np.sin(step_direction), -np.cos(step_direction)))
+		return cls(coordinates, vertex_offsets, running_length, cumulative_length, segment_length, step_direction, step_normal)
+
+	@classmethod
+	def from_geodataframe(cls, all_road_segments: GeoDataFrame) -> "Road_Network_Geometry":
+		# Only the first LineString of each MultiLineString is ever used. See sample_linestring()
+		segment_coordinates: List[np.ndarray] = []
+		for geometry in all_road_segments.geometry:
+			if geometry is not None and geometry.geom_type == "MultiLineString" and len(geometry.geoms) > 0:
+				segment_coordinates.append(np.asarray(geometry.geoms[0].coords, dtype="f8")[:, :2])
+			elif geometry is not None and geometry.geom_type == "LineString":
+				segment_coordinates.append(np.asarray(geometry.coords, dtype="f8")[:, :2])
+			else:
+				segment_coordinates.append(np.empty((0, 2), dtype="f8"))
+
+		vertex_offsets = np.zeros(len(segment_coordinates) + 1, dtype="i8")
+		vertex_offsets[1:] = np.cumsum([len(item) for item in segment_coordinates])
+		coordinates = np.concatenate(segment_coordinates) if segment_coordinates else np.empty((0, 2), dtype="f8")
+		return cls.from_coordinates(coordinates, vertex_offsets)
+
+	def segment_coordinates(self, segment_position: int) -> np.ndarray:
+		return self.coordinates[self.vertex_offsets[segment_position]:self.vertex_offsets[segment_position + 1]]
+
+	def segment_cumulative_length(self, segment_position: int) -> np.ndarray:
+		return self.cumulative_length[self.vertex_offsets[segment_position]:self.vertex_offsets[segment_position + 1]]
@@ -0,0 +1,177 @@
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from geopandas import GeoDataFrame
+
+# dtype of the (road code, slk) pairs which lookup_many() bisects. See _road_slk_key()
+ROAD_SLK_KEY_DTYPE = np.dtype([("road", "i8"), ("slk", "f8")])
+
+# Bit assigned to each value of the CWY column in the road network data
+CARRIAGEWAY_BITMASK: Dict[str, int] = {
+	"Left": 0b001,
+	"Right": 0b010,
+	"Single": 0b100,
+}
+
+# Bitmask for each of the (sorted) carriageway parameters accepted from the user. See parse_request_parameters().
+# "LRS" matches every segment, including any with an unexpected CWY value, the same as when no filter is applied at all.
+REQUEST_CARRIAGEWAY_BITMASK: Dict[str, int] = {
+	"L": 0b001,
+	"R": 0b010,
+	"S": 0b100,
+	"LR": 0b011,
+	"LS": 0b101,
+	"RS": 0b110,
+	"LRS": 0xFF,
+}
+
+
+class Road_Network_Index:
+	"""
+	Built once so that finding the segments for a slice request costs a dictionary lookup plus a bisect,
+	rather than a scan over every row of the road network.
+	Segments are grouped by road number and sorted by START_SLK within each group. The arrays below are all in that sorted order;
+	`row_position` maps each entry back to its position in the original dataframe.
+	Like the geometry, the arrays are built when the network is compiled into a snapshot (see network_snapshot.py) and memory-mapped from there.
+	"""
+
+	def __init__(
+		self,
+		road_names: Sequence[str],
+		row_position: np.ndarray,
+		start_slk: np.ndarray,
+		end_slk: np.ndarray,
+		carriageway_mask: np.ndarray,
+		group_bounds: np.ndarray,
+		end_slk_running_max: np.ndarray,
+		start_slk_key: np.ndarray,
+		end_slk_running_max_key: np.ndarray
+	):
+		self.road_codes: Dict[str, int] = {str(name): code for code, name in enumerate(road_names)}
+		self._road_names: pd.Index = pd.Index(list(self.road_codes))
+		self.row_position: np.ndarray = row_position
+		self.start_slk: np.ndarray = start_slk
+		self.end_slk: np.ndarray = end_slk
+		self.carriageway_mask: np.ndarray = carriageway_mask
+		# group_bounds[code]:group_bounds[code+1] is the slice of the sorted arrays belonging to a road
+		self.group_bounds: np.ndarray = group_bounds
+		# Segments on different carriageways overlap, so END_SLK is not sorted even though START_SLK is.
+		# The running maximum of END_SLK within each road is sorted, and lets us bisect for the first segment that could reach slk_from.
+		self.end_slk_running_max: np.ndarray = end_slk_running_max
+		# (road code, slk) pairs compare lexicographically, which lets numpy bisect within every road group at once. See lookup_many()
+		self._start_slk_key: np.ndarray = start_slk_key
+		self._end_slk_running_max_key: np.ndarray = end_slk_running_max_key
+
+	@classmethod
+	def from_columns(cls, road: np.ndarray, start_slk: np.ndarray, end_slk: np.ndarray, carriageway: np.ndarray) -> "Road_Network_Index":
+		"""
+		Sorts the segments of the network into a new index. The road names of the index are sorted, the same as pd.factorize(road, sort=True).
+		"""
+		road_code, road_names = pd.factorize(road, sort=True)
+		start_slk = np.asarray(start_slk, dtype="f8")
+		end_slk = np.asarray(end_slk, dtype="f8")
+
+		# rows with a missing road number can never be matched by a request. Leave them out of the index.
+		row_position = np.flatnonzero(road_code >= 0)
+		row_position = row_position[np.lexsort((start_slk[row_position], road_code[row_position]))]
+
+		sorted_road_code = road_code[row_position]
+		sorted_start_slk = start_slk[row_position]
+		sorted_end_slk = end_slk[row_position]
+		group_bounds = np.searchsorted(sorted_road_code, np.arange(len(road_names) + 1))
+
+		# fmax is used so that a missing END_SLK does not poison the rest of the group
+		end_slk_running_max = np.empty_like(sorted_end_slk)
+		for group_start, group_end in zip(group_bounds[:-1], group_bounds[1:]):
+			end_slk_running_max[group_start:group_end] = np.fmax.accumulate(sorted_end_slk[group_start:group_end])
+
+		return cls(
+			road_names,
+			row_position,
+			sorted_start_slk,
+			sorted_end_slk,
+			pd.Series(np.asarray(carriageway, dtype=object)).map(CARRIAGEWAY_BITMASK).fillna(0).to_numpy(dtype="u1")[row_position],
+			group_bounds,
+			end_slk_running_max,
+			_road_slk_key(sorted_road_code, sorted_start_slk),
+			_road_slk_key(sorted_road_code, end_slk_running_max)
+		)
+
+	@classmethod
+	def from_geodataframe(cls, all_road_segments: GeoDataFrame) -> "Road_Network_Index":
+		return cls.from_columns(
+			all_road_segments["ROAD"].to_numpy(),
+			all_road_segments["START_SLK"].to_numpy(),
+			all_road_segments["END_SLK"].to_numpy(),
+			all_road_segments["CWY"].to_numpy(),
+		)
+
+	def lookup(self, road: str, slk_from: float, slk_to: float, carriageway_mask: int) -> np.ndarray:
+		"""
+		:return: the positions of the rows in the original dataframe where ROAD matches, START_SLK <= slk_to, END_SLK >= slk_from and CWY is in carriageway_mask.
+			Positions are returned in ascending order so that the rows come back in the same order as a boolean mask over the dataframe would produce.
+		"""
+		return self.row_position[self._lookup_sorted_position(road, slk_from, slk_to, carriageway_mask)]
+
+	def lookup_many(self, roads: Sequence[str], slk_from: np.ndarray, slk_to: np.ndarray, carriageway_mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+		"""
+		The same as lookup() but for many requests at once, without looping over the requests in python.
+		:return: (request_number, row_position, sorted_position) for every matching pair of request and row,
+			ordered by request number then by row position.
+			sorted_position is where the row can be found in the sorted arrays of this index (start_slk, end_slk etc.)
+		"""
+		if len(roads) == 1:
+			# a single request is cheaper to look up with a dictionary and two bisects than with the array operations below
+			sorted_position = self._lookup_sorted_position(roads[0], float(slk_from[0]), float(slk_to[0]), int(carriageway_mask[0]))
+			return np.zeros(len(sorted_position), dtype="i8"), self.row_position[sorted_position], sorted_position
+
+		road_code = self._road_names.get_indexer(pd.Series(roads, dtype=object).str.strip().str.upper())
+
+		upper = np.searchsorted(self._start_slk_key, _road_slk_key(road_code, slk_to), side="right")
+		lower = np.searchsorted(self._end_slk_running_max_key, _road_slk_key(road_code, slk_from), side="left")
+		candidate_count = np.where(road_code >= 0, np.maximum(upper - lower, 0), 0)
+
+		request_number = np.repeat(np.arange(len(road_code)), candidate_count)
+		first_candidate = np.cumsum(candidate_count) - candidate_count
+		sorted_position = np.repeat(lower - first_candidate, candidate_count) + np.arange(candidate_count.sum())
+
+		request_carriageway_mask = np.asarray(carriageway_mask)[request_number]
+		keep = (
+			(self.end_slk[sorted_position] >= np.asarray(slk_from)[request_number])
+			& (
+				(request_carriageway_mask == REQUEST_CARRIAGEWAY_BITMASK["LRS"])
+				| ((self.carriageway_mask[sorted_position] & request_carriageway_mask) != 0)
+			)
+		)
+		request_number = request_number[keep]
+		sorted_position = sorted_position[keep]
+		row_position = self.row_position[sorted_position]
+
+		order = np.lexsort((row_position, request_number))
+		return request_number[order], row_position[order], sorted_position[order]
+
+	def _lookup_sorted_position(self, road: str, slk_from: float, slk_to: float, carriageway_mask: int) -> np.ndarray:
+		# the sorted positions of the rows lookup() returns, ordered by row position
+		road_code = self.road_codes.get(road.strip().upper())
+		if road_code is None:
+			return np.empty(0, dtype="i8")
+		group_start = int(self.group_bounds[road_code])
+		group_end = int(self.group_bounds[road_code + 1])
+		upper = group_start + int(np.searchsorted(self.start_slk[group_start:group_end], slk_to, side="right"))
+		lower = group_start + int(np.searchsorted(self.end_slk_running_max[group_start:group_end], slk_from, side="left"))
+		if upper <= lower:
+			return np.empty(0, dtype="i8")
+
+		keep = self.end_slk[lower:upper] >= slk_from
+		if carriageway_mask != REQUEST_CARRIAGEWAY_BITMASK["LRS"]:
+			keep &= (self.carriageway_mask[lower:upper] & carriageway_mask) != 0
+		sorted_position = lower + np.flatnonzero(keep)
+		return sorted_position[np.argsort(self.row_position[sorted_position], kind="stable")]
+
+
+def _road_slk_key(road_code: np.ndarray, slk: np.ndarray) -> np.ndarray:
+	key = np.empty(len(road_code), dtype=ROAD_SLK_KEY_DTYPE)
+	key["road"] = road_code
+	key["slk"] = slk
+	return key
@@ -0,0 +1,135 @@
+import datetime
+import gc
+import threading
+import time
+import traceback
+from typing import Callable, Optional, Dict, Any
+
+from util.network_snapshot import open_road_network, read_snapshot_manifest, read_source_signature
+from util.road_network import Road_Network
+
+
+class Road_Network_Reloader:
+	"""
+	Loads a new release of the road network in a background thread while the current one keeps serving, then swaps it in.
+
+	The new network is fully loaded and indexed before on_reload(new_road_network) is called to swap it in, so requests never wait for a load.
+	Requests which started before the swap keep the network they started with until they finish; the old network is released as soon as they do.
+
+	A reload is started by reload(), or by the watcher (see start_watching()) when the source or the snapshot changes.
+	Threads do not survive a fork, so the watcher must be started in each worker process, after it has been forked.
+	"""
+
+	def __init__(self, road_network: Road_Network, source_path: str, layer: Optional[str], snapshot_path: str, on_reload: Callable[[Road_Network], None]):
+		self.road_network = road_network
+		self.source_path = source_path
+		self.snapshot_path = snapshot_path
+		# the layer the network was loaded from. When no layer was requested, it is whichever layer the snapshot was compiled from
+		self.layer = layer if layer is not None else self._snapshot_layer()
+		self.on_reload = on_reload
+		self.loaded_at = datetime.datetime.now(datetime.timezone.utc)
+		self.last_error: Optional[str] = None
+		self._reload_lock = threading.Lock()
+		self._reload_thread: Optional[threading.Thread] = None
+		self._watch_lock = threading.Lock()
+		self._watch_thread: Optional[threading.Thread] = None
+		# the source signature seen by the last check of the watcher. See _check_for_changes()
+		self._last_source_signature = None
+
+	def reload(self, layer: Optional[str] = None, wait: bool = False) -> bool:
+		"""
+		Starts loading the network from the source (recompiling the snapshot if the source has changed) in a background thread.
+		:param layer: load this layer instead of the current one
+		:param wait: wait for the reload to finish before returning
+		:return: False if a reload was already in progress, in which case no new one is started
+		"""
+		if not self._reload_lock.acquire(blocking=False):
+			return False
+		self._reload_thread = threading.Thread(target=self._reload, args=(layer if layer is not None else self.layer,), name="road_network_reload", daemon=True)
+		self._reload_thread.start()
+		if wait:
+			self._reload_thread.join()
+		return True
+
+	@property
+	def reloading(self) -> bool:
+		return self._reload_lock.locked()
+
+	def status(self) -> Dict[str, Any]:
+		return {
+			"version": self.road_network.version,
+			"layer": self.layer,
+			"loaded_at": self.loaded_at.isoformat(),
+			"rows": len(self.road_network),
+			"reloading": self.reloading,
+			"last_error": self.last_error,
+		}
+
+	def start_watching(self, interval_seconds: float) -> None:
+		"""
+		Checks the source and the snapshot for changes every interval_seconds, and reloads when either has changed. Does nothing if the watcher is already running in this process.
+		"""
+		with self._watch_lock:
+			if self._watch_thread is not None and self._watch_thread.is_alive():
+				return
+			self._watch_thread = threading.Thread(target=self._watch, args=(interval_seconds,), name="road_network_watcher", daemon=True)
+			self._watch_thread.start()
+
+	def _reload(self, layer: Optional[str]) -> None:
+		try:
+			started_at = datetime.datetime.now(datetime.timezone.utc)
+			new_road_network = open_road_network(self.source_path, layer, self.snapshot_path)
+			self.layer = layer if layer is not None else self._snapshot_layer()
+			if new_road_network.version == self.road_network.version:
+				print(f"Road network is already up to date (version {new_road_network.version})")
+			else:
+				old_version = self.road_network.version
+				self.road_network = new_road_network
+				self.on_reload(new_road_network)
+				self.loaded_at = datetime.datetime.now(datetime.timezone.utc)
+				print(f"Road network reloaded in {(self.loaded_at - started_at).total_seconds():.1f}s. Version {old_version} was replaced by {new_road_network.version}")
+			self.last_error = None
+		except Exception as e:
+			traceback.print_exc()
+			self.last_error = f"{type(e).__name__}: {e}"
+			print(f"Road network reload failed. Still serving version {self.road_network.version}. {self.last_error}")
+		finally:
+			# The old network may be kept alive by reference cycles (eg through a traceback); collect them now rather than whenever gc next runs
+			gc.collect()
+			self._reload_lock.release()
+
+	def _snapshot_layer(self) -> Optional[str]:
+		return (read_snapshot_manifest(self.snapshot_path) or {}).get("layer")
+
+	def _watch(self, interval_seconds: float) -> None:
+		while True:
+			time.sleep(interval_seconds)
+			try:
+				self._check_for_changes()
+			except Exception as e:
+				print(f"Road network watcher could not check for changes: {e!r}")
+
+	def _check_for_changes(self) -> None:
+		if self.reloading:
+			return
+		manifest = read_snapshot_manifest(self.snapshot_path)
+		if manifest is not None and manifest.get("version") != self.road_network.version:
+			# The snapshot was recompiled by another worker process, or a new snapshot was deployed. Load it with whichever layer it was compiled from.
+			self.reload(layer=manifest.get("layer"))
+			return
+
+		try:
+			source_signature = read_source_signature(self.source_path)
+		except OSError:
+			# the source is missing, or is being replaced
+			self._last_source_signature = None
+			return
+		if manifest is not None and source_signature == manifest["source_signature"]:
+			self._last_source_signature = None
+			return
+		# Only reload once the source has stopped changing between two checks, so that a release which is still being copied into place is not loaded
+		if source_signature == self._last_source_signature:
+			self._last_source_signature = None
+			self.reload()
+		else:
+			self._last_source_signature = source_signature
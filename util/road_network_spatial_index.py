@@ -0,0 +1,249 @@
+import heapq
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from util.road_network_geometry import Road_Network_Geometry
+from util.road_network_index import Road_Network_Index, REQUEST_CARRIAGEWAY_BITMASK
+
+# Number of children of each node of the tree
+SPATIAL_INDEX_NODE_SIZE = 16
+
+
+class Road_Network_Spatial_Index:
+	"""
+	A packed R-tree over every step (the straight line between two consecutive vertices) of the road network geometry.
+	Steps are sorted along a hilbert curve and then grouped SPATIAL_INDEX_NODE_SIZE at a time into leaf nodes,
+	which are grouped again into parent nodes and so on. Since every node's children are consecutive, the tree is just one array of bounding boxes per level.
+	Like the rest of the network it is built when the network is compiled into a snapshot (see network_snapshot.py),
+	and is memory-mapped from there and shared by every worker process.
+	"""
+
+	def __init__(
+		self,
+		geometry: Road_Network_Geometry,
+		node_size: int,
+		road_code_count: int,
+		row_road_code: np.ndarray,
+		row_carriageway_mask: np.ndarray,
+		step: np.ndarray,
+		node_bounds: List[np.ndarray]
+	):
+		self.geometry: Road_Network_Geometry = geometry
+		self.node_size: int = node_size
+		# road code and carriageway of each row of the network, in the original row order, so that search results can be filtered
+		self.road_code_count: int = road_code_count
+		self.row_road_code: np.ndarray = row_road_code
+		self.row_carriageway_mask: np.ndarray = row_carriageway_mask
+		# the first vertex of each step, in the order of the leaves of the tree
+		self.step: np.ndarray = step
+		# level 0 holds the bounds of the leaf nodes; the last level holds the root nodes
+		self.node_bounds: List[np.ndarray] = node_bounds
+
+	@classmethod
+	def from_geometry(cls, geometry: Road_Network_Geometry, index: Road_Network_Index, node_size: int = SPATIAL_INDEX_NODE_SIZE) -> "Road_Network_Spatial_Index":
+		row_count = len(geometry.vertex_offsets) - 1
+		road_code_count = len(index.group_bounds) - 1
+		row_road_code = np.full(row_count, -1, dtype="i8")
+		row_road_code[index.row_position] = np.repeat(np.arange(road_code_count), np.diff(index.group_bounds))
+		row_carriageway_mask = np.zeros(row_count, dtype="u1")
+		row_carriageway_mask[index.row_position] = index.carriageway_mask
+
+		# step i runs from vertex i to vertex i+1. The last vertex of each segment does not start a step.
+		vertex_count = np.diff(geometry.vertex_offsets)
+		vertex_segment_end = np.repeat(geometry.vertex_offsets[1:], vertex_count)
+		step = np.flatnonzero(np.arange(len(geometry.coordinates)) < vertex_segment_end - 1)
+
+		step_start = geometry.coordinates[step]
+		step_end = geometry.coordinates[step + 1]
+		step_bounds = np.column_stack((np.minimum(step_start, step_end), np.maximum(step_start, step_end)))
+		order = np.argsort(_hilbert_distance((step_bounds[:, :2] + step_bounds[:, 2:]) / 2), kind="stable")
+
+		node_bounds = []
+		child_bounds = step_bounds[order]
+		while True:
+			node_start = np.arange(0, len(child_bounds), node_size)
+			if len(node_start) == 0:
+				break
+			node_bounds.append(np.column_stack((
+				np.minimum.reduceat(child_bounds[:, 0], node_start),
+				np.minimum.reduceat(child_bounds[:, 1], node_start),
+				np.maximum.reduceat(child_bounds[:, 2], node_start),
+				np.maximum.reduceat(child_bounds[:, 3], node_start),
+			)))
+			child_bounds = node_bounds[-1]
+			if len(child_bounds) <= node_size:
+				break
+
+		return cls(geometry, node_size, road_code_count, row_road_code, row_carriageway_mask, step[order], node_bounds)
+
+	def nearest(self, x: float, y: float, max_distance: float = np.inf, road_codes: Optional[np.ndarray] = None, carriageway_mask: int = REQUEST_CARRIAGEWAY_BITMASK["LRS"]) -> Optional[Tuple[int, float, float]]:
+		"""
+		Finds the step nearest to (x, y), searching the tree nodes in order of their distance from the point.
+		:param max_distance: in data units. Steps further away than this are ignored
+		:param road_codes: if provided, only steps on these roads (see Road_Network_Index.road_codes) are considered
+		:param carriageway_mask: only steps on these carriageways are considered. see REQUEST_CARRIAGEWAY_BITMASK
+		:return: (step, fraction, distance) where step is the index of the first vertex of the step in geometry.coordinates,
+			and fraction is how far along the step the nearest point is, from 0 to 1. None if no step matched.
+		"""
+		allowed_road = None
+		if road_codes is not None:
+			# the extra last entry is for rows without a road code (-1), which never match
+			allowed_road = np.zeros(self.road_code_count + 1, dtype=bool)
+			allowed_road[np.asarray(road_codes, dtype="i8")] = True
+
+		# heap entries are (distance, level, position). level -1 means position is a step, otherwise it is a node of that level
+		top_level = len(self.node_bounds) - 1
+		heap: List[Tuple[float, int, int]] = []
+		if top_level >= 0:
+			for position, distance in enumerate(_box_distance(self.node_bounds[top_level], x, y).tolist()):
+				if distance <= max_distance:
+					heap.append((distance, top_level, position))
+			heapq.heapify(heap)
+
+		while heap:
+			distance, level, position = heapq.heappop(heap)
+			if level < 0:
+				fraction, distance = _step_distance(self.geometry.coordinates, np.array([position]), x, y)
+				return position, float(fraction[0]), float(distance[0])
+
+			child_start = position * self.node_size
+			if level > 0:
+				child_distance = _box_distance(self.node_bounds[level - 1][child_start:child_start + self.node_size], x, y)
+				for child_position, child_distance_item in enumerate(child_distance.tolist(), start=child_start):
+					if child_distance_item <= max_distance:
+						heapq.heappush(heap, (child_distance_item, level - 1, child_position))
+				continue
+
+			step = self.step[child_start:child_start + self.node_size]
+			row = np.searchsorted(self.geometry.vertex_offsets, step, side="right") - 1
+			keep = np.ones(len(step), dtype=bool)
+			if allowed_road is not None:
+				keep &= allowed_road[self.row_road_code[row]]
+			if carriageway_mask != REQUEST_CARRIAGEWAY_BITMASK["LRS"]:
+				keep &= (self.row_carriageway_mask[row] & carriageway_mask) != 0
+			step = step[keep]
+			_, step_distance = _step_distance(self.geometry.coordinates, step, x, y)
+			for step_item, step_distance_item in zip(step.tolist(), step_distance.tolist()):
+				if step_distance_item <= max_distance:
+					heapq.heappush(heap, (step_distance_item, -1, step_item))
+
+		return None
+
+	def intersecting_steps(self, min_x: float, min_y: float, max_x: float, max_y: float) -> np.ndarray:
+		"""
+		Finds every step whose bounding box intersects the box, searching each level of the tree at once.
+		Nodes which lie wholly inside the box are not searched any further, since every step below them is a match.
+		:return: the index of the first vertex of each matching step in geometry.coordinates, in no particular order
+		"""
+		top_level = len(self.node_bounds) - 1
+		if top_level < 0:
+			return np.empty(0, dtype=self.step.dtype)
+
+		# ranges of self.step whose steps all match
+		match_start: List[np.ndarray] = []
+		match_end: List[np.ndarray] = []
+		position = np.arange(len(self.node_bounds[top_level]))
+		for level in range(top_level, -1, -1):
+			bounds = self.node_bounds[level][position]
+			intersects = (bounds[:, 0] <= max_x) & (bounds[:, 1] <= max_y) & (bounds[:, 2] >= min_x) & (bounds[:, 3] >= min_y)
+			inside = intersects & (bounds[:, 0] >= min_x) & (bounds[:, 1] >= min_y) & (bounds[:, 2] <= max_x) & (bounds[:, 3] <= max_y)
+			# a node of this level covers node_size ** (level + 1) consecutive steps
+			steps_per_node = self.node_size ** (level + 1)
+			match_start.append(position[inside] * steps_per_node)
+			match_end.append(np.minimum((position[inside] + 1) * steps_per_node, len(self.step)))
+
+			position = position[intersects & ~inside]
+			position = (position[:, np.newaxis] * self.node_size + np.arange(self.node_size)).ravel()
+			position = position[position < (len(self.node_bounds[level - 1]) if level > 0 else len(self.step))]
+
+		# position now holds the steps of leaf nodes which were only partly inside the box. Check each of them.
+		step = self.step[position]
+		step_start = self.geometry.coordinates[step]
+		step_end = self.geometry.coordinates[step + 1]
+		step_intersects = (
+			(np.minimum(step_start[:, 0], step_end[:, 0]) <= max_x) & (np.minimum(step_start[:, 1], step_end[:, 1]) <= max_y)
+			& (np.maximum(step_start[:, 0], step_end[:, 0]) >= min_x) & (np.maximum(step_start[:, 1], step_end[:, 1]) >= min_y)
+		)
+
+		match_start = np.concatenate(match_start)
+		match_count = np.concatenate(match_end) - match_start
+		match_position = np.arange(match_count.sum()) - np.repeat(np.cumsum(match_count) - match_count - match_start, match_count)
+		return np.concatenate([self.step[match_position], step[step_intersects]])
+
+
+def _box_distance(bounds: np.ndarray, x: float, y: float) -> np.ndarray:
+	# zero inside the box
+	dx = np.maximum(np.maximum(bounds[:, 0] - x, x - bounds[:, 2]), 0)
+	dy = np.maximum(np.maximum(bounds[:, 1] - y, y - bounds[:, 3]), 0)
+	return np.hypot(dx, dy)
+
+
+def _step_distance(coordinates: np.ndarray, step: np.ndarray, x: float, y: float) -> Tuple[np.ndarray, np.ndarray]:
+	step_start = coordinates[step]
+	step_delta = coordinates[step + 1] - step_start
+	step_length_squared = np.einsum("ij,ij->i", step_delta, step_delta)
+	with np.errstate(invalid="ignore", divide="ignore"):
+		fraction = ((x - step_start[:, 0]) * step_delta[:, 0] + (y - step_start[:, 1]) * step_delta[:, 1]) / step_length_squared
+	fraction = np.where(step_length_squared > 0, np.clip(fraction, 0, 1), 0)
+	nearest = step_start + step_delta * fraction[:, np.newaxis]
+	return fraction, np.hypot(nearest[:, 0] - x, nearest[:, 1] - y)
+
+
+def _hilbert_distance(points: np.ndarray) -> np.ndarray:
+	"""
+	Position of each point along a hilbert curve filling the bounding box of all the points, on a 65536 x 65536 grid.
+	The same bit twiddling algorithm as https://github.com/mourner/flatbush, applied to whole arrays at once.
+	"""
+	if len(points) == 0:
+		return np.empty(0, dtype="u4")
+	minimum = points.min(axis=0)
+	extent = points.max(axis=0) - minimum
+	extent[extent == 0] = 1
+	grid = np.floor(0xFFFF * (points - minimum) / extent).astype("u4")
+	x = grid[:, 0]
+	y = grid[:, 1]
+
+	a = x ^ y
+	b = 0xFFFF ^ a
+	c = 0xFFFF ^ (x | y)
+	d = x & (y ^ 0xFFFF)
+
+	A = a | (b >> 1)
+	B = (a >> 1) ^ a
+	C = ((c >> 1) ^ (b & (d >> 1))) ^ c
+	D = ((a & (c >> 1)) ^ (d >> 1)) ^ d
+
+	a, b, c, d = A, B, C, D
+	A = (a & (a >> 2)) ^ (b & (b >> 2))
+	B = (a & (b >> 2)) ^ (b & ((a ^ b) >> 2))
+	C = C ^ ((a & (c >> 2)) ^ (b & (d >> 2)))
+	D = D ^ ((b & (c >> 2)) ^ ((a ^ b) & (d >> 2)))
+
+	a, b, c, d = A, B, C, D
+	A = (a & (a >> 4)) ^ (b & (b >> 4))
+	B = (a & (b >> 4)) ^ (b & ((a ^ b) >> 4))
+	C = C ^ ((a & (c >> 4)) ^ (b & (d >> 4)))
+	D = D ^ ((b & (c >> 4)) ^ ((a ^ b) & (d >> 4)))
+
+	a, b, c, d = A, B, C, D
+	C = C ^ ((a & (c >> 8)) ^ (b & (d >> 8)))
+	D = D ^ ((b & (c >> 8)) ^ ((a ^ b) & (d >> 8)))
+
+	a = C ^ (C >> 1)
+	b = D ^ (D >> 1)
+
+	i0 = x ^ y
+	i1 = b | (0xFFFF ^ (i0 | a))
+
+	i0 = (i0 | (i0 << 8)) & 0x00FF00FF
+	i0 = (i0 | (i0 << 4)) & 0x0F0F0F0F
+	i0 = (i0 | (i0 << 2)) & 0x33333333
+	i0 = (i0 | (i0 << 1)) & 0x55555555
+
+	i1 = (i1 | (i1 << 8)) & 0x00FF00FF
+	i1 = (i1 | (i1 << 4)) & 0x0F0F0F0F
+	i1 = (i1 | (i1 << 2)) & 0x33333333
+	i1 = (i1 | (i1 << 1)) & 0x55555555
+
+	return (i1 << 1) | i0
@@ -0,0 +1,70 @@
+from typing import Dict, Optional
+
+import numpy as np
+
+from util.road_network_geometry import Road_Network_Geometry
+
+# Zoom levels at which a simplified copy of the network geometry is kept. Each is used for tiles at its own zoom level and the next one;
+# tiles beyond the last are drawn from the full geometry.
+SIMPLIFIED_ZOOM_LEVELS = (0, 2, 4, 6, 8, 10, 12)
+
+# Web mercator stops short of the poles
+MAX_WEB_MERCATOR_LATITUDE = 85.0511287798066
+
+# Each web mercator tile is drawn 256 pixels across
+TILE_PIXELS_LOG2 = 8
+
+
+class Road_Network_Tile_Levels:
+	"""
+	Simplified copies of the road network geometry for drawing tiles at low zoom levels, one for each of SIMPLIFIED_ZOOM_LEVELS.
+	Each level keeps only the first vertex of each segment which falls in each pixel of the next zoom level (plus the last vertex of the segment),
+	so a tile never carries many vertices that could not be seen. Segments always keep their first and last vertex, so they still join up.
+	vertex[zoom] holds the positions in geometry.coordinates of the vertices kept at that level;
+	those of segment i are vertex[zoom][vertex_offsets[zoom][i]:vertex_offsets[zoom][i+1]].
+	Like the geometry they are built once when the network is compiled into a snapshot (see network_snapshot.py).
+	"""
+
+	def __init__(self, vertex: Dict[int, np.ndarray], vertex_offsets: Dict[int, np.ndarray]):
+		self.vertex: Dict[int, np.ndarray] = vertex
+		self.vertex_offsets: Dict[int, np.ndarray] = vertex_offsets
+
+	@classmethod
+	def from_geometry(cls, geometry: Road_Network_Geometry) -> "Road_Network_Tile_Levels":
+		world = web_mercator_world_coordinates(geometry.coordinates)
+		vertex_count = np.diff(geometry.vertex_offsets)
+		is_first = np.zeros(len(geometry.coordinates), dtype=bool)
+		is_first[geometry.vertex_offsets[:-1][vertex_count > 0]] = True
+		is_last = np.zeros(len(geometry.coordinates), dtype=bool)
+		is_last[geometry.vertex_offsets[1:][vertex_count > 0] - 1] = True
+
+		vertex = {}
+		vertex_offsets = {}
+		for zoom in SIMPLIFIED_ZOOM_LEVELS:
+			pixel = np.floor(world * 2 ** (zoom + 1 + TILE_PIXELS_LOG2)).astype("i8")
+			enters_pixel = np.ones(len(pixel), dtype=bool)
+			enters_pixel[1:] = np.any(pixel[1:] != pixel[:-1], axis=1)
+			vertex[zoom] = np.flatnonzero(is_first | is_last | enters_pixel)
+			# the number of kept vertices before the first vertex of each segment
+			vertex_offsets[zoom] = np.searchsorted(vertex[zoom], geometry.vertex_offsets)
+		return cls(vertex, vertex_offsets)
+
+	def level(self, zoom: int) -> Optional[int]:
+		"""
+		:return: the simplified level to draw tiles at this zoom level from, or None if they should be drawn from the full geometry
+		"""
+		usable_levels = [level for level in self.vertex if level <= zoom <= level + 1]
+		return max(usable_levels) if usable_levels else None
+
+
+def web_mercator_world_coordinates(coordinates: np.ndarray) -> np.ndarray:
+	"""
+	:param coordinates: (lon, lat) in degrees
+	:return: position of each point on the web mercator map of the whole world, from (0, 0) at the north west corner to (1, 1) at the south east corner
+	"""
+	coordinates = np.asarray(coordinates, dtype="f8")
+	latitude = np.radians(np.clip(coordinates[:, 1], -MAX_WEB_MERCATOR_LATITUDE, MAX_WEB_MERCATOR_LATITUDE))
+	return np.column_stack((
+		(coordinates[:, 0] + 180) / 360,
+		(1 - np.arcsinh(np.tan(latitude)) / np.pi) / 2,
+	))
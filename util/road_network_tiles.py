@@ -0,0 +1,193 @@
+"""
+Mapbox vector tiles of the road network and of slice results, which the map served by `?show` draws instead of downloading the full geometry. See /tiles/ in app.py
+
+Tiles follow the usual web mercator XYZ scheme: at zoom level z the world is 2**z tiles across, counted from the north west corner.
+Geometry is written at VECTOR_TILE_EXTENT units across each tile, and vertices which land on the same unit as the vertex before them are dropped.
+Rather than being clipped exactly at the edge of the tile, a line is cut at the first vertex beyond a margin of TILE_BUFFER units around the tile; the map clips the rest when it draws.
+
+Tiles of the road network are drawn from the segments found by the spatial index (see Road_Network_Spatial_Index.intersecting_steps()),
+and at low zoom levels from the simplified geometry compiled with the network (see Road_Network_Tile_Levels).
+"""
+from typing import List, Tuple
+
+import numpy as np
+
+from util.parse_request_parameters import Slice_Request_Args
+from util.request_metrics import time_stage
+from util.road_network import Road_Network
+from util.road_network_tile_levels import web_mercator_world_coordinates
+from util.sample_linestring_batch import Sample_Batch_Result
+from util.write_mapbox_vector_tile import write_vector_tile_layer, VECTOR_TILE_EXTENT, VECTOR_TILE_GEOMETRY_TYPES
+
+VECTOR_TILE_CONTENT_TYPE = "application/vnd.mapbox-vector-tile"
+
+# Tiles are served up to this zoom level. Maps can show deeper zoom levels by scaling these tiles up.
+MAX_TILE_ZOOM = 16
+
+# margin around each tile, in tile units, within which lines are still drawn so that thick lines are not cut short at the edge of the tile
+TILE_BUFFER = 64
+
+ROAD_NETWORK_TILE_LAYER = "road_network"
+SLICE_RESULT_TILE_LAYER = "slice_result"
+
+
+class Vector_Tile_Exception(Exception):
+	def __init__(self, message):
+		super().__init__(message)
+		self.message = message
+
+
+def check_tile_coordinates(zoom: int, x: int, y: int) -> None:
+	if not 0 <= zoom <= MAX_TILE_ZOOM:
+		raise Vector_Tile_Exception(f"error: tile zoom level {zoom} is out of range. Tiles are available from zoom level 0 to {MAX_TILE_ZOOM}.")
+	if not (0 <= x < 2 ** zoom and 0 <= y < 2 ** zoom):
+		raise Vector_Tile_Exception(f"error: tile {zoom}/{x}/{y} does not exist. At zoom level {zoom} x and y must be from 0 to {2 ** zoom - 1}.")
+
+
+def tile_bounds(zoom: int, x: int, y: int, buffer: float = 0) -> Tuple[float, float, float, float]:
+	"""
+	:param buffer: margin to add around the tile, in tile units
+	:return: (min lon, min lat, max lon, max lat) of the tile
+	"""
+	tile_count = 2 ** zoom
+	margin = buffer / VECTOR_TILE_EXTENT
+	west, east = ((x - margin) / tile_count * 360 - 180, (x + 1 + margin) / tile_count * 360 - 180)
+	north, south = (
+		float(np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (tile_y / tile_count))))))
+		for tile_y in (y - margin, y + 1 + margin)
+	)
+	return west, south, east, north
+
+
+def write_road_network_tile(road_network: Road_Network, zoom: int, x: int, y: int) -> bytes:
+	"""
+	:return: a tile with one layer holding the segments of the network which cross the tile, with their ROAD, CWY, START_SLK and END_SLK. Each feature's id is the row of its segment.
+	"""
+	geometry = road_network.geometry
+	with time_stage("lookup"):
+		step = road_network.spatial_index.intersecting_steps(*tile_bounds(zoom, x, y, TILE_BUFFER))
+		# the rows with at least one step found
+		step_count_before = np.zeros(len(geometry.coordinates) + 1, dtype="i8")
+		np.cumsum(np.bincount(step, minlength=len(geometry.coordinates)), out=step_count_before[1:])
+		row = np.flatnonzero(step_count_before[geometry.vertex_offsets[1:]] > step_count_before[geometry.vertex_offsets[:-1]])
+
+	level = road_network.tile_levels.level(zoom)
+	if level is None:
+		vertex, part_offsets = _concatenated_ranges(geometry.vertex_offsets[row], geometry.vertex_offsets[row + 1])
+	else:
+		level_vertex_position, part_offsets = _concatenated_ranges(road_network.tile_levels.vertex_offsets[level][row], road_network.tile_levels.vertex_offsets[level][row + 1])
+		vertex = road_network.tile_levels.vertex[level][level_vertex_position]
+
+	tile_coordinates, part_offsets, part_source = _tile_parts(geometry.coordinates[vertex], part_offsets, np.zeros(len(row), dtype=bool), zoom, x, y)
+	feature_part_offsets = _feature_part_offsets(part_source)
+	feature_row = row[part_source[feature_part_offsets[:-1]]]
+	return write_vector_tile_layer(
+		ROAD_NETWORK_TILE_LAYER,
+		np.full(len(feature_row), VECTOR_TILE_GEOMETRY_TYPES["LineString"]),
+		tile_coordinates,
+		part_offsets,
+		feature_part_offsets,
+		{
+			"ROAD": np.asarray(road_network.road[feature_row], dtype=str),
+			"CWY": np.asarray(road_network.carriageway[feature_row], dtype=str),
+			"START_SLK": road_network.start_slk[feature_row],
+			"END_SLK": road_network.end_slk[feature_row],
+		},
+		feature_id=feature_row
+	)
+
+
+def write_slice_result_tile(batch_result: Sample_Batch_Result, slice_requests: List[Slice_Request_Args], zoom: int, x: int, y: int) -> bytes:
+	"""
+	:return: a tile with one layer holding every part of the slice result which crosses the tile, with the road, slk_from, slk_to, offset and cway of the slice request that produced it.
+		Each feature's id is the position of its part in the result.
+	"""
+	# Only the parts whose bounding box comes near the tile are projected
+	min_lon, min_lat, max_lon, max_lat = tile_bounds(zoom, x, y, TILE_BUFFER)
+	part_first_vertex = batch_result.part_offsets[:-1]
+	part_count = len(part_first_vertex)
+	if part_count > 0:
+		near_tile = (
+			(np.minimum.reduceat(batch_result.coordinates[:, 0], part_first_vertex) <= max_lon)
+			& (np.minimum.reduceat(batch_result.coordinates[:, 1], part_first_vertex) <= max_lat)
+			& (np.maximum.reduceat(batch_result.coordinates[:, 0], part_first_vertex) >= min_lon)
+			& (np.maximum.reduceat(batch_result.coordinates[:, 1], part_first_vertex) >= min_lat)
+		)
+	else:
+		near_tile = np.zeros(0, dtype=bool)
+	part = np.flatnonzero(near_tile)
+	vertex, part_offsets = _concatenated_ranges(batch_result.part_offsets[part], batch_result.part_offsets[part + 1])
+
+	tile_coordinates, part_offsets, part_source = _tile_parts(batch_result.coordinates[vertex], part_offsets, batch_result.is_point[part], zoom, x, y)
+	feature_part_offsets = _feature_part_offsets(part_source)
+	feature_part = part[part_source[feature_part_offsets[:-1]]]
+	feature_request = [slice_requests[request_number] for request_number in batch_result.request_number[feature_part].tolist()]
+	return write_vector_tile_layer(
+		SLICE_RESULT_TILE_LAYER,
+		np.where(batch_result.is_point[feature_part], VECTOR_TILE_GEOMETRY_TYPES["Point"], VECTOR_TILE_GEOMETRY_TYPES["LineString"]),
+		tile_coordinates,
+		part_offsets,
+		feature_part_offsets,
+		{
+			"road": np.array([item.road for item in feature_request], dtype=str),
+			"slk_from": np.array([item.slk_from for item in feature_request], dtype="f8"),
+			"slk_to": np.array([item.slk_to for item in feature_request], dtype="f8"),
+			"offset": np.array([item.offset for item in feature_request], dtype="f8"),
+			"cway": np.array([item.cway for item in feature_request], dtype=str),
+		},
+		feature_id=feature_part
+	)
+
+
+def _tile_parts(coordinates: np.ndarray, part_offsets: np.ndarray, part_is_point: np.ndarray, zoom: int, x: int, y: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+	"""
+	Projects lines and points into the tile, drops repeated vertices and cuts lines down to the steps which cross the tile (see the module docstring).
+	A line may be cut into several parts, and lines which end up shorter than one tile unit are left out.
+	:return: (tile coordinates, part offsets, the input part each output part came from)
+	"""
+	tile_coordinates = np.round((web_mercator_world_coordinates(coordinates) * 2 ** zoom - (x, y)) * VECTOR_TILE_EXTENT).astype("i8")
+	vertex_count = np.diff(part_offsets)
+	vertex_part = np.repeat(np.arange(len(vertex_count)), vertex_count)
+	is_first = np.zeros(len(tile_coordinates), dtype=bool)
+	is_first[part_offsets[:-1][vertex_count > 0]] = True
+	is_repeated = np.zeros(len(tile_coordinates), dtype=bool)
+	is_repeated[1:] = np.all(tile_coordinates[1:] == tile_coordinates[:-1], axis=1)
+	keep = is_first | ~is_repeated
+	tile_coordinates, vertex_part, is_first = tile_coordinates[keep], vertex_part[keep], is_first[keep]
+
+	is_point = part_is_point[vertex_part]
+	is_last = np.ones(len(tile_coordinates), dtype=bool)
+	is_last[:-1] = is_first[1:]
+	low, high = -TILE_BUFFER, VECTOR_TILE_EXTENT + TILE_BUFFER
+	is_inside = np.all((tile_coordinates >= low) & (tile_coordinates <= high), axis=1)
+	# step i runs from vertex i to the next vertex of the same line. Keep the vertices at either end of each step which crosses the buffered tile
+	step_end = np.roll(tile_coordinates, -1, axis=0)
+	step_crosses = ~is_last & ~is_point & np.all(
+		(np.minimum(tile_coordinates, step_end) <= high) & (np.maximum(tile_coordinates, step_end) >= low),
+		axis=1
+	)
+	step_before_crosses = np.zeros(len(tile_coordinates), dtype=bool)
+	step_before_crosses[1:] = step_crosses[:-1] & ~is_first[1:]
+	keep = np.where(is_point, is_inside, step_crosses | step_before_crosses)
+	starts_part = (is_point | ~step_before_crosses)[keep]
+
+	vertex_part = vertex_part[keep]
+	new_part_offsets = np.append(np.flatnonzero(starts_part), np.count_nonzero(keep))
+	return tile_coordinates[keep], new_part_offsets, vertex_part[starts_part]
+
+
+def _feature_part_offsets(part_source: np.ndarray) -> np.ndarray:
+	# consecutive parts which came from the same input part make up one feature
+	starts_feature = np.ones(len(part_source), dtype=bool)
+	starts_feature[1:] = part_source[1:] != part_source[:-1]
+	return np.append(np.flatnonzero(starts_feature), len(part_source))
+
+
+def _concatenated_ranges(start: np.ndarray, end: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+	"""
+	:return: the integers from start[i] up to end[i] for every i one after the other, and the offset of each range in the result
+	"""
+	count = end - start
+	offsets = np.zeros(len(count) + 1, dtype="i8")
+	offsets[1:] = np.cumsum(count)
+	return np.arange(offsets[-1]) - np.repeat(offsets[:-1] - start, count), offsets
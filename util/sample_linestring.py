@@ -4,14 +4,16 @@ from typing import List, Union
 from geopandas import GeoDataFrame
 from shapely.geometry import LineString, Point, MultiLineString
 
-from util.cut_linestring import double_cut_linestring
+from util.cut_linestring import double_cut_coordinates
 from util.get_point_along_linestring_with_offset import get_point_along_linestring_with_offset
 from util.convert_metres_to_degrees import convert_metres_to_degrees
+from util.road_network_geometry import Road_Network_Geometry
 
 
-def sample_linestring(road_segments: GeoDataFrame, slk_cut_first: float, slk_cut_second: float = None, offset_metres: float = 0) -> List[Union[Point, LineString]]:
+def sample_linestring(road_segments: GeoDataFrame, road_network_geometry: Road_Network_Geometry, slk_cut_first: float, slk_cut_second: float = None, offset_metres: float = 0) -> List[Union[Point, LineString]]:
 	"""
-	:param road_segments: from a single road number
+	:param road_segments: from a single road number. The index of each row must be its position in the full road network (as returned by filter_dataframe()).
+	:param road_network_geometry: precomputed coordinates and cumulative lengths for the full road network
 	:param slk_cut_first:
 	:param slk_cut_second:
 	:param offset_metres:
@@ -46,9 +48,17 @@ def sample_linestring(road_segments: GeoDataFrame, slk_cut_first: float, slk_cut
 					)
 				
 		elif OUTPUT_LINESTRING:
-			_, segment, _ = double_cut_linestring(linestring, row_slk_from, row_slk_to, slk_cut_first, slk_cut_second)
-			if segment is None or segment.is_empty:
+			segment_coordinates = double_cut_coordinates(
+				road_network_geometry.segment_coordinates(index),
+				road_network_geometry.segment_cumulative_length(index),
+				row_slk_from,
+				row_slk_to,
+				slk_cut_first,
+				slk_cut_second
+			)
+			if segment_coordinates is None:
 				continue
+			segment = LineString(segment_coordinates)
 			if offset_metres == 0:
 				output.append(segment)
 			else:
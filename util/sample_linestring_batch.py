@@ -0,0 +1,329 @@
+from dataclasses import dataclass
+from typing import List, Union, Optional, Tuple
+
+import numpy as np
+from shapely.geometry import LineString, Point
+
+from util.convert_metres_to_degrees import convert_metres_to_degrees
+from util.parse_request_parameters import Slice_Request_Args
+from util.request_metrics import time_stage, count_request_metric
+from util.road_network import Road_Network
+from util.road_network_geometry import Road_Network_Geometry
+from util.road_network_index import REQUEST_CARRIAGEWAY_BITMASK
+
+
+# How offset lines are joined at each vertex: "mitre" extends the offset steps until they meet, unless the resulting vertex
+# would be more than OFFSET_LINE_MITRE_LIMIT times the offset distance from the original vertex, in which case the corner is bevelled.
+# "bevel" always joins the offset steps with a straight line.
+OFFSET_LINE_JOIN = "mitre"
+OFFSET_LINE_MITRE_LIMIT = 2.0
+
+# Line parts shorter than this fraction of their segment are floating point noise at a segment boundary, and are left out
+LINE_PART_MINIMUM_FRACTION = 1e-09
+
+
+class Slice_Network_Exception(Exception):
+	def __init__(self, message):
+		super().__init__(message)
+		self.message = message
+
+
+@dataclass
+class Sample_Batch_Result:
+	"""
+	Output of sample_linestring_batch(). Every part is either a single point or a linestring;
+	the coordinates of part i are coordinates[part_offsets[i]:part_offsets[i+1]].
+	Parts are ordered by request_number, and within each request they are in the same order sample_linestring() would produce them.
+	The points of an interval request are instead ordered by slk, then by carriageway.
+	"""
+	request_number: np.ndarray
+	is_point: np.ndarray
+	coordinates: np.ndarray
+	part_offsets: np.ndarray
+	# the slk of each point part. NaN for linestrings
+	slk: np.ndarray
+	# the row of the road network each part was cut from
+	row_position: np.ndarray
+
+	def geometries(self, request_number: Optional[int] = None) -> List[Union[Point, LineString]]:
+		"""
+		:param request_number: if provided, only the parts produced by that slice request are returned
+		:return: shapely geometries equivalent to those returned by sample_linestring()
+		"""
+		if request_number is None:
+			part_range = range(len(self.request_number))
+		else:
+			part_range = range(*np.searchsorted(self.request_number, (request_number, request_number + 1)))
+		return [
+			Point(self.coordinates[self.part_offsets[part]]) if self.is_point[part]
+			else LineString(self.coordinates[self.part_offsets[part]:self.part_offsets[part + 1]])
+			for part in part_range
+		]
+
+
+def sample_linestring_batch(slice_requests: List[Slice_Request_Args], road_network: Road_Network, join: str = OFFSET_LINE_JOIN, mitre_limit: float = OFFSET_LINE_MITRE_LIMIT) -> Sample_Batch_Result:
+	"""
+	Equivalent to calling filter_dataframe() then sample_linestring() for each slice request,
+	but matches requests to segments, cuts and offsets using array operations over every request at once.
+	Unlike sample_linestring(), offset lines are not produced with shapely's parallel_offset; see _offset_lines().
+	:param join: "mitre" or "bevel". see OFFSET_LINE_JOIN
+	"""
+	if join not in ("mitre", "bevel"):
+		raise ValueError(f"join must be 'mitre' or 'bevel', not {join!r}")
+	road_network_index = road_network.index
+	road_network_geometry = road_network.geometry
+	
+	carriageway_mask = []
+	for slice_request in slice_requests:
+		if slice_request.cway not in REQUEST_CARRIAGEWAY_BITMASK:
+			raise Slice_Network_Exception(f"Invalid carriageway parameter: {slice_request.cway}. Must be any combination of the three letters 'L', 'R' and 'S'. eg &cwy=LR or &cwy=RL or &cwy=S. omit the parameter to query all.")
+		carriageway_mask.append(REQUEST_CARRIAGEWAY_BITMASK[slice_request.cway])
+
+	request_slk_from = np.array([item.slk_from for item in slice_requests], dtype="f8")
+	request_slk_to = np.array([item.slk_to for item in slice_requests], dtype="f8")
+	request_offset = np.array([item.offset for item in slice_requests], dtype="f8")
+	request_interval = np.array([item.interval / 1000 if item.interval is not None else np.nan for item in slice_requests], dtype="f8")
+	request_is_point = _isclose(request_slk_from, request_slk_to)
+
+	with time_stage("lookup"):
+		request_number, row_position, sorted_position = road_network_index.lookup_many(
+			[item.road for item in slice_requests],
+			request_slk_from,
+			request_slk_to,
+			np.array(carriageway_mask, dtype="u1")
+		)
+	count_request_metric("input_segments", len(row_position))
+
+	if np.any(~np.isnan(request_interval)):
+		request_number, row_position, sorted_position, sample_slk = _interval_samples(
+			road_network, request_number, row_position, sorted_position, request_slk_from, request_slk_to, request_interval
+		)
+	else:
+		sample_slk = np.full(len(request_number), np.nan)
+	is_sample = ~np.isnan(sample_slk)
+
+	# one entry per (request, segment) pair from here on. Each sample point of an interval request is a pair of its own, and is cut like a point request at that slk.
+	slk_from = np.where(is_sample, sample_slk, request_slk_from[request_number])
+	slk_to = np.where(is_sample, sample_slk, request_slk_to[request_number])
+	segment_slk_start = road_network_index.start_slk[sorted_position]
+	segment_slk_end = road_network_index.end_slk[sorted_position]
+	vertex_start = road_network_geometry.vertex_offsets[row_position]
+	vertex_end = road_network_geometry.vertex_offsets[row_position + 1]
+	length = road_network_geometry.segment_length[row_position]
+	is_point = request_is_point[request_number] | is_sample
+
+	# The fraction is found first, as in cut_linestring(), so that an slk equal to END_SLK gives exactly the length of the segment
+	with np.errstate(divide="ignore", invalid="ignore"):
+		distance_first = (slk_from - segment_slk_start) / (segment_slk_end - segment_slk_start) * length
+		distance_second = (slk_to - segment_slk_start) / (segment_slk_end - segment_slk_start) * length
+
+	# line parts which would be cut to (almost) nothing are left out, rather than returned as a line with two identical vertices
+	keep = (vertex_end - vertex_start >= 2) & np.where(
+		is_point,
+		(segment_slk_start <= slk_from) & (slk_from <= segment_slk_end),
+		(distance_first < length) & (np.minimum(distance_second, length) - np.maximum(distance_first, 0) > LINE_PART_MINIMUM_FRACTION * length)
+	)
+	request_number, row_position, is_point, vertex_start, vertex_end, length, distance_first, distance_second, slk_from = (
+		item[keep] for item in (request_number, row_position, is_point, vertex_start, vertex_end, length, distance_first, distance_second, slk_from)
+	)
+	offset_degrees = convert_metres_to_degrees(request_offset[request_number])
+
+	# Points: interpolate, then offset perpendicular to the direction of the line at that point. See get_point_along_linestring_with_offset()
+	point_distance = np.clip(np.nan_to_num(distance_first[is_point]), 0, length[is_point])
+	point_vertex_start = vertex_start[is_point]
+	point_vertex_end = vertex_end[is_point]
+	after = _vertex_after(road_network_geometry, point_vertex_start, point_vertex_end, point_distance, side="right")
+	point_coordinates = _interpolate(road_network_geometry, after, point_distance)
+	direction_vertex = _vertex_after(road_network_geometry, point_vertex_start, point_vertex_end, point_distance, side="left")
+	point_coordinates += road_network_geometry.step_normal[direction_vertex - 1] * offset_degrees[is_point][:, np.newaxis]
+
+	# Lines: keep whole vertices between the two cuts and add a new vertex at each cut. See double_cut_coordinates()
+	is_line = ~is_point
+	line_vertex_start = vertex_start[is_line]
+	line_vertex_end = vertex_end[is_line]
+	line_length = length[is_line]
+	line_distance_first = distance_first[is_line]
+	line_distance_second = distance_second[is_line]
+
+	_, tail_start, first_vertex = _split(road_network_geometry, line_vertex_start, line_vertex_end, np.clip(line_distance_first, 0, line_length))
+	cut_at_start = line_distance_first <= 0
+	tail_start[cut_at_start] = line_vertex_start[cut_at_start] + 1
+	first_vertex[cut_at_start] = road_network_geometry.coordinates[line_vertex_start[cut_at_start]]
+
+	head_end, _, second_vertex = _split(road_network_geometry, line_vertex_start, line_vertex_end, np.clip(line_distance_second, 0, line_length))
+	cut_at_end = line_distance_second >= line_length
+	head_end[cut_at_end] = line_vertex_end[cut_at_end] - 1
+	second_vertex[cut_at_end] = road_network_geometry.coordinates[line_vertex_end[cut_at_end] - 1]
+
+	interior_count = np.maximum(head_end - tail_start, 0)
+
+	# pack points and lines back together in their original order
+	part_vertex_count = np.ones(len(request_number), dtype="i8")
+	part_vertex_count[is_line] = interior_count + 2
+	part_offsets = np.zeros(len(request_number) + 1, dtype="i8")
+	np.cumsum(part_vertex_count, out=part_offsets[1:])
+	coordinates = np.empty((part_offsets[-1], 2), dtype="f8")
+
+	coordinates[part_offsets[:-1][is_point]] = point_coordinates
+	line_first_output = part_offsets[:-1][is_line]
+	coordinates[line_first_output] = first_vertex
+	coordinates[line_first_output + interior_count + 1] = second_vertex
+	interior_line = np.repeat(np.arange(len(interior_count)), interior_count)
+	interior_within = np.arange(interior_count.sum()) - np.repeat(np.cumsum(interior_count) - interior_count, interior_count)
+	coordinates[line_first_output[interior_line] + 1 + interior_within] = road_network_geometry.coordinates[tail_start[interior_line] + interior_within]
+
+	result = Sample_Batch_Result(request_number, is_point, coordinates, part_offsets, np.where(is_point, slk_from, np.nan), row_position)
+
+	is_offset_line = is_line & (offset_degrees != 0)
+	if np.any(is_offset_line):
+		first_step = np.zeros(len(request_number), dtype="i8")
+		first_step[is_line] = tail_start - 1
+		result = _offset_lines(result, road_network_geometry, offset_degrees, is_offset_line, first_step, join, mitre_limit)
+	return result
+
+
+def _interval_samples(
+	road_network: Road_Network,
+	request_number: np.ndarray,
+	row_position: np.ndarray,
+	sorted_position: np.ndarray,
+	request_slk_from: np.ndarray,
+	request_slk_to: np.ndarray,
+	request_interval: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+	"""
+	Replaces each (request, segment) pair of an interval request with one pair for every sample point of the request which falls on that segment.
+	The sample points are at slk_from, slk_from + interval and so on up to slk_to. The samples of every segment are found at once from its slk range,
+	so they are all located with one search of the cumulative lengths (see _vertex_after()) rather than one search per point.
+	A sample on the boundary between two segments of the same carriageway is only kept on the first of them.
+	:param request_interval: km between the sample points of each request. NaN for requests which are not interval requests
+	:return: (request_number, row_position, sorted_position, sample_slk). sample_slk is NaN for the pairs of other requests, which are left as they are.
+	"""
+	road_network_index = road_network.index
+	interval = request_interval[request_number]
+	slk_from = request_slk_from[request_number]
+	lower = np.maximum(road_network_index.start_slk[sorted_position], slk_from)
+	upper = np.minimum(road_network_index.end_slk[sorted_position], request_slk_to[request_number])
+	is_interval = ~np.isnan(interval)
+	has_samples = is_interval & np.isfinite(lower) & np.isfinite(upper) & (upper >= lower) & (np.diff(road_network.geometry.vertex_offsets)[row_position] >= 2)
+
+	# one sample either side of the range, in case rounding puts them inside it. Samples outside it are dropped below
+	with np.errstate(invalid="ignore"):
+		first_sample = np.where(has_samples, np.ceil((lower - slk_from) / interval) - 1, 0).astype("i8")
+		last_sample = np.where(has_samples, np.floor((upper - slk_from) / interval) + 1, 0).astype("i8")
+	sample_count = np.where(is_interval, np.where(has_samples, last_sample - first_sample + 1, 0), 1)
+	pair = np.repeat(np.arange(len(request_number)), sample_count)
+	sample_number = np.repeat(first_sample - (np.cumsum(sample_count) - sample_count), sample_count) + np.arange(sample_count.sum())
+	is_interval = is_interval[pair]
+	# rounded so that floating point error does not show up in the slk of each sample. The first is exactly slk_from
+	sample_slk = np.where(is_interval, np.where(sample_number == 0, slk_from[pair], np.round(slk_from[pair] + sample_number * interval[pair], 9)), np.nan)
+	keep = ~is_interval | ((sample_number >= 0) & (sample_slk >= lower[pair]) & (sample_slk <= upper[pair]))
+	pair, sample_number, sample_slk, is_interval = pair[keep], sample_number[keep], sample_slk[keep], is_interval[keep]
+
+	# Sort the samples of each request by slk, then by carriageway. The pairs of other requests keep their order.
+	order_key = np.where(is_interval, sample_number, pair)
+	carriageway_key = np.where(is_interval, road_network_index.carriageway_mask[sorted_position[pair]], 0)
+	order = np.lexsort((pair, carriageway_key, order_key, request_number[pair]))
+	pair, order_key, carriageway_key, sample_slk, is_interval = pair[order], order_key[order], carriageway_key[order], sample_slk[order], is_interval[order]
+	is_repeated = np.zeros(len(pair), dtype=bool)
+	is_repeated[1:] = (
+		is_interval[1:]
+		& (request_number[pair[1:]] == request_number[pair[:-1]])
+		& (order_key[1:] == order_key[:-1])
+		& (carriageway_key[1:] == carriageway_key[:-1])
+	)
+	pair, sample_slk = pair[~is_repeated], sample_slk[~is_repeated]
+	return request_number[pair], row_position[pair], sorted_position[pair], sample_slk
+
+
+def _isclose(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+	# the same test as math.isclose() with the default relative tolerance. Infinities are only close to themselves
+	with np.errstate(invalid="ignore"):
+		return (a == b) | (np.isfinite(a) & np.isfinite(b) & (np.abs(a - b) <= 1e-09 * np.maximum(np.abs(a), np.abs(b))))
+
+
+def _vertex_after(road_network_geometry: Road_Network_Geometry, vertex_start: np.ndarray, vertex_end: np.ndarray, distance: np.ndarray, side: str) -> np.ndarray:
+	# np.searchsorted(segment_cumulative_length, distance, side) for many segments at once, clipped so that it always points at the end of a line segment
+	target = road_network_geometry.running_length[vertex_start] + distance
+	return np.clip(np.searchsorted(road_network_geometry.running_length, target, side=side), vertex_start + 1, vertex_end - 1)
+
+
+def _interpolate(road_network_geometry: Road_Network_Geometry, vertex_after: np.ndarray, distance: np.ndarray) -> np.ndarray:
+	cumulative_length = road_network_geometry.cumulative_length
+	vertex_a = road_network_geometry.coordinates[vertex_after - 1]
+	vertex_b = road_network_geometry.coordinates[vertex_after]
+	step_length = cumulative_length[vertex_after] - cumulative_length[vertex_after - 1]
+	with np.errstate(divide="ignore", invalid="ignore"):
+		fraction = np.where(step_length > 0, (distance - cumulative_length[vertex_after - 1]) / step_length, 0)
+	return vertex_a + (vertex_b - vertex_a) * np.clip(fraction, 0, 1)[:, np.newaxis]
+
+
+def _split(road_network_geometry: Road_Network_Geometry, vertex_start: np.ndarray, vertex_end: np.ndarray, distance: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+	# split_coordinates_at_distance() for many segments at once. Indices are into the flat coordinate buffer.
+	cumulative_length = road_network_geometry.cumulative_length
+	after = _vertex_after(road_network_geometry, vertex_start, vertex_end, distance, side="right")
+	close_before = _isclose(cumulative_length[after - 1], distance)
+	close_after = ~close_before & _isclose(cumulative_length[after], distance)
+
+	vertex_at_cut = _interpolate(road_network_geometry, after, distance)
+	vertex_at_cut[close_before] = road_network_geometry.coordinates[after[close_before] - 1]
+	vertex_at_cut[close_after] = road_network_geometry.coordinates[after[close_after]]
+
+	head_end = np.where(close_before, after - 1, after)
+	tail_start = np.where(close_after, after + 1, after)
+	return head_end, tail_start, vertex_at_cut
+
+
+def _offset_lines(result: Sample_Batch_Result, road_network_geometry: Road_Network_Geometry, offset_degrees: np.ndarray, is_offset_line: np.ndarray, first_step: np.ndarray, join: str, mitre_limit: float) -> Sample_Batch_Result:
+	"""
+	Offsets every vertex of the selected lines along the precomputed normals of the network steps it lies between.
+	Each line stays a single LineString with its original direction.
+	:param first_step: for each part, the index (into the network step arrays) of the step its first vertex lies on
+	"""
+	part_vertex_count = np.diff(result.part_offsets)
+	vertex_part = np.repeat(np.arange(len(part_vertex_count)), part_vertex_count)
+	vertex_within_part = np.arange(len(result.coordinates)) - result.part_offsets[:-1][vertex_part]
+
+	offset_vertex = np.flatnonzero(is_offset_line[vertex_part])
+	part = vertex_part[offset_vertex]
+	within_part = vertex_within_part[offset_vertex]
+	last_step_within_part = part_vertex_count[part] - 2
+	normal_before = road_network_geometry.step_normal[first_step[part] + np.clip(within_part - 1, 0, last_step_within_part)]
+	normal_after = road_network_geometry.step_normal[first_step[part] + np.clip(within_part, 0, last_step_within_part)]
+	vertex = result.coordinates[offset_vertex]
+	distance = offset_degrees[part][:, np.newaxis]
+
+	# The mitre vertex is where the two offset steps meet, on the bisector of the corner. Its distance from the original vertex is
+	# |offset| * sqrt(2 / (1 + cos(turn angle))), which grows without limit at sharp corners, so it is never placed further than mitre_limit * |offset| away.
+	# On the outside of a corner, past the mitre limit (or always, if join is "bevel") the corner is bevelled instead, with one vertex for each offset step.
+	# On the inside of a corner the offset steps cross over each other, so a bevel would leave a spike; the mitre vertex is always used there.
+	cos_turn = np.sum(normal_before * normal_after, axis=1)
+	turn_cross = normal_before[:, 0] * normal_after[:, 1] - normal_before[:, 1] * normal_after[:, 0]
+	inside_corner = turn_cross * distance[:, 0] < 0
+	with np.errstate(divide="ignore", invalid="ignore"):
+		mitre_scale = np.sqrt(2 / (1 + cos_turn))
+		bisector = normal_before + normal_after
+		bisector_length = np.hypot(bisector[:, 0], bisector[:, 1])[:, np.newaxis]
+		mitre_vertex = np.where(
+			bisector_length > 1e-12,
+			vertex + distance * bisector / bisector_length * np.minimum(mitre_scale, mitre_limit)[:, np.newaxis],
+			vertex + distance * normal_before
+		)
+	straight = cos_turn >= 1 - 1e-12
+	single = straight | inside_corner
+	if join == "mitre":
+		single |= mitre_scale <= mitre_limit
+	first_output_vertex = np.where(single[:, np.newaxis], mitre_vertex, vertex + distance * normal_before)
+	second_output_vertex = vertex + distance * normal_after
+
+	output_count = np.ones(len(result.coordinates), dtype="i8")
+	output_count[offset_vertex] = np.where(single, 1, 2)
+	output_start = np.cumsum(output_count) - output_count
+	coordinates = np.empty((output_count.sum(), 2), dtype="f8")
+	coordinates[output_start] = result.coordinates
+	coordinates[output_start[offset_vertex]] = first_output_vertex
+	coordinates[output_start[offset_vertex[~single]] + 1] = second_output_vertex[~single]
+
+	part_offsets = np.zeros(len(result.part_offsets), dtype="i8")
+	np.cumsum(np.bincount(vertex_part, weights=output_count, minlength=len(part_vertex_count)).astype("i8"), out=part_offsets[1:])
+	return Sample_Batch_Result(result.request_number, result.is_point, coordinates, part_offsets, result.slk, result.row_position)
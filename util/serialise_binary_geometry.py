@@ -0,0 +1,150 @@
+"""
+Writes the geometry nodes built by batch_result_geometry_node() (see serialise_output_geometry.py) in compact formats,
+straight from their coordinate arrays:
+
+ WKB               little endian (ISO) well known binary
+ TWKB              tiny well known binary; coordinates are rounded to `precision` decimal places and delta encoded. See https://github.com/TWKB/Specification
+ encoded polyline  Google's encoded polyline algorithm; one polyline per line or group of points. See https://developers.google.com/maps/documentation/utilities/polylinealgorithm
+"""
+import struct
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+
+WKB_GEOMETRY_TYPES = {
+	"Point": 1,
+	"LineString": 2,
+	"MultiPoint": 4,
+	"MultiLineString": 5,
+	"GeometryCollection": 7,
+}
+
+# TWKB can only record from -8 to 7 decimal places
+MAXIMUM_TWKB_PRECISION = 7
+DEFAULT_TWKB_PRECISION = 7
+
+# Precision 5 is the one used by Google. Precision 6 is also common (eg OSRM's "polyline6")
+DEFAULT_POLYLINE_PRECISION = 5
+MAXIMUM_POLYLINE_PRECISION = 15
+
+# one point of a WKB MultiPoint: byte order, geometry type, x, y
+_WKB_POINT_DTYPE = np.dtype([("byte_order", "u1"), ("geometry_type", "<u4"), ("x", "<f8"), ("y", "<f8")])
+
+
+def write_wkb_geometry(geometry_node: Tuple[str, Any], precision: Optional[int] = None) -> bytes:
+	"""
+	:param precision: coordinates are rounded to this many decimal places. None writes every coordinate in full.
+	"""
+	geometry_type, geometry_coordinates = geometry_node
+	header = struct.pack("<BI", 1, WKB_GEOMETRY_TYPES[geometry_type])
+	if geometry_type == "GeometryCollection":
+		return header + struct.pack("<I", len(geometry_coordinates)) + b"".join(write_wkb_geometry(item, precision) for item in geometry_coordinates)
+	if geometry_type == "MultiLineString":
+		return header + struct.pack("<I", len(geometry_coordinates)) + b"".join(write_wkb_geometry(("LineString", item), precision) for item in geometry_coordinates)
+
+	coordinates = _xy(geometry_coordinates, precision)
+	if geometry_type == "Point":
+		return header + coordinates.tobytes()
+	if geometry_type == "LineString":
+		return header + struct.pack("<I", len(coordinates)) + coordinates.tobytes()
+	# MultiPoint
+	points = np.empty(len(coordinates), dtype=_WKB_POINT_DTYPE)
+	points["byte_order"] = 1
+	points["geometry_type"] = WKB_GEOMETRY_TYPES["Point"]
+	points["x"] = coordinates[:, 0]
+	points["y"] = coordinates[:, 1]
+	return header + struct.pack("<I", len(coordinates)) + points.tobytes()
+
+
+def write_twkb_geometry(geometry_node: Tuple[str, Any], precision: int = DEFAULT_TWKB_PRECISION) -> bytes:
+	"""
+	:param precision: decimal places kept, from -8 to MAXIMUM_TWKB_PRECISION
+	"""
+	geometry_type, geometry_coordinates = geometry_node
+	# type and precision, then the metadata flags (no bounding box, size, id list or extended dimensions)
+	header = bytes([WKB_GEOMETRY_TYPES[geometry_type] | (zigzag_encode(np.array([precision]))[0] << 4), 0])
+	if geometry_type == "GeometryCollection":
+		return header + encode_varints(np.array([len(geometry_coordinates)])) + b"".join(write_twkb_geometry(item, precision) for item in geometry_coordinates)
+
+	# Every coordinate is written as the difference from the one before it, continuing across the parts of a MultiLineString
+	parts = geometry_coordinates if geometry_type == "MultiLineString" else [geometry_coordinates]
+	integer_coordinates = _integer_coordinates(np.concatenate(parts) if parts else np.empty((0, 2)), precision)
+	deltas = zigzag_encode(np.diff(integer_coordinates, axis=0, prepend=np.zeros((1, 2), dtype="i8")).ravel())
+
+	if geometry_type == "Point":
+		return header + encode_varints(deltas)
+	if geometry_type in ("LineString", "MultiPoint"):
+		return header + encode_varints(np.concatenate([[len(integer_coordinates)], deltas]))
+	# MultiLineString: the number of lines, then for each line its number of points followed by its coordinates
+	part_lengths = np.array([len(item) for item in parts], dtype="i8")
+	part_ends = np.cumsum(part_lengths) * 2
+	values = np.insert(deltas, np.concatenate([[0], part_ends[:-1]]), part_lengths)
+	return header + encode_varints(np.concatenate([[len(parts)], values]))
+
+
+def write_encoded_polylines(geometry_node: Tuple[str, Any], precision: int = DEFAULT_POLYLINE_PRECISION) -> str:
+	"""
+	:return: one encoded polyline for each line, and for the points of each Point or MultiPoint, separated by newlines. Coordinates are encoded in (lat, lon) order.
+	"""
+	parts = _polyline_parts(geometry_node)
+	part_lengths = np.array([len(item) for item in parts], dtype="i8")
+	part_starts = np.cumsum(part_lengths) - part_lengths
+	# Every part is encoded in one go: each coordinate is the difference from the one before it, except the first of each part
+	lat_lon = _integer_coordinates(np.concatenate(parts), precision)[:, ::-1]
+	deltas = np.diff(lat_lon, axis=0, prepend=np.zeros((1, 2), dtype="i8"))
+	deltas[part_starts] = lat_lon[part_starts]
+	# 5 bit chunks, least significant first, with 0x20 set on every chunk but the last of each value, offset by 63 into printable characters
+	chunks, chunk_count = variable_length_chunks(zigzag_encode(deltas.ravel()), 5)
+	text = (chunks + 63).tobytes().decode("ascii")
+	part_ends = np.cumsum(chunk_count)[np.cumsum(part_lengths) * 2 - 1].tolist()
+	return "\n".join(text[part_start:part_end] for part_start, part_end in zip([0] + part_ends[:-1], part_ends))
+
+
+def _polyline_parts(geometry_node: Tuple[str, Any]) -> List[np.ndarray]:
+	geometry_type, geometry_coordinates = geometry_node
+	if geometry_type == "GeometryCollection":
+		return [part for item in geometry_coordinates for part in _polyline_parts(item)]
+	if geometry_type == "MultiLineString":
+		return list(geometry_coordinates)
+	return [geometry_coordinates]
+
+
+def _xy(coordinates: np.ndarray, precision: Optional[int]) -> np.ndarray:
+	coordinates = np.ascontiguousarray(np.asarray(coordinates)[:, :2], dtype="<f8")
+	if precision is not None:
+		coordinates = np.round(coordinates, precision)
+	return coordinates
+
+
+def _integer_coordinates(coordinates: np.ndarray, precision: int) -> np.ndarray:
+	return np.round(np.asarray(coordinates)[:, :2] * 10.0 ** precision).astype("i8")
+
+
+def zigzag_encode(values: np.ndarray) -> np.ndarray:
+	# maps signed integers to unsigned ones so that small negative values stay small: 0, -1, 1, -2 ... become 0, 1, 2, 3 ...
+	values = values.astype("i8")
+	return ((values << 1) ^ (values >> 63)).astype("u8")
+
+
+def encode_varints(values: np.ndarray) -> bytes:
+	# unsigned LEB128 varints: 7 bit chunks, least significant first, with 0x80 set on every chunk but the last of each value
+	return variable_length_chunks(values, 7)[0].tobytes()
+
+
+def variable_length_chunks(values: np.ndarray, chunk_bits: int) -> Tuple[np.ndarray, np.ndarray]:
+	"""
+	:return: the chunks of every value, and the number of chunks of each value
+	"""
+	values = np.asarray(values).astype("u8")
+	continuation_bit = 1 << chunk_bits
+	chunk_mask = np.uint64(continuation_bit - 1)
+	chunk_count = np.ones(len(values), dtype="i8")
+	for chunk_number in range(1, -(-64 // chunk_bits)):
+		chunk_count += values >= np.uint64(1 << (chunk_bits * chunk_number))
+	first_chunk = np.cumsum(chunk_count) - chunk_count
+	chunks = np.empty(int(chunk_count.sum()), dtype="u1")
+	for chunk_number in range(int(chunk_count.max(initial=0))):
+		has_chunk = chunk_count > chunk_number
+		chunk = (values[has_chunk] >> np.uint64(chunk_bits * chunk_number)) & chunk_mask
+		chunks[first_chunk[has_chunk] + chunk_number] = chunk | np.where(chunk_count[has_chunk] > chunk_number + 1, continuation_bit, 0).astype("u8")
+	return chunks, chunk_count
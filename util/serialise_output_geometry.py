@@ -1,73 +1,254 @@
 import json
-from typing import Union, List#, Literal
+from typing import Union, List, Optional, Tuple, Any, Sequence#, Literal
 
+import numpy as np
 from shapely.geometry import Point, MultiPoint, MultiLineString, LineString
 from shapely.ops import unary_union
 
+from util.serialise_binary_geometry import write_wkb_geometry, write_twkb_geometry, write_encoded_polylines, DEFAULT_TWKB_PRECISION, MAXIMUM_TWKB_PRECISION, DEFAULT_POLYLINE_PRECISION, MAXIMUM_POLYLINE_PRECISION
+from util.write_flatgeobuf import write_flatgeobuf_header, write_flatgeobuf_feature
+
+# How the parts of a response are combined into one geometry:
+#  "none"    every part is kept separately in a GeometryCollection, in the order they were sliced
+#  "collect" points are gathered into one MultiPoint and lines into one MultiLineString, without any noding (the default)
+#  "union"   points and lines are combined with shapely's unary_union, which nodes and dissolves overlapping lines (the original behaviour)
+MERGE_OPTIONS = ("none", "collect", "union")
+DEFAULT_MERGE = "collect"
+
+# Output types chosen by the `format` url parameter (or the `wkt` parameter):
+#  "GEOJSON" a GeoJSON Feature (the default)
+#  "WKT" well known text
+#  "WKB", "WKB_HEX" well known binary, as raw bytes or as hexadecimal text
+#  "TWKB" tiny well known binary
+#  "POLYLINE" Google encoded polylines, one per line
+#  "FLATGEOBUF" a FlatGeobuf file holding one feature
+OUTPUT_TYPES = ("GEOJSON", "WKT", "WKB", "WKB_HEX", "TWKB", "POLYLINE", "FLATGEOBUF")
+# Content type of the response for each output type. GeoJSON and WKT responses keep the default content type they have always been served with.
+OUTPUT_CONTENT_TYPES = {
+	"WKB": "application/octet-stream",
+	"WKB_HEX": "text/plain",
+	"TWKB": "application/octet-stream",
+	"POLYLINE": "text/plain",
+	"FLATGEOBUF": "application/flatgeobuf",
+}
+
+# Output types which can write each part of an interval request as a feature of its own. See serialise_part_features()
+PART_FEATURE_OUTPUT_TYPES = ("GEOJSON", "FLATGEOBUF")
+PART_FEATURE_COLUMNS = ["road", "cway", "slk", "slk_from", "slk_to", "offset"]
+
+# The geometry is built as a small tree of (geometry type, coordinates) before it is written as text:
+#  ("Point", array of shape (1, 2)), ("LineString", array of shape (n, 2)),
+#  ("MultiPoint", array of shape (n, 2)), ("MultiLineString", [array of shape (n, 2), ...]),
+#  ("GeometryCollection", [node, ...])
+Geometry_Node = Tuple[str, Any]
+
 
 #def serialise_output_geometry(geometry_list: List[Union[Point, MultiPoint, LineString, MultiLineString]], output_type: Literal["WKT", "GEOJSON"] = "GEOJSON") -> str:
-def serialise_output_geometry(geometry_list: List[Union[Point, MultiPoint, LineString, MultiLineString]], output_type = "GEOJSON") -> str:
-	
-	# TODO: make the union operation optional for GeoJSON as it may produce weird results. expose setting to user?
-	PERFORM_UNION_ON_GEOMS_FOR_GEOJSON = True
-	
-	result = ""
-	
+def serialise_output_geometry(geometry_list: List[Union[Point, MultiPoint, LineString, MultiLineString]], output_type = "GEOJSON", precision: Optional[int] = None) -> str:
+	"""
+	Serialises shapely geometry using merge="union". See serialise_batch_result() for the fast path used by the server.
+	:param precision: number of decimal places written for each coordinate. None writes every coordinate in full.
+	"""
+	return _write_feature(_union_geometry_node(geometry_list, output_type), output_type, precision)
+
+
+def serialise_batch_result(batch_result, output_type = "GEOJSON", merge: str = DEFAULT_MERGE, precision: Optional[int] = None, request_number: Optional[int] = None) -> Union[str, bytes]:
+	"""
+	Serialises the output of sample_linestring_batch() as a GeoJSON Feature, or as any other of the OUTPUT_TYPES.
+	Unless merge="union", coordinates are written straight from batch_result.coordinates without creating any shapely objects.
+	:param request_number: if provided, only the parts produced by that slice request are serialised
+	:return: text, or bytes for the binary output types (WKB, TWKB and FLATGEOBUF)
+	"""
+	return _write_feature(batch_result_geometry_node(batch_result, output_type, merge, request_number), output_type, precision)
+
+
+def serialise_part_features(batch_result, slice_requests: list, part_carriageway: Sequence[str], output_type = "GEOJSON", precision: Optional[int] = None) -> Union[str, bytes]:
+	"""
+	Serialises every part of the output of sample_linestring_batch() as a feature of its own, rather than as the parts of one geometry.
+	Each feature has the road and offset of the slice request it came from, and the cway of the segment it was cut from.
+	Points also have their "slk", and lines the "slk_from" and "slk_to" of their request. Used for interval requests with merge=none.
+	:param part_carriageway: the CWY of the road network segment each part was cut from
+	:return: a GeoJSON FeatureCollection, or a FlatGeobuf file with the PART_FEATURE_COLUMNS (see PART_FEATURE_OUTPUT_TYPES)
+	"""
+	coordinates = batch_result.coordinates if precision is None else np.round(batch_result.coordinates, precision)
+	part_properties = [
+		{
+			"road": slice_requests[request_number].road,
+			"cway": str(carriageway),
+			**({"slk": slk} if is_point else {"slk_from": slice_requests[request_number].slk_from, "slk_to": slice_requests[request_number].slk_to}),
+			"offset": slice_requests[request_number].offset,
+		}
+		for request_number, is_point, slk, carriageway in zip(batch_result.request_number.tolist(), batch_result.is_point.tolist(), batch_result.slk.tolist(), part_carriageway)
+	]
+	part_geometry = [
+		("Point", coordinates[part_start:part_start + 1]) if is_point else ("LineString", coordinates[part_start:part_end])
+		for is_point, part_start, part_end in zip(batch_result.is_point.tolist(), batch_result.part_offsets[:-1].tolist(), batch_result.part_offsets[1:].tolist())
+	]
+	if output_type == "FLATGEOBUF":
+		return write_flatgeobuf_header(PART_FEATURE_COLUMNS) + b"".join(
+			write_flatgeobuf_feature(geometry_node, {
+				column_number: (value if isinstance(value, str) else repr(value))
+				for column_number, value in enumerate(properties.get(column) for column in PART_FEATURE_COLUMNS)
+				if value is not None
+			})
+			for geometry_node, properties in zip(part_geometry, part_properties)
+		)
+	return '{"type":"FeatureCollection","features":[' + ",".join(
+		'{"type":"Feature","properties":' + json.dumps(properties, separators=(",", ":")) + ',"geometry":' + write_geojson_geometry(geometry_node) + '}'
+		for geometry_node, properties in zip(part_geometry, part_properties)
+	) + ']}'
+
+
+def batch_result_geometry_node(batch_result, output_type = "GEOJSON", merge: str = DEFAULT_MERGE, request_number: Optional[int] = None) -> Geometry_Node:
+	if merge not in MERGE_OPTIONS:
+		raise Serialise_Results_Exception(f"merge must be one of {', '.join(MERGE_OPTIONS)}")
+
+	if merge == "union":
+		return _union_geometry_node(batch_result.geometries(request_number), output_type)
+
+	if request_number is None:
+		first_part, end_part = 0, len(batch_result.request_number)
+	else:
+		first_part, end_part = np.searchsorted(batch_result.request_number, (request_number, request_number + 1))
+	if end_part <= first_part:
+		raise Exception("Empty geometry list")
+
+	is_point = batch_result.is_point[first_part:end_part]
+	part_offsets = batch_result.part_offsets[first_part:end_part + 1]
+	coordinates = batch_result.coordinates
+
+	if output_type == "WKT" and merge == "collect" and is_point.any() and not is_point.all():
+		raise Serialise_Results_Exception("Unable to serialise both points and lines when using the WKT output type. Try GeoJSON output instead.")
+
+	if end_part - first_part == 1:
+		if is_point[0]:
+			return "Point", coordinates[part_offsets[0]:part_offsets[0] + 1]
+		return "LineString", coordinates[part_offsets[0]:part_offsets[1]]
+
+	if merge == "none":
+		return "GeometryCollection", [
+			("Point", coordinates[part_start:part_start + 1]) if part_is_point
+			else ("LineString", coordinates[part_start:part_end])
+			for part_is_point, part_start, part_end in zip(is_point.tolist(), part_offsets[:-1].tolist(), part_offsets[1:].tolist())
+		]
+
+	geometry_nodes = []
+	if is_point.any():
+		geometry_nodes.append(("MultiPoint", coordinates[part_offsets[:-1][is_point]]))
+	if not is_point.all():
+		geometry_nodes.append(("MultiLineString", [
+			coordinates[part_start:part_end]
+			for part_start, part_end in zip(part_offsets[:-1][~is_point].tolist(), part_offsets[1:][~is_point].tolist())
+		]))
+	if len(geometry_nodes) == 1:
+		return geometry_nodes[0]
+	return "GeometryCollection", geometry_nodes
+
+
+def write_geojson_geometry(geometry_node: Geometry_Node, precision: Optional[int] = None) -> str:
+	"""
+	:return: the GeoJSON geometry object as text, eg '{"type":"LineString","coordinates":[[115.8,-31.9],[115.9,-31.9]]}'
+	"""
+	geometry_type, geometry_coordinates = geometry_node
+	if geometry_type == "GeometryCollection":
+		return '{"type":"GeometryCollection","geometries":[' + ",".join(write_geojson_geometry(item, precision) for item in geometry_coordinates) + ']}'
+	if geometry_type == "Point":
+		coordinates_text = _write_coordinates(geometry_coordinates, "[%r,%r]", ",", precision)
+	elif geometry_type == "MultiLineString":
+		coordinates_text = "[" + ",".join("[" + _write_coordinates(item, "[%r,%r]", ",", precision) + "]" for item in geometry_coordinates) + "]"
+	else:
+		coordinates_text = "[" + _write_coordinates(geometry_coordinates, "[%r,%r]", ",", precision) + "]"
+	return '{"type":"' + geometry_type + '","coordinates":' + coordinates_text + '}'
+
+
+def write_wkt_geometry(geometry_node: Geometry_Node, precision: Optional[int] = None) -> str:
+	"""
+	:return: the geometry as WKT, eg "LINESTRING (115.8 -31.9, 115.9 -31.9)"
+	"""
+	geometry_type, geometry_coordinates = geometry_node
+	if geometry_type == "GeometryCollection":
+		geometry_text = ", ".join(write_wkt_geometry(item, precision) for item in geometry_coordinates)
+	elif geometry_type == "MultiPoint":
+		geometry_text = _write_coordinates(geometry_coordinates, "(%r %r)", ", ", precision)
+	elif geometry_type == "MultiLineString":
+		geometry_text = ", ".join("(" + _write_coordinates(item, "%r %r", ", ", precision) + ")" for item in geometry_coordinates)
+	else:
+		geometry_text = _write_coordinates(geometry_coordinates, "%r %r", ", ", precision)
+	return geometry_type.upper() + " (" + geometry_text + ")"
+
+
+def _write_feature(geometry_node: Geometry_Node, output_type, precision: Optional[int]) -> Union[str, bytes]:
+	if output_type == "WKT":
+		return write_wkt_geometry(geometry_node, precision)
+	if output_type == "WKB":
+		return write_wkb_geometry(geometry_node, precision)
+	if output_type == "WKB_HEX":
+		return write_wkb_geometry(geometry_node, precision).hex().upper()
+	if output_type == "TWKB":
+		if precision is not None and precision > MAXIMUM_TWKB_PRECISION:
+			raise Serialise_Results_Exception(f"TWKB can store at most {MAXIMUM_TWKB_PRECISION} decimal places. Try &precision={MAXIMUM_TWKB_PRECISION} or less.")
+		return write_twkb_geometry(geometry_node, DEFAULT_TWKB_PRECISION if precision is None else precision)
+	if output_type == "POLYLINE":
+		if precision is not None and precision > MAXIMUM_POLYLINE_PRECISION:
+			raise Serialise_Results_Exception(f"Encoded polylines can store at most {MAXIMUM_POLYLINE_PRECISION} decimal places. Try &precision={DEFAULT_POLYLINE_PRECISION} or &precision=6.")
+		return write_encoded_polylines(geometry_node, DEFAULT_POLYLINE_PRECISION if precision is None else precision)
+	if output_type == "FLATGEOBUF":
+		return write_flatgeobuf_header([]) + write_flatgeobuf_feature(geometry_node, {}, precision)
+	return '{"type":"Feature","geometry":' + write_geojson_geometry(geometry_node, precision) + '}'
+
+
+def _write_coordinates(coordinates: np.ndarray, coordinate_format: str, separator: str, precision: Optional[int]) -> str:
+	# One % operation formats every coordinate of the array; repr() of a rounded float is its shortest round-trip text, so there are no trailing zeros.
+	if len(coordinates) == 0:
+		return ""
+	if precision is not None:
+		coordinates = np.round(coordinates, precision)
+	return separator.join([coordinate_format] * len(coordinates)) % tuple(np.asarray(coordinates)[:, :2].ravel().tolist())
+
+
+def _union_geometry_node(geometry_list: List[Union[Point, MultiPoint, LineString, MultiLineString]], output_type) -> Geometry_Node:
 	# separate list into points and lines:
 	point_list = [item for item in geometry_list if isinstance(item, (Point, MultiPoint))]
-	# multi_point_list = [item for item in geometry_list if isinstance(item, MultiPoint)]
 	line_list = [item for item in geometry_list if isinstance(item, (LineString, MultiLineString))]
-	# multi_line_list = [item for item in geometry_list if isinstance(item, MultiLineString)]
-	
+
 	if not (line_list or point_list):
 		raise Exception("Unable to serialise input; none of the retrieved geometry matched Point, MultiPoint, LineString, or MultiLineString")
-		
+
 	if output_type == "WKT":
 		if point_list and line_list:
 			# TODO: this exception may not be desirable? The code below will work anyway,
 			#  but will only keep lines, discarding any points. The aim is to ensures the user doesnt lose data in a way that would be hard to diagnose
 			raise Serialise_Results_Exception("Unable to serialise both points and lines when using the WKT output type. Try GeoJSON output instead.")
-		result = unary_union(geometry_list).wkt
-	
-	elif output_type == "GEOJSON":
-		result = {
-			"type": "Feature",
-			"geometry": None
-		}
-		
-		if len(geometry_list) < 1:
-			raise Exception("Empty geometry list")
-		
-		elif len(geometry_list) == 1:
-			result["geometry"] = geometry_list[0].__geo_interface__
-			
-		else:
-			if PERFORM_UNION_ON_GEOMS_FOR_GEOJSON:
-				geoms = []
-				if point_list:
-					geoms.append(unary_union(point_list))
-				if line_list:
-					geoms.append(unary_union(line_list))
-				if len(geoms) == 0:
-					raise Serialise_Results_Exception("Something went wrong when computing the union of geometries in the serialise_output_geometry() function. 0 geoms returned.")
-			else:
-				geoms = geometry_list
-				
-			if len(geoms) == 1:
-				result["geometry"] = geoms[0].__geo_interface__
-			else:
-				result["geometry"] = {
-					"type": "GeometryCollection",
-					"geometries": [
-						item.__geo_interface__ for item in geoms
-					]
-				}
-		
-		result = json.dumps(result)
-	return result
+		return _shapely_geometry_node(unary_union(geometry_list))
+
+	if len(geometry_list) == 1:
+		return _shapely_geometry_node(geometry_list[0])
+
+	geoms = []
+	if point_list:
+		geoms.append(unary_union(point_list))
+	if line_list:
+		geoms.append(unary_union(line_list))
+
+	if len(geoms) == 1:
+		return _shapely_geometry_node(geoms[0])
+	return "GeometryCollection", [_shapely_geometry_node(item) for item in geoms]
+
+
+def _shapely_geometry_node(geometry) -> Geometry_Node:
+	geometry_type = geometry.geom_type
+	if geometry_type in ("Point", "LineString"):
+		return geometry_type, np.asarray(geometry.coords)[:, :2]
+	if geometry_type == "MultiPoint":
+		return geometry_type, np.array([item.coords[0][:2] for item in geometry.geoms])
+	if geometry_type == "MultiLineString":
+		return geometry_type, [np.asarray(item.coords)[:, :2] for item in geometry.geoms]
+	if geometry_type == "GeometryCollection":
+		return geometry_type, [_shapely_geometry_node(item) for item in geometry.geoms]
+	raise Serialise_Results_Exception(f"Unable to serialise geometry of type {geometry_type}")
 
 
 class Serialise_Results_Exception(Exception):
 	def __init__(self, message):
 		super().__init__(message)
-		self.message = message
\ No newline at end of file
+		self.message = message
@@ -0,0 +1,87 @@
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict
+
+from waitress import serve as waitress_serve
+
+# A worker which exits sooner than this after starting is assumed to be crashing on startup, and is restarted more slowly.
+WORKER_MINIMUM_LIFETIME_SECONDS = 5
+WORKER_RESTART_DELAY_SECONDS = 1
+
+
+def serve_workers(app, host: str, port: int, workers: int, threads: int = 4) -> None:
+	"""
+	Serves `app` from several worker processes which all accept connections from one listening socket.
+
+	The workers are forked from this process after the road network has been loaded, so they share it rather than each loading a copy:
+	the snapshot arrays are memory-mapped read only (see network_snapshot.py), and everything else built at startup is shared copy-on-write.
+	This process stays behind as a supervisor and restarts any worker that exits unexpectedly.
+
+	Forking is only available on unix-like systems. Elsewhere a single process is served instead.
+	"""
+	if workers <= 1 or not hasattr(os, "fork"):
+		if workers > 1:
+			print(f"Multiple workers are not supported on this platform ({sys.platform}). Serving from a single process.")
+		waitress_serve(app, host=host, port=port, threads=threads)
+		return
+
+	listening_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	listening_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+	listening_socket.bind((host, port))
+	listening_socket.listen(1024)
+
+	worker_started_at: Dict[int, float] = {}
+	stopping = False
+
+	def start_worker():
+		pid = os.fork()
+		if pid == 0:
+			# worker process
+			signal.signal(signal.SIGTERM, signal.SIG_DFL)
+			signal.signal(signal.SIGINT, signal.SIG_DFL)
+			exit_code = 0
+			try:
+				waitress_serve(app, sockets=[listening_socket], threads=threads)
+			except BaseException as e:
+				print(f"Worker {os.getpid()} stopped: {e!r}")
+				exit_code = 1
+			finally:
+				os._exit(exit_code)
+		worker_started_at[pid] = time.monotonic()
+
+	def stop_workers(signal_number, frame):
+		nonlocal stopping
+		stopping = True
+		for pid in list(worker_started_at):
+			try:
+				os.kill(pid, signal.SIGTERM)
+			except ProcessLookupError:
+				pass
+
+	signal.signal(signal.SIGTERM, stop_workers)
+	signal.signal(signal.SIGINT, stop_workers)
+
+	for _ in range(workers):
+		start_worker()
+	print(f"Serving on http://{host}:{port} with {workers} worker processes: {sorted(worker_started_at)}")
+
+	while worker_started_at:
+		try:
+			pid, status = os.wait()
+		except ChildProcessError:
+			break
+		except InterruptedError:
+			continue
+		started_at = worker_started_at.pop(pid, None)
+		if started_at is None or stopping:
+			continue
+		print(f"Worker {pid} exited unexpectedly (status {status}). Restarting it.")
+		if time.monotonic() - started_at < WORKER_MINIMUM_LIFETIME_SECONDS:
+			time.sleep(WORKER_RESTART_DELAY_SECONDS)
+		if not stopping:
+			start_worker()
+
+	listening_socket.close()
@@ -0,0 +1,94 @@
+import itertools
+import json
+from typing import Iterable, Iterator, Dict, Any, List, Tuple, Optional
+
+import numpy as np
+
+from util.parse_request_parameters import parse_slice_request_row, URL_Parameter_Parse_Exception, Slice_Request_Args
+from util.read_bulk_rows import BULK_ROW_READ_ERROR
+from util.road_network import Road_Network
+from util.road_network_index import REQUEST_CARRIAGEWAY_BITMASK
+from util.sample_linestring_batch import sample_linestring_batch
+from util.serialise_output_geometry import batch_result_geometry_node, write_geojson_geometry, Serialise_Results_Exception, DEFAULT_MERGE, Geometry_Node
+from util.write_flatgeobuf import write_flatgeobuf_header, write_flatgeobuf_feature
+
+# Number of rows sliced together by the batch engine. Memory used while streaming a response is proportional to this, not to the size of the request.
+BULK_CHUNK_SIZE = 1000
+
+# Output types which /bulk/ can respond with. See OUTPUT_TYPES
+BULK_OUTPUT_TYPES = ("GEOJSON", "FLATGEOBUF")
+
+# FlatGeobuf columns. Ids are written as text, since they may be of any JSON type.
+BULK_FLATGEOBUF_COLUMNS = ["id", "error"]
+
+
+def stream_bulk_features(bulk_rows: Iterable[Dict[str, Any]], road_network: Road_Network, chunk_size: int = BULK_CHUNK_SIZE, merge: str = DEFAULT_MERGE, precision: Optional[int] = None) -> Iterator[str]:
+	"""
+	Yields one serialised GeoJSON Feature for each row read by read_bulk_rows(), in the same order.
+	The caller's id is copied to the feature "id" and to "properties". Rows which cannot be sliced produce a feature with
+	"geometry":null and an "error" property rather than failing the whole batch.
+	:param merge: how the parts of each row are combined. see serialise_batch_result()
+	"""
+	for row, geometry_node, error in slice_bulk_rows(bulk_rows, road_network, chunk_size, merge):
+		properties = {"id": row["id"]}
+		if error is not None:
+			properties["error"] = error
+		yield (
+			'{"type":"Feature","id":' + json.dumps(row["id"], separators=(",", ":"))
+			+ ',"properties":' + json.dumps(properties, separators=(",", ":"))
+			+ ',"geometry":' + (write_geojson_geometry(geometry_node, precision) if geometry_node is not None else "null") + '}'
+		)
+
+
+def stream_bulk_flatgeobuf(bulk_rows: Iterable[Dict[str, Any]], road_network: Road_Network, chunk_size: int = BULK_CHUNK_SIZE, merge: str = DEFAULT_MERGE, precision: Optional[int] = None) -> Iterator[bytes]:
+	"""
+	Yields a FlatGeobuf file in pieces: the header, then one feature for each row read by read_bulk_rows(), in the same order.
+	Each feature has the columns "id" and "error", like the properties written by stream_bulk_features()
+	"""
+	yield write_flatgeobuf_header(BULK_FLATGEOBUF_COLUMNS, name="bulk")
+	for row, geometry_node, error in slice_bulk_rows(bulk_rows, road_network, chunk_size, merge):
+		row_id = row["id"] if isinstance(row["id"], str) else json.dumps(row["id"])
+		yield write_flatgeobuf_feature(geometry_node, {0: row_id, 1: error}, precision)
+
+
+def slice_bulk_rows(bulk_rows: Iterable[Dict[str, Any]], road_network: Road_Network, chunk_size: int = BULK_CHUNK_SIZE, merge: str = DEFAULT_MERGE) -> Iterator[Tuple[Dict[str, Any], Optional[Geometry_Node], Optional[str]]]:
+	"""
+	Slices the rows read by read_bulk_rows() chunk_size rows at a time.
+	:return: (row, geometry node, error) for each row, in the same order. Exactly one of the geometry node and the error is None.
+	"""
+	bulk_rows = iter(bulk_rows)
+	while True:
+		chunk = list(itertools.islice(bulk_rows, chunk_size))
+		if not chunk:
+			return
+
+		errors: Dict[int, str] = {}
+		valid_rows: List[Tuple[int, Slice_Request_Args]] = []
+		for row_number, row in enumerate(chunk):
+			if row.get(BULK_ROW_READ_ERROR) is not None:
+				errors[row_number] = row[BULK_ROW_READ_ERROR]
+				continue
+			try:
+				slice_request = parse_slice_request_row(row["road"], row["slk_from"], row["slk_to"], row["offset"], row["cway"], row["interval"])
+			except URL_Parameter_Parse_Exception as e:
+				errors[row_number] = e.message
+				continue
+			if slice_request.cway not in REQUEST_CARRIAGEWAY_BITMASK:
+				errors[row_number] = f"error: Invalid carriageway parameter: {slice_request.cway}. Must be any combination of the three letters 'L', 'R' and 'S'."
+				continue
+			valid_rows.append((row_number, slice_request))
+
+		batch_result = sample_linestring_batch([slice_request for _, slice_request in valid_rows], road_network)
+		request_part_count = np.bincount(batch_result.request_number, minlength=len(valid_rows))
+		geometries: Dict[int, Geometry_Node] = {}
+		for request_number, (row_number, _) in enumerate(valid_rows):
+			if request_part_count[request_number] == 0:
+				errors[row_number] = "error: unable to slice network with the provided parameters: Valid user parameters produced no resulting geometry. Are the SLK bounds within the extent of the road?"
+				continue
+			try:
+				geometries[row_number] = batch_result_geometry_node(batch_result, "GEOJSON", merge, request_number)
+			except Serialise_Results_Exception as serialise_results_exception:
+				errors[row_number] = f"error: unable to serialise results with the provided parameters: {serialise_results_exception.message}"
+
+		for row_number, row in enumerate(chunk):
+			yield row, geometries.get(row_number), errors.get(row_number)
@@ -0,0 +1,45 @@
+import json
+from typing import Iterable, Iterator, Dict, Any
+
+from util.parse_request_parameters import parse_reverse_request_row, URL_Parameter_Parse_Exception, Reverse_Filter_Args
+from util.read_bulk_rows import BULK_ROW_READ_ERROR
+from util.reverse_geocode import reverse_geocode
+from util.road_network import Road_Network
+
+REVERSE_ROW_COLUMNS = ("id", "lat", "lon")
+REVERSE_ROW_REQUIRED_COLUMNS = ("lat", "lon")
+
+ERROR_SUGGEST_CORRECT_REVERSE_BULK = (
+	"POST a JSON array like [{\"id\":1, \"lat\":-31.95, \"lon\":115.86}, ...] "
+	"or a CSV file with the header row id,lat,lon"
+)
+
+
+def stream_reverse_features(reverse_rows: Iterable[Dict[str, Any]], road_network: Road_Network, reverse_filter: Reverse_Filter_Args) -> Iterator[str]:
+	"""
+	Yields one serialised GeoJSON Feature for each row of a reverse request, in the same order.
+	The geometry of each feature is the nearest point on the road, and its properties are the road, cway, slk, offset and distance (in metres) of the requested point.
+	Rows which cannot be matched produce a feature with "geometry":null and an "error" property rather than failing the whole request.
+	"""
+	for row in reverse_rows:
+		properties: Dict[str, Any] = {"id": row["id"]}
+		geometry = None
+		try:
+			if row.get(BULK_ROW_READ_ERROR) is not None:
+				raise URL_Parameter_Parse_Exception(row[BULK_ROW_READ_ERROR])
+			reverse_request = parse_reverse_request_row(row["lat"], row["lon"])
+			result = reverse_geocode(road_network, reverse_request.lat, reverse_request.lon, reverse_filter.roads, reverse_filter.cway, reverse_filter.radius)
+			if result is None:
+				properties["error"] = "error: no road matching the provided parameters was found within the search radius."
+			else:
+				properties.update(road=result.road, cway=result.cway, slk=result.slk, offset=result.offset, distance=result.distance)
+				geometry = {"type": "Point", "coordinates": [result.lon, result.lat]}
+		except URL_Parameter_Parse_Exception as e:
+			properties["error"] = e.message
+
+		yield json.dumps({
+			"type": "Feature",
+			"id": row["id"],
+			"properties": properties,
+			"geometry": geometry
+		}, separators=(",", ":"))
@@ -0,0 +1,88 @@
+import os
+import shutil
+import threading
+from typing import Optional, Hashable
+
+from util.response_cache import Response_Cache
+
+# Written into the directory of each network version when its first tile is saved. Only directories holding it are ever removed by remove_old_versions()
+TILE_CACHE_MARKER_FILE_NAME = ".road_network_tiles"
+
+
+class Tile_Cache:
+	"""
+	Encoded map tiles, kept in memory by a Response_Cache, and for tiles of the road network also in a directory on disk.
+	The directory is shared by every worker process and outlasts restarts, so each tile of the network only has to be drawn once for each version of the network.
+	Tiles are stored as <directory>/<network version>/<zoom>/<x>/<y>.mvt
+	Tiles of slice results are only kept in memory, since there is no end to the different queries they could be drawn for.
+	"""
+
+	def __init__(self, max_bytes: int, directory: Optional[str]):
+		"""
+		:param directory: None keeps tiles in memory only
+		"""
+		self.memory_cache = Response_Cache(max_bytes)
+		self.directory = directory
+		# network versions whose directory this process has already marked. See _mark_version_directory()
+		self._marked_versions = set()
+
+	def get(self, network_version: str, zoom: int, x: int, y: int, query_key: Optional[Hashable] = None) -> Optional[bytes]:
+		"""
+		:param query_key: identifies the slice query a tile of slice results was drawn for. None for tiles of the road network
+		"""
+		tile = self.memory_cache.get((network_version, query_key, zoom, x, y))
+		if tile is not None or query_key is not None or self.directory is None:
+			return tile
+		try:
+			with open(self._path(network_version, zoom, x, y), "rb") as tile_file:
+				tile = tile_file.read()
+		except OSError:
+			return None
+		self.memory_cache.put((network_version, query_key, zoom, x, y), tile)
+		return tile
+
+	def put(self, network_version: str, zoom: int, x: int, y: int, tile: bytes, query_key: Optional[Hashable] = None) -> None:
+		self.memory_cache.put((network_version, query_key, zoom, x, y), tile)
+		if query_key is not None or self.directory is None:
+			return
+		tile_path = self._path(network_version, zoom, x, y)
+		# written beside its final location and then moved into place, so that other processes never read half a tile
+		temporary_path = f"{tile_path}.tmp-{os.getpid()}-{threading.get_ident()}"
+		try:
+			self._mark_version_directory(network_version)
+			os.makedirs(os.path.dirname(tile_path), exist_ok=True)
+			with open(temporary_path, "wb") as tile_file:
+				tile_file.write(tile)
+			os.replace(temporary_path, tile_path)
+		except OSError as e:
+			# The disk cache is only an optimisation. The tile is still served (and kept in memory) if it can't be written.
+			print(f"Could not write tile to the tile cache: {e!r}")
+
+	def clear(self) -> None:
+		"""
+		Empties the memory cache. Tiles on disk are left for the other worker processes, which may still be serving the same network version.
+		"""
+		self.memory_cache.clear()
+
+	def remove_old_versions(self, keep_network_version: str) -> None:
+		"""
+		Removes the tiles of every network version but keep_network_version from disk. Called once at startup, before any worker processes are started.
+		Only directories written by this cache (which hold TILE_CACHE_MARKER_FILE_NAME) are removed. Anything else in the directory is left alone.
+		"""
+		if self.directory is None or not os.path.isdir(self.directory):
+			return
+		for network_version in os.listdir(self.directory):
+			version_directory = os.path.join(self.directory, network_version)
+			if network_version != keep_network_version and os.path.isfile(os.path.join(version_directory, TILE_CACHE_MARKER_FILE_NAME)):
+				shutil.rmtree(version_directory, ignore_errors=True)
+
+	def _mark_version_directory(self, network_version: str) -> None:
+		if network_version in self._marked_versions:
+			return
+		version_directory = os.path.join(self.directory, network_version)
+		os.makedirs(version_directory, exist_ok=True)
+		open(os.path.join(version_directory, TILE_CACHE_MARKER_FILE_NAME), "a").close()
+		self._marked_versions.add(network_version)
+
+	def _path(self, network_version: str, zoom: int, x: int, y: int) -> str:
+		return os.path.join(self.directory, network_version, str(zoom), str(x), f"{y}.mvt")
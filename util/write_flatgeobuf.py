@@ -0,0 +1,172 @@
+"""
+Writes FlatGeobuf (https://flatgeobuf.org) straight from the geometry nodes built by batch_result_geometry_node() (see serialise_output_geometry.py),
+without the flatbuffers or GDAL libraries.
+
+The file is written as a header followed by one feature at a time, so it can be streamed.
+No spatial index is written, and the header does not record the number of features, since neither is known until the last feature has been written.
+Every column is a string column.
+"""
+import struct
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+FLATGEOBUF_MAGIC_BYTES = b"fgb\x03fgb\x00"
+
+# FlatGeobuf GeometryType. Unknown allows each feature to have a different geometry type.
+FLATGEOBUF_GEOMETRY_TYPES = {
+	"Unknown": 0,
+	"Point": 1,
+	"LineString": 2,
+	"MultiPoint": 4,
+	"MultiLineString": 5,
+	"GeometryCollection": 7,
+}
+FLATGEOBUF_COLUMN_TYPE_STRING = 11
+FLATGEOBUF_CRS_CODE = 4326
+
+
+def write_flatgeobuf_header(column_names: List[str], name: str = "") -> bytes:
+	"""
+	:return: the magic bytes and the header, which must be followed by the features written by write_flatgeobuf_feature()
+	"""
+	header = _Flatbuffer_Builder().finish([
+		(0, "string", name),
+		(2, "B", FLATGEOBUF_GEOMETRY_TYPES["Unknown"]),
+		(7, "tables", [
+			[
+				(0, "string", column_name),
+				(1, "B", FLATGEOBUF_COLUMN_TYPE_STRING),
+			]
+			for column_name in column_names
+		]),
+		# there is no spatial index. The default of 16 would mean there is one
+		(9, "H", 0),
+		(10, "table", [
+			(0, "string", "EPSG"),
+			(1, "i", FLATGEOBUF_CRS_CODE),
+		]),
+	])
+	return FLATGEOBUF_MAGIC_BYTES + struct.pack("<I", len(header)) + header
+
+
+def write_flatgeobuf_feature(geometry_node: Optional[Tuple[str, Any]], properties: Dict[int, Optional[str]], precision: Optional[int] = None) -> bytes:
+	"""
+	:param geometry_node: None writes a feature with no geometry
+	:param properties: the value of each column, by column number. None values are left out
+	:param precision: coordinates are rounded to this many decimal places. None writes every coordinate in full.
+	"""
+	property_bytes = bytearray()
+	for column_number, value in properties.items():
+		if value is not None:
+			encoded_value = value.encode("utf-8")
+			property_bytes += struct.pack("<HI", column_number, len(encoded_value)) + encoded_value
+
+	fields = []
+	if geometry_node is not None:
+		fields.append((0, "table", _geometry_fields(geometry_node, precision)))
+	if property_bytes:
+		fields.append((1, "vector_B", bytes(property_bytes)))
+	feature = _Flatbuffer_Builder().finish(fields)
+	return struct.pack("<I", len(feature)) + feature
+
+
+def _geometry_fields(geometry_node: Tuple[str, Any], precision: Optional[int]) -> list:
+	geometry_type, geometry_coordinates = geometry_node
+	fields = [(6, "B", FLATGEOBUF_GEOMETRY_TYPES[geometry_type])]
+	if geometry_type == "GeometryCollection":
+		fields.append((7, "tables", [_geometry_fields(item, precision) for item in geometry_coordinates]))
+		return fields
+
+	if geometry_type == "MultiLineString":
+		# the index of the point after the end of each line
+		fields.append((0, "vector_I", np.cumsum([len(item) for item in geometry_coordinates]).astype("<u4").tobytes()))
+		coordinates = np.concatenate(geometry_coordinates)
+	else:
+		coordinates = geometry_coordinates
+	coordinates = np.ascontiguousarray(np.asarray(coordinates)[:, :2], dtype="<f8")
+	if precision is not None:
+		coordinates = np.round(coordinates, precision)
+	fields.append((1, "vector_d", coordinates.tobytes()))
+	return fields
+
+
+class _Flatbuffer_Builder:
+	"""
+	Writes a flatbuffer from front to back: each table is written after its vtable and before the strings, vectors and tables it refers to,
+	since offsets to them must point forwards. Every value is aligned to its own size from the start of the buffer.
+
+	Tables are lists of (field number, kind, value). kind is a struct format character for scalars,
+	or one of "string", "table", "tables" (a vector of tables), or "vector_<struct format character>" with the vector's contents as bytes.
+	"""
+
+	def __init__(self):
+		self.buffer = bytearray()
+
+	def finish(self, root_table_fields: list) -> bytes:
+		self.buffer += b"\x00" * 4
+		root_table_position = self._write_table(root_table_fields)
+		struct.pack_into("<I", self.buffer, 0, root_table_position)
+		return bytes(self.buffer)
+
+	def _pad(self, alignment: int, extra_bytes: int = 0) -> None:
+		# pads so that a value written `extra_bytes` after the current end is aligned
+		self.buffer += b"\x00" * (-(len(self.buffer) + extra_bytes) % alignment)
+
+	def _write_table(self, fields: list) -> int:
+		fields = sorted(fields, key=lambda field: -self._inline_size(field[1]))
+		# The table starts with the (signed) offset back to its vtable, followed by its fields, largest first so that each stays aligned
+		field_offsets = {}
+		table_size = 4
+		for field_number, kind, _ in fields:
+			field_size = self._inline_size(kind)
+			table_size += -table_size % field_size
+			field_offsets[field_number] = table_size
+			table_size += field_size
+		table_alignment = max([4] + [self._inline_size(kind) for _, kind, _ in fields])
+
+		vtable_entry_count = max(field_offsets, default=-1) + 1
+		self._pad(2)
+		vtable_position = len(self.buffer)
+		self.buffer += struct.pack(f"<HH{vtable_entry_count}H", 4 + 2 * vtable_entry_count, table_size, *[field_offsets.get(field_number, 0) for field_number in range(vtable_entry_count)])
+
+		self._pad(table_alignment)
+		table_position = len(self.buffer)
+		self.buffer += b"\x00" * table_size
+		struct.pack_into("<i", self.buffer, table_position, table_position - vtable_position)
+
+		for field_number, kind, value in fields:
+			field_position = table_position + field_offsets[field_number]
+			if len(kind) == 1:
+				struct.pack_into("<" + kind, self.buffer, field_position, value)
+			else:
+				struct.pack_into("<I", self.buffer, field_position, self._write_reference(kind, value) - field_position)
+		return table_position
+
+	def _write_reference(self, kind: str, value) -> int:
+		if kind == "table":
+			return self._write_table(value)
+		if kind == "string":
+			encoded_value = value.encode("utf-8")
+			self._pad(4)
+			position = len(self.buffer)
+			self.buffer += struct.pack("<I", len(encoded_value)) + encoded_value + b"\x00"
+			return position
+		if kind == "tables":
+			self._pad(4)
+			position = len(self.buffer)
+			self.buffer += struct.pack("<I", len(value)) + b"\x00" * (4 * len(value))
+			for item_number, item in enumerate(value):
+				item_position = position + 4 + 4 * item_number
+				struct.pack_into("<I", self.buffer, item_position, self._write_table(item) - item_position)
+			return position
+		# vector of scalars
+		item_size = struct.calcsize(kind[len("vector_"):])
+		self._pad(max(4, item_size), extra_bytes=4)
+		position = len(self.buffer)
+		self.buffer += struct.pack("<I", len(value) // item_size) + value
+		return position
+
+	@staticmethod
+	def _inline_size(kind: str) -> int:
+		return struct.calcsize(kind) if len(kind) == 1 else 4
@@ -0,0 +1,185 @@
+"""
+Writes Mapbox vector tiles (https://github.com/mapbox/vector-tile-spec, version 2.1) without the protobuf or mapbox-vector-tile libraries.
+
+A tile is a protobuf message holding a list of layers. Since the items of a repeated field can simply be concatenated,
+each layer is written on its own by write_vector_tile_layer() and a tile is just its layers joined together.
+The features of a layer are written all at once with array operations: apart from the key and value tables,
+a layer's features (tags and geometry commands included) are one long sequence of protobuf varints.
+"""
+from typing import Dict, Optional, List, Tuple
+
+import numpy as np
+
+from util.serialise_binary_geometry import zigzag_encode, encode_varints
+
+VECTOR_TILE_EXTENT = 4096
+VECTOR_TILE_VERSION = 2
+
+# Feature.GeomType. Every vertex of a Point feature is one point; each part of a LineString feature is one line.
+VECTOR_TILE_GEOMETRY_TYPES = {
+	"Point": 1,
+	"LineString": 2,
+}
+
+# Each geometry command integer holds the command id in its lowest 3 bits, and the number of times it is repeated above them
+_COMMAND_MOVE_TO = 1
+_COMMAND_LINE_TO = 2
+
+# protobuf wire types
+_WIRE_VARINT = 0
+_WIRE_64_BIT = 1
+_WIRE_LENGTH_DELIMITED = 2
+
+
+def write_vector_tile_layer(
+	name: str,
+	geometry_type: np.ndarray,
+	coordinates: np.ndarray,
+	part_offsets: np.ndarray,
+	feature_part_offsets: np.ndarray,
+	properties: Dict[str, np.ndarray],
+	feature_id: Optional[np.ndarray] = None,
+	extent: int = VECTOR_TILE_EXTENT
+) -> bytes:
+	"""
+	:param geometry_type: the VECTOR_TILE_GEOMETRY_TYPES value of each feature
+	:param coordinates: integer tile coordinates of every vertex, from 0 to extent across the tile with y pointing down. Consecutive vertices of a line should differ.
+	:param part_offsets: the vertices of part i are coordinates[part_offsets[i]:part_offsets[i+1]]. Each part of a LineString feature must have at least 2 vertices.
+	:param feature_part_offsets: the parts of feature i are those from feature_part_offsets[i] to feature_part_offsets[i+1]. Every feature must have at least one part.
+	:param properties: the value of each property for every feature, by property name. Values may be strings, floats or integers
+	:param feature_id: an optional unsigned integer id for each feature
+	:return: the layer, already wrapped as a field of a tile. Nothing if there are no features, since an empty layer is not worth sending
+	"""
+	feature_count = len(feature_part_offsets) - 1
+	if feature_count == 0:
+		return b""
+	geometry_values, geometry_value_feature = _geometry_commands(geometry_type, coordinates, part_offsets, feature_part_offsets)
+	keys, value_messages, tags = _tag_tables(properties, feature_count)
+
+	# Each feature is written as [features key, feature length, (id key, id), tags key, tags length, tags..., type key, type, geometry key, geometry length] followed by its geometry.
+	head_columns = [_field_key(2, _WIRE_LENGTH_DELIMITED), 0]
+	if feature_id is not None:
+		head_columns += [_field_key(1, _WIRE_VARINT), feature_id]
+	tags_length_column = len(head_columns) + 1
+	head_columns += [_field_key(2, _WIRE_LENGTH_DELIMITED), 0]
+	head_columns += list(tags.T)
+	head_columns += [_field_key(3, _WIRE_VARINT), geometry_type, _field_key(4, _WIRE_LENGTH_DELIMITED), 0]
+	head = np.column_stack([np.broadcast_to(np.asarray(column, dtype="u8"), (feature_count,)) for column in head_columns])
+
+	head[:, tags_length_column] = _varint_length(tags).sum(axis=1) if tags.size else 0
+	geometry_value_count = np.bincount(geometry_value_feature, minlength=feature_count)
+	head[:, -1] = np.bincount(geometry_value_feature, weights=_varint_length(geometry_values), minlength=feature_count).astype("u8")
+	head[:, 1] = _varint_length(head[:, 2:]).sum(axis=1) + head[:, -1]
+
+	# interleave the heads with the geometries
+	head_width = head.shape[1]
+	feature_value_count = head_width + geometry_value_count
+	feature_start = np.cumsum(feature_value_count) - feature_value_count
+	feature_values = np.empty(int(feature_value_count.sum()), dtype="u8")
+	feature_values[(feature_start[:, np.newaxis] + np.arange(head_width)).ravel()] = head.ravel()
+	first_geometry_value = np.cumsum(geometry_value_count) - geometry_value_count
+	geometry_value_number = np.arange(len(geometry_values)) - first_geometry_value[geometry_value_feature]
+	feature_values[feature_start[geometry_value_feature] + head_width + geometry_value_number] = geometry_values
+
+	layer = bytearray()
+	layer += _varint(_field_key(15, _WIRE_VARINT)) + _varint(VECTOR_TILE_VERSION)
+	layer += _length_delimited(1, name.encode("utf-8"))
+	layer += encode_varints(feature_values)
+	for key in keys:
+		layer += _length_delimited(3, key.encode("utf-8"))
+	layer += b"".join(value_messages)
+	layer += _varint(_field_key(5, _WIRE_VARINT)) + _varint(extent)
+	return _length_delimited(3, bytes(layer))
+
+
+def _geometry_commands(geometry_type: np.ndarray, coordinates: np.ndarray, part_offsets: np.ndarray, feature_part_offsets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+	"""
+	:return: the geometry command integers of every feature one after the other, and the feature each belongs to
+	"""
+	coordinates = np.asarray(coordinates, dtype="i8")
+	feature_count = len(feature_part_offsets) - 1
+	part_feature = np.repeat(np.arange(feature_count), np.diff(feature_part_offsets))
+	part_is_line = np.asarray(geometry_type)[part_feature] == VECTOR_TILE_GEOMETRY_TYPES["LineString"]
+
+	# The cursor starts at (0, 0) for each feature, and every vertex after that is relative to the one before it
+	delta = np.diff(coordinates, axis=0, prepend=np.zeros((1, 2), dtype="i8"))
+	feature_first_vertex = part_offsets[feature_part_offsets[:-1]]
+	delta[feature_first_vertex] = coordinates[feature_first_vertex]
+
+	# Each line is a MoveTo followed by a LineTo repeated for the rest of its vertices. All the points of a feature share one repeated MoveTo
+	group_first_part = np.flatnonzero(part_is_line | (np.arange(len(part_feature)) == feature_part_offsets[part_feature]))
+	group_vertex_start = part_offsets[group_first_part]
+	group_vertex_count = np.diff(np.append(group_vertex_start, part_offsets[-1]))
+	group_is_line = part_is_line[group_first_part]
+	group_value_count = 2 * group_vertex_count + 1 + group_is_line
+	group_value_start = np.cumsum(group_value_count) - group_value_count
+
+	values = np.empty(int(group_value_count.sum()), dtype="u8")
+	values[group_value_start] = _COMMAND_MOVE_TO | (np.where(group_is_line, 1, group_vertex_count) << 3)
+	values[group_value_start[group_is_line] + 3] = _COMMAND_LINE_TO | ((group_vertex_count[group_is_line] - 1) << 3)
+	vertex_group = np.repeat(np.arange(len(group_first_part)), group_vertex_count)
+	vertex_number = np.arange(len(coordinates)) - group_vertex_start[vertex_group]
+	vertex_value_position = group_value_start[vertex_group] + 1 + 2 * vertex_number + (group_is_line[vertex_group] & (vertex_number > 0))
+	values[vertex_value_position] = zigzag_encode(delta[:, 0])
+	values[vertex_value_position + 1] = zigzag_encode(delta[:, 1])
+	return values, np.repeat(part_feature[group_first_part], group_value_count)
+
+
+def _tag_tables(properties: Dict[str, np.ndarray], feature_count: int) -> Tuple[List[str], List[bytes], np.ndarray]:
+	"""
+	:return: the layer's keys, its encoded values, and the tags of each feature: (key index, value index) pairs, one pair per property
+	"""
+	keys = []
+	value_messages = []
+	tags = np.empty((feature_count, 2 * len(properties)), dtype="u8")
+	value_count = 0
+	for key_number, (key, column) in enumerate(properties.items()):
+		unique_values, value_number = np.unique(np.asarray(column), return_inverse=True)
+		keys.append(key)
+		value_messages.append(_value_messages(unique_values))
+		tags[:, 2 * key_number] = key_number
+		tags[:, 2 * key_number + 1] = value_count + value_number.ravel()
+		value_count += len(unique_values)
+	return keys, value_messages, tags
+
+
+def _value_messages(values: np.ndarray) -> bytes:
+	# Each value is a Value message with a single field. Numbers are all the same size, so those are written in one go.
+	if values.dtype.kind == "f":
+		message = np.empty(len(values), dtype=[("key", "u1"), ("length", "u1"), ("double_key", "u1"), ("double_value", "<f8")])
+		message["key"] = _field_key(4, _WIRE_LENGTH_DELIMITED)
+		message["length"] = 9
+		message["double_key"] = _field_key(3, _WIRE_64_BIT)
+		message["double_value"] = values
+		return message.tobytes()
+	if values.dtype.kind in "iu":
+		# sint_value
+		return b"".join(_length_delimited(4, _varint(_field_key(6, _WIRE_VARINT)) + _varint(int(zigzag_encode(np.array([value]))[0]))) for value in values.tolist())
+	return b"".join(_length_delimited(4, _length_delimited(1, str(value).encode("utf-8"))) for value in values.tolist())
+
+
+def _length_delimited(field_number: int, value: bytes) -> bytes:
+	return _varint(_field_key(field_number, _WIRE_LENGTH_DELIMITED)) + _varint(len(value)) + value
+
+
+def _varint(value: int) -> bytes:
+	# one varint. Much quicker than encode_varints() for a single small value
+	encoded = bytearray()
+	while value >= 0x80:
+		encoded.append((value & 0x7F) | 0x80)
+		value >>= 7
+	encoded.append(value)
+	return bytes(encoded)
+
+
+def _field_key(field_number: int, wire_type: int) -> int:
+	return (field_number << 3) | wire_type
+
+
+def _varint_length(values: np.ndarray) -> np.ndarray:
+	# number of bytes of each value once written as a varint
+	values = np.asarray(values).astype("u8")
+	length = np.ones(values.shape, dtype="u8")
+	for chunk_number in range(1, 10):
+		length += values >= np.uint64(1 << (7 * chunk_number))
+	return length